@@ -0,0 +1,97 @@
+import os
+import time
+import logging
+
+from broadcast import TokenBucket
+from db import DB_POOL_MAX
+from metrics import ADMISSION_THROTTLED
+
+logger = logging.getLogger(__name__)
+
+# Per-user budgets for the expensive callbacks: sustained taps per second and
+# the burst allowed on top (a rate of 0 disables the limit)
+ADMISSION_PURCHASE_RATE = float(os.environ.get('ADMISSION_PURCHASE_RATE', '0.5'))
+ADMISSION_PURCHASE_BURST = float(os.environ.get('ADMISSION_PURCHASE_BURST', '3'))
+ADMISSION_PAYMENT_RATE = float(os.environ.get('ADMISSION_PAYMENT_RATE', '0.2'))
+ADMISSION_PAYMENT_BURST = float(os.environ.get('ADMISSION_PAYMENT_BURST', '3'))
+# Guarded callbacks running at once, across all users (0 = no ceiling); more
+# than the pool can serve would only queue up waiting for a connection
+ADMISSION_MAX_INFLIGHT = int(os.environ.get('ADMISSION_MAX_INFLIGHT', str(2 * DB_POOL_MAX)))
+
+THROTTLED_TEXT = "⏳ Too many taps - please wait a moment."
+BUSY_TEXT = "⏳ The lottery is busy right now - please try again in a few seconds."
+
+
+# Admission control for callbacks that hit the database or the payment backend.
+# Each action has a token bucket per user, and all guarded actions share one
+# ceiling on how many run at once. A rejected tap is answered right away with
+# a short notice and never reaches the handler, so it costs one answerCallbackQuery
+# and no database work. Actions are handler names, as in the handler metrics.
+class AdmissionController:
+    def __init__(self, rules, max_inflight=ADMISSION_MAX_INFLIGHT):
+        # action -> (rate, burst)
+        self.rules = {action: rule for action, rule in rules.items() if rule[0] > 0}
+        self.guarded = set(rules)
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self._buckets = {}
+        self.admitted = 0
+        self.throttled_user = 0
+        self.throttled_global = 0
+
+    # None if the call may run, else the reason ('user' or 'global')
+    def check(self, action, user_id, now=None):
+        if self.max_inflight and self.inflight >= self.max_inflight:
+            return 'global'
+        rule = self.rules.get(action)
+        if rule is not None:
+            key = (action, user_id)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                self._prune()
+                bucket = self._buckets[key] = TokenBucket(*rule)
+            if bucket.reserve(now):
+                return 'user'
+        return None
+
+    # Router middleware; must run before the query is answered
+    async def middleware(self, route, update, context, call_next):
+        action = route.handler.__name__
+        if action not in self.guarded:
+            return await call_next()
+
+        query = update.callback_query
+        reason = self.check(action, query.from_user.id)
+        if reason is not None:
+            if reason == 'user':
+                self.throttled_user += 1
+            else:
+                self.throttled_global += 1
+            ADMISSION_THROTTLED.inc(action=action, reason=reason)
+            logger.debug(f"Admission: rejected {action} for user {query.from_user.id} ({reason})")
+            await query.answer(THROTTLED_TEXT if reason == 'user' else BUSY_TEXT)
+            return None
+
+        self.admitted += 1
+        self.inflight += 1
+        try:
+            return await call_next()
+        finally:
+            self.inflight -= 1
+
+    # Forget buckets that have refilled, so the table stays small
+    def _prune(self):
+        if len(self._buckets) < 10_000:
+            return
+        now = time.monotonic()
+        for key in [key for key, bucket in self._buckets.items() if bucket.idle(now)]:
+            del self._buckets[key]
+
+    def stats(self):
+        return {
+            'inflight': self.inflight,
+            'admitted': self.admitted,
+            'throttled_user': self.throttled_user,
+            'throttled_global': self.throttled_global,
+            'buckets': len(self._buckets),
+        }
@@ -0,0 +1,139 @@
+# Send a broadcast through the real Broadcaster and outbox against a stub Bot
+# that enforces Telegram's limits (30 msg/s per bot, 1 msg/s per chat) with
+# 429 RetryAfter errors, optionally injects random 429s, and can kill the
+# sender halfway to check that the broadcast resumes:
+#
+#   python -m benchmarks.broadcast_bench --chats 2000 --speedup 20 --inject-429 0.002 --crash-after 500
+#
+# --speedup scales every limit and delay so long runs finish quickly; the
+# report projects the time for 100k chats at real Telegram limits.
+import os
+import time
+import random
+import asyncio
+import logging
+import argparse
+from collections import Counter, deque
+
+from telegram.error import RetryAfter, Forbidden
+
+from broadcast import Broadcaster
+from repository import create_repository
+
+
+class StubBot:
+    def __init__(self, limit, chat_interval, retry_after, inject, blocked, latency, seed=1):
+        self.limit = limit
+        self.chat_interval = chat_interval
+        self.retry_after = retry_after
+        self.inject = inject
+        self.blocked = blocked
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.delivered = Counter()
+        self.rejected = 0
+        self._window = deque()
+        self._last_by_chat = {}
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        while self._window and now - self._window[0] >= 1.0:
+            self._window.popleft()
+        too_fast = (
+            len(self._window) >= self.limit
+            or now - self._last_by_chat.get(chat_id, -1e9) < self.chat_interval
+            or self.rng.random() < self.inject
+        )
+        if too_fast:
+            self.rejected += 1
+            raise RetryAfter(self.retry_after)
+        self._window.append(now)
+        self._last_by_chat[chat_id] = now
+        self.delivered[(chat_id, text)] += 1
+
+
+async def wait_until_done(repo, stub, crash_after=None):
+    while True:
+        counts = await repo.outbox_counts()
+        if not counts.get('queued') and not counts.get('sending'):
+            return counts
+        if crash_after is not None and sum(stub.delivered.values()) >= crash_after:
+            return None
+        await asyncio.sleep(0.05)
+
+
+async def bench(args):
+    repo = create_repository(args.database_url)
+    await repo.open()
+    await repo.migrate()
+
+    speed = args.speedup
+    blocked = set(range(1, args.chats + 1, max(1, int(1 / args.blocked)))) if args.blocked else set()
+    stub = StubBot(
+        limit=30 * speed, chat_interval=1.0 / speed, retry_after=args.retry_after / speed,
+        inject=args.inject_429, blocked=blocked, latency=args.latency / speed
+    )
+
+    def new_broadcaster():
+        return Broadcaster(
+            repo, rate=args.rate * speed, chat_rate=speed, batch_size=args.batch,
+            concurrency=args.concurrency, idle_interval=0.05
+        )
+
+    total = 0
+    for campaign in range(args.campaigns):
+        messages = [(chat_id, f"Draw results #{campaign} for chat {chat_id}") for chat_id in range(1, args.chats + 1)]
+        broadcaster = new_broadcaster()
+        total += await broadcaster.enqueue(f'bench-{os.getpid()}-{campaign}', messages)
+
+    started = time.perf_counter()
+    broadcaster = new_broadcaster()
+    await broadcaster.start(stub)
+    if args.crash_after:
+        await wait_until_done(repo, stub, args.crash_after)
+        # Simulated crash: the task dies mid-batch without recording anything
+        broadcaster._task.cancel()
+        print(f"Killed the sender after {sum(stub.delivered.values())} deliveries, restarting")
+        broadcaster = new_broadcaster()
+        await broadcaster.start(stub)
+    counts = await wait_until_done(repo, stub)
+    elapsed = time.perf_counter() - started
+    await broadcaster.stop()
+
+    delivered = sum(stub.delivered.values())
+    duplicates = sum(count - 1 for count in stub.delivered.values() if count > 1)
+    rate = len(stub.delivered) / elapsed
+    print(f"\nMessages queued:   {total}")
+    print(f"Outbox:            {counts}")
+    print(f"Delivered:         {delivered} ({duplicates} duplicates after the restart)")
+    print(f"429s from stub:    {stub.rejected}")
+    print(f"Elapsed:           {elapsed:.2f}s ({rate:.0f} msg/s at {speed}x, {rate / speed:.1f} msg/s real)")
+    print(f"100k chats at real limits: ~{100_000 / (rate / speed) / 60:.0f} minutes")
+    await repo.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Broadcast throughput under Telegram rate limits")
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL', 'sqlite://'))
+    parser.add_argument('--chats', type=int, default=2000)
+    parser.add_argument('--campaigns', type=int, default=1, help='messages per chat (tests the per-chat limit)')
+    parser.add_argument('--rate', type=float, default=25, help='sender rate at 1x (msg/s)')
+    parser.add_argument('--batch', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--speedup', type=float, default=20, help='scale limits and delays by this factor')
+    parser.add_argument('--latency', type=float, default=0.05, help='Bot API round trip at 1x (s)')
+    parser.add_argument('--retry-after', type=float, default=5, help='retry_after of injected 429s at 1x (s)')
+    parser.add_argument('--inject-429', type=float, default=0.0, help='share of sends rejected at random')
+    parser.add_argument('--blocked', type=float, default=0.0, help='share of chats that blocked the bot')
+    parser.add_argument('--crash-after', type=int, default=0, help='kill the sender after this many deliveries')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(bench(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# Simulate many users tapping at once and compare update latency with
+# sequential processing vs. PerUserUpdateProcessor; also checks that one
+# user's updates never overlap and finish in arrival order:
+#
+#   python -m benchmarks.concurrency_bench --users 1000 --concurrency 64
+import time
+import random
+import asyncio
+import argparse
+
+from telegram import Update, User, CallbackQuery
+from telegram.ext import SimpleUpdateProcessor
+
+from concurrency import PerUserUpdateProcessor
+
+
+def make_update(update_id, user_id, data):
+    user = User(id=user_id, first_name=f'User{user_id}', is_bot=False)
+    query = CallbackQuery(id=str(update_id), from_user=user, chat_instance=str(user_id), data=data)
+    return Update(update_id=update_id, callback_query=query)
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+async def simulate(processor, users, taps, duration, slow_share, seed):
+    rng = random.Random(seed)
+    latencies = []
+    running = {}
+    finished = {}
+    violations = 0
+
+    # Handler stand-in: mostly quick DB + API work, some slow payment checks
+    async def handle(update, arrived):
+        nonlocal violations
+        user_id = update.effective_user.id
+        if running.get(user_id):
+            violations += 1
+        running[user_id] = True
+        slow = update.callback_query.data.startswith('pay_')
+        await asyncio.sleep(rng.uniform(0.2, 0.4) if slow else rng.uniform(0.005, 0.03))
+        running[user_id] = False
+        if finished.get(user_id, -1) > update.update_id:
+            violations += 1
+        finished[user_id] = update.update_id
+        latencies.append(time.perf_counter() - arrived)
+
+    schedule = sorted(
+        (rng.uniform(0, duration), user_id)
+        for user_id in range(1, users + 1)
+        for _ in range(taps)
+    )
+
+    tasks = []
+    started = time.perf_counter()
+    for update_id, (at, user_id) in enumerate(schedule):
+        delay = at - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        data = 'pay_T' if rng.random() < slow_share else 'my_tickets'
+        update = make_update(update_id, user_id, data)
+        arrived = time.perf_counter()
+        tasks.append(asyncio.create_task(processor.process_update(update, handle(update, arrived))))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return len(latencies) / elapsed, latencies, violations
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Per-user concurrent update processing")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--taps', type=int, default=3, help='updates per user')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds over which taps arrive')
+    parser.add_argument('--slow-share', type=float, default=0.05, help='share of slow pay_ updates')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--skip-sequential', action='store_true')
+    args = parser.parse_args()
+
+    modes = [(f'per-user x{args.concurrency}', PerUserUpdateProcessor(args.concurrency))]
+    if not args.skip_sequential:
+        modes.insert(0, ('sequential', SimpleUpdateProcessor(1)))
+
+    print(f"{args.users} users x {args.taps} taps over {args.duration}s, {args.slow_share:.0%} slow")
+    ok = True
+    for name, processor in modes:
+        throughput, latencies, violations = await simulate(
+            processor, args.users, args.taps, args.duration, args.slow_share, seed=1
+        )
+        print(f"  {name:<16} {throughput:>8,.0f} updates/s  p50={percentile(latencies, 50) * 1000:>8.1f}ms  "
+              f"p99={percentile(latencies, 99) * 1000:>8.1f}ms  ordering violations={violations}")
+        if isinstance(processor, PerUserUpdateProcessor) and violations:
+            ok = False
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(asyncio.run(main()))
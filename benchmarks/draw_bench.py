@@ -0,0 +1,51 @@
+# Settle a synthetic round of N tickets with the vectorized draw engine:
+#
+#   python -m benchmarks.draw_bench --tickets 5000000
+import time
+import argparse
+
+import numpy as np
+
+from draw import settle, encode_many, MAX_NUMBER, PICK_COUNT
+
+
+def random_picks(rng, count):
+    # argsort of random keys gives uniform 6-of-42 picks without replacement
+    keys = rng.random((count, MAX_NUMBER), dtype=np.float32)
+    return np.argpartition(keys, PICK_COUNT, axis=1)[:, :PICK_COUNT] + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Draw settlement benchmark")
+    parser.add_argument('--tickets', type=int, default=2_000_000)
+    parser.add_argument('--chunk', type=int, default=500_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    started = time.perf_counter()
+    masks = np.concatenate([
+        encode_many(random_picks(rng, min(args.chunk, args.tickets - i)))
+        for i in range(0, args.tickets, args.chunk)
+    ])
+    bonuses = rng.integers(1, MAX_NUMBER + 1, size=args.tickets, dtype=np.int8)
+    generated = time.perf_counter() - started
+
+    numbers = sorted(rng.choice(np.arange(1, MAX_NUMBER + 1), PICK_COUNT, replace=False).tolist())
+    bonus = int(rng.integers(1, MAX_NUMBER + 1))
+
+    started = time.perf_counter()
+    result = settle(masks, bonuses, numbers, bonus)
+    elapsed = time.perf_counter() - started
+
+    print(f"generated {args.tickets:,} tickets in {generated:.2f}s")
+    print(f"settled   {result.tickets:,} tickets in {elapsed:.3f}s "
+          f"({result.tickets / elapsed / 1e6:.1f}M tickets/s)")
+    print(f"numbers={result.numbers} bonus={bonus} pool={result.pool / 1e9:,.0f} TON")
+    for name, count in result.winners.items():
+        print(f"  {name:>8}: {count:>9,} winners x {result.prize_per_ticket[name] / 1e9:,.4f} TON")
+    print(f"  rollover: {result.rollover / 1e9:,.2f} TON")
+
+
+if __name__ == '__main__':
+    main()
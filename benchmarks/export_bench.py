@@ -0,0 +1,144 @@
+# Export a large synthetic tickets table through export.export_tickets and
+# sample the process RSS after every chunk, to show memory stays flat:
+#
+#   python -m benchmarks.export_bench --rows 10000000 --format jsonl
+#   python -m benchmarks.export_bench --database-url postgresql://localhost/lotto_bench
+#
+# Seeds a temporary SQLite file by default; against Postgres it seeds a scratch
+# schema (bench_<pid>) with generate_series and drops it afterwards.
+import os
+import time
+import asyncio
+import logging
+import argparse
+import sqlite3
+import resource
+import tempfile
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+
+from export import export_tickets, EXPORT_FORMATS, EXPORT_CHUNK
+from repository import create_repository
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def seed_sqlite(path, rows):
+    conn = sqlite3.connect(path)
+    started = datetime(2026, 1, 3, 20)
+    conn.execute('''
+    WITH RECURSIVE seq(g) AS (SELECT 1 UNION ALL SELECT g + 1 FROM seq WHERE g < ?)
+    INSERT INTO tickets (user_id, username, numbers, bonus_number, ticket_id, batch_id,
+                         purchased_at, draw_round, payment_status)
+    SELECT g % 50000, 'user' || (g % 50000),
+           (g % 7 + 1) || ',' || (g % 5 + 9) || ',' || (g % 6 + 15) || ',' || (g % 4 + 22) || ',' ||
+           (g % 9 + 27) || ',' || (g % 6 + 37),
+           g % 42 + 1, 'EXPORT_' || g, 'EXPORT_' || g,
+           strftime('%Y-%m-%d %H:%M:%f', ?, '+' || (g % 604800) || ' seconds'),
+           ?, CASE WHEN g % 20 = 0 THEN 'pending' ELSE 'paid' END
+    FROM seq
+    ''', (rows, started.strftime('%Y-%m-%d %H:%M:%S'), (started + timedelta(days=7)).date().isoformat()))
+    conn.commit()
+    conn.close()
+
+
+def seed_postgres(database_url, rows):
+    conn = psycopg2.connect(database_url)
+    with conn.cursor() as cursor:
+        cursor.execute('''
+        INSERT INTO tickets (user_id, username, numbers, bonus_number, ticket_id, batch_id,
+                             purchased_at, draw_round, payment_status)
+        SELECT g % 50000, 'user' || (g % 50000),
+               ARRAY[g % 7 + 1, g % 5 + 9, g % 6 + 15, g % 4 + 22, g % 9 + 27, g % 6 + 37]::SMALLINT[],
+               g % 42 + 1, 'EXPORT_' || g, 'EXPORT_' || g,
+               TIMESTAMP '2026-01-03 20:00' + g % 604800 * INTERVAL '1 second',
+               DATE '2026-01-10', CASE WHEN g % 20 = 0 THEN 'pending' ELSE 'paid' END
+        FROM generate_series(1, %s) g
+        ''', (rows,))
+    conn.commit()
+    conn.close()
+
+
+async def migrate(database_url):
+    repo = create_repository(database_url)
+    await repo.open()
+    await repo.migrate()
+    await repo.close()
+
+
+async def bench(args, database_url, output):
+    repo = create_repository(database_url)
+    await repo.open()
+    samples = []
+    started = time.perf_counter()
+
+    def progress(written):
+        samples.append((written, rss_mb()))
+
+    baseline = rss_mb()
+    with open(output, 'wb') as file:
+        written = await export_tickets(repo, file, args.format, chunk_size=args.chunk_size, progress=progress)
+    elapsed = time.perf_counter() - started
+    await repo.close()
+
+    print(f"\nExported {written:,} rows as {args.format} in {elapsed:.1f}s ({written / elapsed:,.0f} rows/s), "
+          f"{os.path.getsize(output) / 2 ** 20:.0f} MB written")
+    print(f"RSS before: {baseline:.1f} MB")
+    step = max(1, len(samples) // 10)
+    for written, rss in samples[::step] + samples[-1:]:
+        print(f"  after {written:>12,} rows: {rss:7.1f} MB")
+    peak = max(rss for _, rss in samples) if samples else baseline
+    print(f"Peak during export: {peak:.1f} MB (+{peak - baseline:.1f} MB over the baseline)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory use of a streaming ticket export")
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL'),
+                        help='Postgres DSN (default: a temporary SQLite file)')
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl')
+    parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'export')
+        if not args.database_url:
+            database_url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+            asyncio.run(migrate(database_url))
+            started = time.perf_counter()
+            seed_sqlite(database_url[len('sqlite:///'):], args.rows)
+            print(f"Seeded {args.rows:,} tickets in {time.perf_counter() - started:.1f}s")
+            asyncio.run(bench(args, database_url, output))
+            return
+
+        schema = f'bench_{os.getpid()}'
+        admin = psycopg2.connect(args.database_url)
+        admin.autocommit = True
+        with admin.cursor() as cursor:
+            cursor.execute(f'CREATE SCHEMA {schema}')
+        try:
+            database_url = make_dsn(args.database_url, options=f'-csearch_path={schema}')
+            asyncio.run(migrate(database_url))
+            started = time.perf_counter()
+            seed_postgres(database_url, args.rows)
+            print(f"Seeded {args.rows:,} tickets in {time.perf_counter() - started:.1f}s")
+            asyncio.run(bench(args, database_url, output))
+        finally:
+            with admin.cursor() as cursor:
+                cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+            admin.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+# Drive the real bot.py handlers offline: updates go through the application
+# and PerUserUpdateProcessor as in production, Bot API calls hit a recording
+# fake instead of Telegram and payments come from the fake TON source.
+# Reports throughput and latency percentiles per flow, and Bot API calls per
+# flow (the fake rejects unchanged edits with "message is not modified", as
+# Telegram does):
+#
+#   python -m benchmarks.handler_bench --users 200 --rounds 6 --api-latency 0.03
+#   python -m benchmarks.handler_bench --database-url postgresql://localhost/lotto_bench
+#
+# Uses an in-memory SQLite repository by default; against Postgres it runs in
+# a scratch schema (bench_<pid>) that is dropped afterwards.
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from collections import Counter, defaultdict
+
+# Must be set before bot.py reads them at import time
+os.environ['TON_SOURCE'] = 'fake'
+os.environ.setdefault('METRICS_PORT', '0')
+os.environ.setdefault('PURCHASE_COOLDOWN', '0')
+os.environ.setdefault('ADMISSION_PURCHASE_RATE', '0')
+os.environ.setdefault('ADMISSION_PAYMENT_RATE', '0')
+os.environ.setdefault('ADMISSION_MAX_INFLIGHT', '0')
+os.environ.setdefault('PAYMENT_CHECK_INTERVAL', '3600')
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+from metrics import current_flow
+
+BOT_USER = {'id': 100000, 'is_bot': True, 'first_name': 'Lotto', 'username': 'lotto_bench_bot'}
+
+
+# Stand-in for the Bot API: answers every method with a plausible result,
+# counts calls per method and per (flow, method), and remembers the last
+# keyboard sent to each chat
+class FakeBotRequest(BaseRequest):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.flow_calls = Counter()
+        self.keyboards = {}
+        self.last_message = {}
+        self.contents = {}
+        self.not_modified = 0
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        self.calls[api_method] += 1
+        self.flow_calls[current_flow.get(), api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if api_method == 'getMe':
+            result = BOT_USER
+        elif api_method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params['chat_id'])
+            markup = params.get('reply_markup')
+            if isinstance(markup, str):
+                markup = json.loads(markup)
+            self.keyboards[chat_id] = markup
+            if api_method == 'sendMessage':
+                self._message_id += 1
+                message_id = self.last_message[chat_id] = self._message_id
+            else:
+                message_id = int(params['message_id'])
+            content = (params.get('text'), json.dumps(markup, sort_keys=True))
+            if api_method == 'editMessageText' and self.contents.get((chat_id, message_id)) == content:
+                self.not_modified += 1
+                return 400, json.dumps({
+                    'ok': False, 'error_code': 400,
+                    'description': 'Bad Request: message is not modified: specified new message content and '
+                                   'reply markup are exactly the same as a current content and reply markup of the message',
+                }).encode()
+            self.contents[chat_id, message_id] = content
+            result = {
+                'message_id': message_id, 'date': int(time.time()), 'from': BOT_USER,
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', ''),
+            }
+            if markup:
+                result['reply_markup'] = markup
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    # callback_data of the first button in the chat's last keyboard with this prefix
+    def button(self, chat_id, prefix):
+        markup = self.keyboards.get(chat_id) or {}
+        for row in markup.get('inline_keyboard', []):
+            for button in row:
+                data = button.get('callback_data', '')
+                if data.startswith(prefix):
+                    return data
+        return None
+
+
+class Driver:
+    def __init__(self, application, fake):
+        self.application = application
+        self.fake = fake
+        self.latencies = defaultdict(list)
+        self._update_id = 0
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+    async def _process(self, flow, data):
+        self._update_id += 1
+        data['update_id'] = self._update_id
+        update = Update.de_json(data, self.application.bot)
+        started = time.perf_counter()
+        await self.application.update_processor.process_update(
+            update, self.application.process_update(update)
+        )
+        self.latencies[flow].append(time.perf_counter() - started)
+
+    async def command(self, flow, user_id, text):
+        self._update_id += 1
+        await self._process(flow, {'message': {
+            'message_id': self._update_id, 'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'}, 'from': self._user(user_id), 'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}],
+        }})
+
+    async def tap(self, flow, user_id, callback_data):
+        await self._process(flow, {'callback_query': {
+            'id': f'{user_id}:{self._update_id}', 'from': self._user(user_id),
+            'chat_instance': str(user_id), 'data': callback_data,
+            'message': {
+                'message_id': self.fake.last_message[user_id], 'date': int(time.time()), 'from': BOT_USER,
+                'chat': {'id': user_id, 'type': 'private'}, 'text': '',
+            },
+        }})
+
+
+# Bot API calls per flow: calls per invocation of the flow, by method
+def report_calls(fake, counts):
+    flows = defaultdict(dict)
+    for (flow, method), calls in fake.flow_calls.items():
+        flows[flow][method] = calls
+    print(f"\n{'Bot API calls':<22}{'runs':>8}{'calls':>8}{'per run':>9}  by method")
+    for flow, methods in sorted(flows.items()):
+        total = sum(methods.values())
+        runs = counts.get(flow)
+        per_run = f"{total / runs:.2f}" if runs else '-'
+        print(f"{flow:<22}{runs or '-':>8}{total:>8}{per_run:>9}  "
+              + ', '.join(f"{method}={calls}" for method, calls in sorted(methods.items())))
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def report(title, latencies, elapsed):
+    print(f"\n{title} ({elapsed:.2f}s)")
+    print(f"{'flow':<18}{'count':>8}{'ops/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for flow, values in latencies.items():
+        values = sorted(values)
+        print(f"{flow:<18}{len(values):>8}{len(values) / elapsed:>10.0f}"
+              f"{percentile(values, 50) * 1000:>9.2f}{percentile(values, 95) * 1000:>9.2f}"
+              f"{percentile(values, 99) * 1000:>9.2f}{values[-1] * 1000:>9.2f}")
+
+
+async def run_phase(title, driver, users, concurrency, flow):
+    driver.latencies.clear()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(user_id):
+        async with limit:
+            await flow(user_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(user_id) for user_id in users))
+    report(title, dict(driver.latencies), time.perf_counter() - started)
+
+
+async def bench(args, bot):
+    fake = FakeBotRequest(args.api_latency)
+    application = (
+        Application.builder()
+        .token('123456:bench')
+        .request(fake)
+        .updater(None)
+        .concurrent_updates(bot.PerUserUpdateProcessor(args.concurrency))
+        .persistence(bot.persistence)
+        .build()
+    )
+    bot.register_handlers(application)
+    await application.initialize()
+    await bot.post_init(application)
+
+    driver = Driver(application, fake)
+    users = range(1, args.users + 1)
+    buy = f'buyn_{args.batch}' if args.batch > 1 else 'buy_ticket'
+    memos = {}
+
+    async def start_flow(user_id):
+        await driver.command('start', user_id, '/start')
+
+    async def purchase_flow(user_id):
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            await driver.tap('buy_ticket', user_id, buy)
+            confirm = fake.button(user_id, 'confirm_')
+            if confirm is None:
+                return
+            await driver.tap('confirm', user_id, confirm)
+            pay = fake.button(user_id, 'pay_')
+            if pay is None:
+                return
+            await driver.tap('process_payment', user_id, pay)
+            memos.setdefault(user_id, []).append(confirm[len('confirm_'):])
+        driver.latencies['purchase (e2e)'].append(time.perf_counter() - started)
+
+    async def tickets_flow(user_id):
+        await driver.tap('my_tickets', user_id, 'my_tickets')
+        for _ in range(args.pages):
+            older = fake.button(user_id, 'tickets_older_')
+            if older is None:
+                break
+            await driver.tap('my_tickets (page)', user_id, older)
+
+    # Menu round trip with every button tapped twice (a double tap, or a
+    # stale keyboard): the second tap would not change the message
+    async def menu_flow(user_id):
+        await driver.command('start', user_id, '/start')
+        for data in ('connect_wallet', 'connect_tonkeeper', 'connect_wallet', 'hot_numbers', 'back_to_main'):
+            await driver.tap(data, user_id, data)
+            await driver.tap(data, user_id, data)
+
+    try:
+        if not bot.repo.is_open:
+            raise SystemExit("Could not open the database")
+        await run_phase("Phase 1: /start", driver, users, args.concurrency, start_flow)
+        await run_phase("Phase 2: buy -> confirm -> pay", driver, users, args.concurrency, purchase_flow)
+
+        # Every memo gets paid on chain, then the verifier settles them in batches
+        for user_memos in memos.values():
+            for memo in user_memos:
+                bot.payment_ingestor.source.pay(memo, bot.payment_ingestor.price * args.batch)
+        driver.latencies.clear()
+        pending = len(bot.payment_verifier)
+        started = time.perf_counter()
+        while len(bot.payment_verifier):
+            pass_started = time.perf_counter()
+            if not await bot.payment_verifier.run_once():
+                break
+            driver.latencies['payment_check'].append(time.perf_counter() - pass_started)
+        elapsed = time.perf_counter() - started
+        report(f"Phase 3: verify {pending} payments ({pending / elapsed:.0f} memos/s settled)",
+               dict(driver.latencies), elapsed)
+        await bot.round_stats.refresh()
+        print("Round:", bot.round_stats.stats(), "hot:", bot.round_stats.ranked_numbers())
+
+        await run_phase("Phase 4: my_tickets + paging", driver, users, args.concurrency, tickets_flow)
+        await run_phase("Phase 5: menus, every button tapped twice", driver, users, args.concurrency, menu_flow)
+
+        print("\nBot API calls:", dict(fake.calls), f"(rejected as not modified: {fake.not_modified})")
+        runs = Counter()
+        for route in bot.callback_router.routes():
+            runs[route.handler.__name__] += route.calls
+        runs['start'] = 2 * len(users)
+        runs['payment_confirmed'] = sum(len(user_memos) for user_memos in memos.values())
+        report_calls(fake, runs)
+        purchase_flows = ('buy_ticket', 'confirm_purchase', 'process_payment', 'payment_confirmed')
+        purchase_calls = sum(calls for (flow, _), calls in fake.flow_calls.items() if flow in purchase_flows)
+        purchases = runs['payment_confirmed']
+        if purchases:
+            print(f"Bot API calls per purchase (buy -> confirm -> pay -> confirmed): {purchase_calls / purchases:.2f}")
+        print("Render:", bot.renderer.stats())
+        await application.update_persistence()
+        await bot.persistence.flush()
+        print("Persistence:", bot.persistence.stats())
+        print("Database:", bot.repo.stats())
+    finally:
+        await bot.post_stop(application)
+        await application.shutdown()
+        await bot.post_shutdown(application)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline handler benchmark")
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL', 'sqlite://'),
+                        help='sqlite:// URL or Postgres DSN (default: $BENCH_DATABASE_URL or in-memory SQLite)')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=6, help='purchases per user')
+    parser.add_argument('--batch', type=int, default=1, choices=(1, 5, 10, 25, 50), help='tickets per purchase')
+    parser.add_argument('--pages', type=int, default=2, help='"Older" pages opened per user')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--api-latency', type=float, default=0.0, help='simulated Bot API round trip (s)')
+    args = parser.parse_args()
+
+    if args.database_url.startswith('sqlite:'):
+        os.environ['DATABASE_URL'] = args.database_url
+        import bot
+        logging.getLogger().setLevel(logging.WARNING)
+        asyncio.run(bench(args, bot))
+        return 0
+
+    # Scratch schema so the run never touches real tickets
+    schema = f'bench_{os.getpid()}'
+    admin = psycopg2.connect(args.database_url)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f'CREATE SCHEMA {schema}')
+    os.environ['DATABASE_URL'] = make_dsn(args.database_url, options=f'-csearch_path={schema}')
+
+    import bot
+    logging.getLogger().setLevel(logging.WARNING)
+    try:
+        asyncio.run(bench(args, bot))
+    finally:
+        with admin.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+        admin.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
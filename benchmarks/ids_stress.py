@@ -0,0 +1,91 @@
+# Generate millions of ticket IDs across worker processes and check that
+# none collide and that each worker's IDs are strictly increasing:
+#
+#   python -m benchmarks.ids_stress --workers 8 --per-worker 1000000
+#
+# Each worker is set up like one webhook replica (WEBHOOK_SHARDS listing all
+# of them, its own SHARD_INDEX, no NODE_ID) and uses the default node id.
+import os
+import time
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+
+from ids import IdGenerator, MAX_NODE_ID, encode_id, decode_id
+
+
+def replica_env(index, replicas):
+    os.environ.pop('NODE_ID', None)
+    os.environ['WEBHOOK_SHARDS'] = ','.join(f'http://replica-{i}:8080' for i in range(replicas))
+    os.environ['SHARD_INDEX'] = str(index)
+
+
+def generate(args):
+    index, replicas, count = args
+    replica_env(index, replicas)
+    generator = IdGenerator()
+    ids = np.fromiter((generator.next_int() for _ in range(count)), dtype=np.int64, count=count)
+    return generator.node_id, ids
+
+
+# Node ids outside 0..MAX_NODE_ID must be rejected, not wrapped
+def out_of_range_rejected():
+    rejected = 0
+    for name, value in (('NODE_ID', MAX_NODE_ID + 1), ('SHARD_INDEX', MAX_NODE_ID + 1), ('NODE_ID', -1)):
+        replica_env(0, 2)
+        os.environ[name] = str(value)
+        try:
+            IdGenerator()
+        except ValueError:
+            rejected += 1
+        else:
+            print(f"{name}={value} was accepted")
+    os.environ.pop('NODE_ID', None)
+    return rejected == 3
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ticket ID collision stress test")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--per-worker', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with Pool(args.workers) as pool:
+        results = pool.map(generate, [(index, args.workers, args.per_worker) for index in range(args.workers)])
+    elapsed = time.perf_counter() - started
+
+    total = args.workers * args.per_worker
+    failures = 0
+    nodes = [node_id for node_id, _ in results]
+    if nodes != list(range(args.workers)):
+        print(f"default node ids {nodes} do not follow SHARD_INDEX")
+        failures += 1
+    if not out_of_range_rejected():
+        failures += 1
+    for node_id, ids in results:
+        if not np.all(np.diff(ids) > 0):
+            print(f"worker {node_id}: IDs are not strictly increasing")
+            failures += 1
+
+    unique = np.unique(np.concatenate([ids for _, ids in results])).size
+    if unique != total:
+        print(f"{total - unique} collisions")
+        failures += 1
+
+    # Encoding must round-trip and keep string order equal to numeric order
+    sample = np.sort(results[0][1][::max(1, args.per_worker // 10_000)])
+    encoded = [encode_id(int(value)) for value in sample]
+    if encoded != sorted(encoded) or [decode_id(e) for e in encoded] != sample.tolist():
+        print("encoded IDs do not round-trip in order")
+        failures += 1
+
+    print(f"{total:,} IDs from {args.workers} processes in {elapsed:.2f}s "
+          f"({total / elapsed / 1e6:.2f}M IDs/s), {unique:,} unique")
+    print("OK" if not failures else "FAILED")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,132 @@
+# Cost of one persistence pass with many known users, DatabasePersistence
+# against PTB's PicklePersistence (which rewrites the whole file on flush):
+#
+#   python -m benchmarks.persistence_bench --users 10000 1000000 --dirty 0.01
+#
+# Every user has a pending selection in user_data. A pass hands the library
+# the users touched since the last one (--dirty of them, half of which
+# actually changed) and flushes, as Application.update_persistence does.
+# The database side uses a temporary SQLite file, or with --database-url a
+# scratch Postgres schema (bench_<pid>) that is dropped afterwards.
+import os
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from datetime import datetime
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+from telegram.ext import PicklePersistence
+
+from persistence import DatabasePersistence, _encode
+from repository import create_repository
+
+
+def user_data(user_id, round_number=0):
+    batch_id = f'TONLOTO_{user_id:013d}'
+    return {
+        'pending_batch': {
+            'batch_id': batch_id,
+            'tickets': [{'ticket_id': batch_id, 'numbers': [3, 7, 12, 19, 33, 41], 'bonus': 5 + round_number % 5}],
+            'confirmed': False,
+        },
+        'ticket_summary': {'paid': 4, 'pending': 1},
+    }
+
+
+# Users touched in a pass: every other one picked a new selection
+def dirty_users(users, dirty, round_number):
+    step = max(1, int(1 / dirty))
+    touched = range(1, users + 1, step)
+    return [(user_id, user_data(user_id, round_number if i % 2 else 0)) for i, user_id in enumerate(touched)]
+
+
+async def timed_pass(persistence, touched):
+    started = time.perf_counter()
+    await asyncio.gather(*(persistence.update_user_data(user_id, data) for user_id, data in touched))
+    await persistence.flush()
+    return time.perf_counter() - started
+
+
+@contextmanager
+def scratch_database(database_url, path):
+    if not database_url:
+        yield f'sqlite:///{path}'
+        return
+    schema = f'bench_{os.getpid()}'
+    admin = psycopg2.connect(database_url)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f'CREATE SCHEMA {schema}')
+    try:
+        yield make_dsn(database_url, options=f'-csearch_path={schema}')
+    finally:
+        with admin.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+        admin.close()
+
+
+async def bench_database(args, users, database_url):
+    repo = create_repository(database_url)
+    await repo.open()
+    await repo.migrate()
+    now = datetime.now()
+    for first in range(1, users + 1, 10_000):
+        rows = [(user_id, _encode(user_data(user_id))) for user_id in range(first, min(first + 10_000, users + 1))]
+        await repo.save_context_data('user', rows, now)
+
+    # A fresh process: users are loaded when their next update arrives
+    persistence = DatabasePersistence(repo)
+    started = time.perf_counter()
+    for user_id, _ in dirty_users(users, args.dirty, 0):
+        await persistence.refresh_user_data(user_id, {})
+    load_time = time.perf_counter() - started
+
+    timings = [await timed_pass(persistence, dirty_users(users, args.dirty, round_number))
+               for round_number in range(1, args.passes + 1)]
+    stats = persistence.stats()
+    await repo.close()
+    return min(timings), load_time, stats
+
+
+async def bench_pickle(args, users, path):
+    persistence = PicklePersistence(path, on_flush=True)
+    for user_id in range(1, users + 1):
+        await persistence.update_user_data(user_id, user_data(user_id))
+    await persistence.flush()
+    timings = [await timed_pass(persistence, dirty_users(users, args.dirty, round_number))
+               for round_number in range(1, args.passes + 1)]
+    return min(timings), os.path.getsize(path)
+
+
+async def bench(args):
+    print(f"{'users':>10}{'dirty':>8}{'database ms':>14}{'pickle ms':>12}{'pickle file':>14}{'lazy load ms/user':>20}")
+    for users in args.users:
+        with tempfile.TemporaryDirectory() as directory:
+            with scratch_database(args.database_url, os.path.join(directory, 'bench.db')) as database_url:
+                database_ms, load_time, stats = await bench_database(args, users, database_url)
+            pickle_ms, size = await bench_pickle(args, users, os.path.join(directory, 'bench.pickle'))
+        touched = len(range(1, users + 1, max(1, int(1 / args.dirty))))
+        print(f"{users:>10}{touched:>8}{database_ms * 1000:>14.1f}{pickle_ms * 1000:>12.1f}"
+              f"{size / 2 ** 20:>12.1f}MB{load_time / touched * 1000:>20.3f}")
+        print(f"{'':>10}database persistence: {stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistence flush cost by number of users")
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL'),
+                        help='Postgres DSN (default: a temporary SQLite file)')
+    parser.add_argument('--users', type=int, nargs='+', default=[10_000, 1_000_000])
+    parser.add_argument('--dirty', type=float, default=0.01, help='share of users touched per pass')
+    parser.add_argument('--passes', type=int, default=3, help='passes per backend; the fastest is reported')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(bench(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# Throughput and uniformity checks for ticket and draw randomness:
+#
+#   python -m benchmarks.rng_bench --tickets 1000000 --draws 20000
+import math
+import time
+import random
+import argparse
+
+import numpy as np
+
+from rng import (MAX_NUMBER, PICK_COUNT, sample_tickets, new_seed, commitment,
+                 verify_commitment, draw_numbers)
+
+ALPHA = 0.001
+
+
+# Upper tail of the chi-square distribution (Wilson-Hilferty approximation)
+def chi_square_p(statistic, dof):
+    z = ((statistic / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def chi_square(observed, expected):
+    observed = np.asarray(observed, dtype=np.float64)
+    statistic = float(((observed - expected) ** 2 / expected).sum())
+    return chi_square_p(statistic, observed.size - 1)
+
+
+def report(name, ok, detail=''):
+    print(f"  {'PASS' if ok else 'FAIL'}  {name} {detail}")
+    return ok
+
+
+def throughput(tickets):
+    print("Throughput")
+    for batch in (1, 100, 10_000):
+        calls = max(1, min(tickets // batch, 20_000))
+        started = time.perf_counter()
+        for _ in range(calls):
+            sample_tickets(batch)
+        elapsed = time.perf_counter() - started
+        print(f"  sample_tickets({batch:>6}): {calls * batch / elapsed:>12,.0f} tickets/s")
+
+    count = min(tickets, 200_000)
+    started = time.perf_counter()
+    for _ in range(count):
+        sorted(random.sample(range(1, MAX_NUMBER + 1), PICK_COUNT))
+        random.randint(1, MAX_NUMBER)
+    elapsed = time.perf_counter() - started
+    print(f"  random.sample baseline:  {count / elapsed:>12,.0f} tickets/s")
+
+
+def ticket_uniformity(tickets):
+    print(f"Ticket uniformity ({tickets:,} tickets)")
+    picks, bonuses = sample_tickets(tickets)
+    ok = True
+
+    valid = (
+        picks.min() >= 1 and picks.max() <= MAX_NUMBER
+        and np.all(np.diff(picks, axis=1) > 0)
+    )
+    ok &= report('picks are sorted, distinct and in range', bool(valid))
+
+    counts = np.bincount(picks.ravel(), minlength=MAX_NUMBER + 1)[1:]
+    p = chi_square(counts, tickets * PICK_COUNT / MAX_NUMBER)
+    ok &= report('number frequencies', p > ALPHA, f"(p={p:.4f})")
+
+    first, second = np.triu_indices(PICK_COUNT, k=1)
+    a, b = picks[:, first].ravel() - 1, picks[:, second].ravel() - 1
+    pair_counts = np.bincount(a * MAX_NUMBER + b, minlength=MAX_NUMBER * MAX_NUMBER)
+    pairs = pair_counts.reshape(MAX_NUMBER, MAX_NUMBER)[np.triu_indices(MAX_NUMBER, k=1)]
+    p = chi_square(pairs, tickets * len(first) / len(pairs))
+    ok &= report('pair frequencies', p > ALPHA, f"(p={p:.4f})")
+
+    counts = np.bincount(bonuses, minlength=MAX_NUMBER + 1)[1:]
+    p = chi_square(counts, tickets / MAX_NUMBER)
+    ok &= report('bonus frequencies', p > ALPHA, f"(p={p:.4f})")
+    return ok
+
+
+def draw_checks(draws):
+    print(f"Commit-reveal draws ({draws:,} seeds)")
+    ok = True
+
+    seed = new_seed()
+    published = commitment(seed)
+    ok &= report('same seed and round give the same numbers',
+                 draw_numbers(seed, '2026-01-03') == draw_numbers(seed, '2026-01-03'))
+    ok &= report('commitment verifies', verify_commitment(seed, published))
+    tampered = ('0' if seed[0] != '0' else '1') + seed[1:]
+    ok &= report('tampered seed is rejected', not verify_commitment(tampered, published))
+
+    numbers = np.zeros(MAX_NUMBER + 1, dtype=np.int64)
+    bonuses = np.zeros(MAX_NUMBER + 1, dtype=np.int64)
+    started = time.perf_counter()
+    for i in range(draws):
+        picked, bonus = draw_numbers(new_seed(), i)
+        numbers[picked] += 1
+        bonuses[bonus] += 1
+    elapsed = time.perf_counter() - started
+
+    p = chi_square(numbers[1:], draws * PICK_COUNT / MAX_NUMBER)
+    ok &= report('drawn number frequencies', p > ALPHA, f"(p={p:.4f})")
+    p = chi_square(bonuses[1:], draws / MAX_NUMBER)
+    ok &= report('drawn bonus frequencies', p > ALPHA, f"(p={p:.4f})")
+    print(f"  {draws / elapsed:,.0f} draws/s")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RNG throughput and uniformity")
+    parser.add_argument('--tickets', type=int, default=1_000_000)
+    parser.add_argument('--draws', type=int, default=20_000)
+    args = parser.parse_args()
+
+    throughput(args.tickets)
+    ok = ticket_uniformity(args.tickets)
+    ok &= draw_checks(args.draws)
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,119 @@
+# Post synthetic Telegram Update JSON at a webhook receiver and report
+# throughput and latency percentiles. Point it at a running bot
+# (BOT_MODE=webhook) or use --serve to measure the receiver on its own:
+#
+#   python -m benchmarks.webhook_load --serve --requests 50000 --concurrency 64
+#   python -m benchmarks.webhook_load --url http://localhost:8080/telegram --secret s3cret
+import os
+import time
+import json
+import random
+import asyncio
+import argparse
+
+import httpx
+
+from webhook import WebhookServer, SECRET_HEADER
+
+CALLBACKS = ['buy_ticket', 'my_tickets', 'connect_wallet', 'back_to_main']
+
+
+def synthetic_update(update_id, users):
+    user_id = random.randint(1, users)
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+    chat = {'id': user_id, 'type': 'private'}
+    if random.random() < 0.3:
+        return {'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': user,
+            'text': '/start', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        }}
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'from': user, 'chat_instance': str(user_id),
+        'data': random.choice(CALLBACKS),
+        'message': {'message_id': 1, 'date': int(time.time()), 'chat': chat, 'text': 'menu'},
+    }}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+
+# Raw keep-alive HTTP/1.1 connections: a general-purpose client would be the
+# bottleneck long before the receiver is
+async def post_loop(host, port, path, secret, bodies, counter, latencies):
+    errors = 0
+    reader, writer = await asyncio.open_connection(host, port)
+    secret_line = f"{SECRET_HEADER}: {secret}\r\n" if secret else ''
+    try:
+        for i in counter:
+            body = bodies[i]
+            request = (
+                f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                f"{secret_line}Content-Length: {len(body)}\r\n\r\n"
+            ).encode() + body
+            started = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = 0
+            for line in head.split(b'\r\n'):
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            if length:
+                await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            if not head.startswith(b'HTTP/1.1 200'):
+                errors += 1
+    finally:
+        writer.close()
+    return errors
+
+
+async def run_load(url, secret, requests, concurrency, users):
+    target = httpx.URL(url)
+    bodies = [json.dumps(synthetic_update(i, users)).encode() for i in range(requests)]
+    latencies = []
+    counter = iter(range(requests))
+
+    started = time.perf_counter()
+    errors = sum(await asyncio.gather(*(
+        post_loop(target.host, target.port or 80, target.raw_path.decode(), secret, bodies, counter, latencies)
+        for _ in range(concurrency)
+    )))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"{requests:,} updates in {elapsed:.2f}s -> {requests / elapsed:,.0f} updates/s, {errors} errors")
+    print(f"latency p50={percentile(latencies, 50) * 1000:.2f}ms "
+          f"p95={percentile(latencies, 95) * 1000:.2f}ms p99={percentile(latencies, 99) * 1000:.2f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Webhook load generator")
+    parser.add_argument('--url', default='http://127.0.0.1:8080/telegram')
+    parser.add_argument('--secret', default=os.environ.get('WEBHOOK_SECRET', 'load-test'))
+    parser.add_argument('--requests', type=int, default=20_000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--users', type=int, default=1_000)
+    parser.add_argument('--serve', action='store_true', help='run a local receiver that discards updates')
+    args = parser.parse_args()
+
+    server = None
+    if args.serve:
+        received = asyncio.Queue()
+        server = WebhookServer(received.put, host='127.0.0.1', port=0, secret=args.secret)
+        await server.start()
+        port = server._server.sockets[0].getsockname()[1]
+        args.url = f'http://127.0.0.1:{port}{server.path}'
+
+    try:
+        await run_load(args.url, args.secret, args.requests, args.concurrency, args.users)
+    finally:
+        if server is not None:
+            await server.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,12 +1,44 @@
 import os
-import logging
-import random
-import psycopg2
+import re
+import signal
 import asyncio
-from datetime import datetime
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import logging
+import tempfile
+from functools import partial
+from datetime import datetime, timedelta
+from telegram import Update
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
 from dotenv import load_dotenv
+from db import DatabaseUnavailable
+from repository import create_repository
+from payments import PaymentVerifier
+from ton_ingest import PaymentIngestor, create_transaction_source
+from draw import next_draw_at, draw_time, draw_messages, commit_draw, reveal_draw, run_draw
+from ids import next_ticket_id
+from rng import sample_tickets
+from cache import TTLCache
+from webhook import WebhookServer, WEBHOOK_SECRET, SECRET_RE
+from broadcast import Broadcaster
+from persistence import DatabasePersistence
+from export import export_tickets, EXPORT_FORMATS, WRITERS
+from round_stats import RoundStats, ROUND_STATS_INTERVAL
+from render import (
+    Screen, MessageRenderer, BATCH_SIZES, EXPIRED_SELECTION_MESSAGE, EXPIRED_SELECTION,
+    CONNECT_WALLET, CONNECT_TONKEEPER, CONNECT_TONHUB, WALLET_CONNECTED, BUY_MULTIPLE,
+    CHECKING_PAYMENT, CHECKING_PAYMENT_AGAIN, NO_TICKETS, main_menu_screen, format_pool_line,
+    hot_numbers_screen, ticket_selection_screen, payment_instructions_screen,
+    payment_confirmed_screen, payment_not_received_screen, ticket_page_screen, draw_commitment_screen
+)
+from concurrency import PerUserUpdateProcessor, CONCURRENT_UPDATES
+from metrics import REGISTRY, EXPIRED_TICKETS, MetricsServer, InstrumentedRequest, instrumented
+from router import (
+    CallbackRouter, ticket_id_param, int_param, split_param,
+    answer_middleware, timing_middleware, cooldown_middleware
+)
+from admission import (
+    AdmissionController, ADMISSION_PURCHASE_RATE, ADMISSION_PURCHASE_BURST,
+    ADMISSION_PAYMENT_RATE, ADMISSION_PAYMENT_BURST
+)
 
 # Load environment variables
 load_dotenv()
@@ -21,281 +53,170 @@ logger = logging.getLogger(__name__)
 # TON Configuration - REPLACE WITH YOUR WALLET ADDRESS
 TON_WALLET_ADDRESS = os.environ.get('TON_WALLET_ADDRESS', 'UQDn-7fmd-goYxycJZuKBBkaBM2Hd8XJEVOqQyE_22892mXs')
 
-# Database connection
-def get_db_connection():
-    try:
-        database_url = os.environ.get('DATABASE_URL')
-        if not database_url:
-            logger.error("DATABASE_URL not found in environment variables")
-            return None
-        
-        conn = psycopg2.connect(database_url)
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        return None
+# Run mode: 'polling' (default, single replica) or 'webhook'
+BOT_MODE = os.environ.get('BOT_MODE', 'polling').lower()
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+# Webhook replicas: every replica lists all replica base URLs in the same order
+# and its own position in SHARD_INDEX; each user is handled by one replica
+WEBHOOK_SHARDS = [url.strip() for url in os.environ.get('WEBHOOK_SHARDS', '').split(',') if url.strip()]
+SHARD_INDEX = int(os.environ.get('SHARD_INDEX', '0'))
+
+# Telegram user ids allowed to run /export
+ADMIN_IDS = {int(user_id) for user_id in os.environ.get('ADMIN_IDS', '').split(',') if user_id.strip()}
+# Bots can upload files up to 50 MB; larger exports need the CLI (python export.py)
+EXPORT_UPLOAD_LIMIT = 50 * 1024 * 1024
+
+# Tickets shown per "My Tickets" page
+TICKETS_PAGE_SIZE = int(os.environ.get('TICKETS_PAGE_SIZE', '5'))
+EPOCH = datetime(1970, 1, 1)
+TICKET_CURSOR_RE = re.compile(r'^(newer|older)_[0-9a-z]+_[0-9a-z]+$')
 
-# Initialize database
-def init_db():
+# Seconds during which a repeated purchase tap by the same user is ignored
+PURCHASE_COOLDOWN = float(os.environ.get('PURCHASE_COOLDOWN', '1.0'))
+
+# Confirmed but unpaid tickets are deleted after PENDING_TICKET_TTL seconds by a
+# job that runs every PENDING_GC_INTERVAL seconds, PENDING_GC_BATCH memos per delete
+PENDING_TICKET_TTL = float(os.environ.get('PENDING_TICKET_TTL', str(24 * 3600)))
+PENDING_GC_INTERVAL = float(os.environ.get('PENDING_GC_INTERVAL', '600'))
+PENDING_GC_BATCH = int(os.environ.get('PENDING_GC_BATCH', '500'))
+# Seconds between ingestion passes on every replica, on top of the ones run
+# for due verifications, so no paid batch waits for the expiry job unseen
+PAYMENT_INGEST_INTERVAL = float(os.environ.get('PAYMENT_INGEST_INTERVAL', '300'))
+
+# Chat (e.g. a channel) that also gets each round's seed hash when it opens;
+# anyone can see it with /draw. Failed draw jobs retry after DRAW_RETRY_INTERVAL seconds
+DRAW_ANNOUNCE_CHAT_ID = int(os.environ['DRAW_ANNOUNCE_CHAT_ID']) if os.environ.get('DRAW_ANNOUNCE_CHAT_ID') else None
+DRAW_RETRY_INTERVAL = float(os.environ.get('DRAW_RETRY_INTERVAL', '60'))
+
+# Storage backend (Postgres pool, or SQLite for sqlite:// URLs) - opened in
+# post_init, closed in post_shutdown
+repo = create_repository(os.environ.get('DATABASE_URL'))
+
+# context.user_data (the pending selection) survives restarts; see persistence.py
+persistence = DatabasePersistence(repo)
+
+# Initialize database - apply pending schema migrations
+async def init_db():
     try:
-        conn = get_db_connection()
-        if conn is None:
-            logger.error("Could not connect to database")
-            return
-            
-        cursor = conn.cursor()
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tickets (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER,
-            username TEXT,
-            numbers TEXT,
-            bonus_number INTEGER,
-            ticket_id TEXT UNIQUE,
-            purchased_at TIMESTAMP,
-            payment_status TEXT DEFAULT 'pending',
-            wallet_connected BOOLEAN DEFAULT FALSE,
-            wallet_address TEXT
-        )
-        ''')
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            wallet_connected BOOLEAN DEFAULT FALSE,
-            wallet_address TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        conn.commit()
-        conn.close()
+        applied = await repo.migrate()
+        if applied:
+            logger.info(f"Applied database migrations: {applied}")
         logger.info("Database initialized successfully")
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
 
-# Generate lottery numbers
-def generate_numbers():
-    numbers = sorted(random.sample(range(1, 43), 6))
-    bonus = random.randint(1, 42)
-    return numbers, bonus
+# Generate lottery numbers (OS CSPRNG, `count` tickets per call)
+def generate_numbers(count=1):
+    picks, bonuses = sample_tickets(count)
+    return [(row.tolist(), int(bonus)) for row, bonus in zip(picks, bonuses)]
 
-# Generate unique ticket ID
+# Generate unique ticket ID (time-ordered, unique per NODE_ID)
 def generate_ticket_id():
-    return f"TONLOTO_{random.randint(100000, 999999)}_{int(datetime.now().timestamp())}"
+    return next_ticket_id()
+
+# Cached user profiles {'username', 'wallet_connected'} - written through on every change
+user_cache = TTLCache()
+
+# Live pool and number picks of the current round (see round_stats.py)
+round_stats = RoundStats(repo)
+
+# Main menu line with the live pool - read from the snapshot, no query
+def pool_line():
+    return format_pool_line(round_stats.pool_ton(), round_stats.snapshot.tickets)
+
+# Sends and edits bot messages from prebuilt screens; edits that would not
+# change a message are skipped (see render.py)
+renderer = MessageRenderer()
 
-# Check if user exists, create if not
-def ensure_user_exists(user_id, username):
+# Check if user exists, create if not (skipped while the cached username is current)
+async def ensure_user_exists(user_id, username):
+    username = username or 'Unknown'
+    profile = user_cache.get(user_id)
+    if profile is not None and profile['username'] == username:
+        return True
+    
     try:
-        conn = get_db_connection()
-        if conn is None:
-            return False
-            
-        cursor = conn.cursor()
-        cursor.execute('''
-        INSERT INTO users (user_id, username) 
-        VALUES (%s, %s)
-        ON CONFLICT (user_id) DO UPDATE SET username = EXCLUDED.username
-        ''', (user_id, username or 'Unknown'))
-        conn.commit()
-        conn.close()
+        wallet_connected = await repo.upsert_user(user_id, username)
+        user_cache.set(user_id, {'username': username, 'wallet_connected': wallet_connected})
         return True
     except Exception as e:
         logger.error(f"Error ensuring user exists: {e}")
         return False
 
-# Check TON payment (simplified for testing)
-async def check_ton_payment(ticket_id, user_id):
+# Wallet history ingestion - one pass settles every pending ticket it can match
+payment_ingestor = PaymentIngestor(
+    repo, create_transaction_source(TON_WALLET_ADDRESS), TON_WALLET_ADDRESS,
+    cursor_key=f"{TON_WALLET_ADDRESS}#{SHARD_INDEX}" if len(WEBHOOK_SHARDS) > 1 else None
+)
+
+# Check TON payments for a batch of tickets
+async def check_ton_payments(payments):
     try:
-        # Simulate payment verification
-        await asyncio.sleep(2)
+        await payment_ingestor.run_once()
         
-        # For testing, simulate success
-        return True
+        return await repo.paid_batches([payment.ticket_id for payment in payments])
         
     except Exception as e:
         logger.error(f"Payment check error: {e}")
-        return False
+        return set()
 
 # Check if user has wallet connected
-def check_wallet_connection(user_id):
+async def check_wallet_connection(user_id):
+    profile = user_cache.get(user_id)
+    if profile is not None:
+        return profile['wallet_connected']
+    
     try:
-        conn = get_db_connection()
-        if conn is None:
+        result = await repo.get_user(user_id)
+        if result is None:
             return False
-            
-        cursor = conn.cursor()
-        cursor.execute('SELECT wallet_connected FROM users WHERE user_id = %s', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
         
-        return result[0] if result else False
+        user_cache.set(user_id, {'username': result[0], 'wallet_connected': result[1]})
+        return result[1]
     except Exception as e:
         logger.error(f"Error checking wallet connection: {e}")
         return False
 
 # Start command
+@instrumented('start')
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     # Ensure user exists in database
-    ensure_user_exists(user.id, user.username)
-    
-    wallet_connected = check_wallet_connection(user.id)
+    await ensure_user_exists(user.id, user.username)
     
-    if wallet_connected:
-        keyboard = [
-            [InlineKeyboardButton("💰 Buy Ticket", callback_data='buy_ticket')],
-            [InlineKeyboardButton("🎫 My Tickets", callback_data='my_tickets')],
-            [InlineKeyboardButton("🔗 Wallet Settings", callback_data='connect_wallet')]
-        ]
-        wallet_status = "✅ Your wallet is connected!"
-    else:
-        keyboard = [
-            [InlineKeyboardButton("💰 Buy Ticket", callback_data='buy_ticket')],
-            [InlineKeyboardButton("🎫 My Tickets", callback_data='my_tickets')],
-            [InlineKeyboardButton("🔗 Connect Wallet", callback_data='connect_wallet')]
-        ]
-        wallet_status = "🔗 Connect your wallet to purchase tickets easily"
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    wallet_connected = await check_wallet_connection(user.id)
     
     logger.info(f"Received /start from user {user.id} ({user.username})")
     
-    welcome_text = f"Hi {user.mention_html()}! Welcome to TON Lottery! 🎰\n\n"
-    welcome_text += "🎫 Buy lottery tickets for 1 TON each\n"
-    welcome_text += "💰 80% of all ticket sales go to the prize pool!\n"
-    welcome_text += "🏆 Weekly draws every Saturday at 20:00 UTC\n\n"
-    welcome_text += wallet_status
-    
-    await update.message.reply_html(welcome_text, reply_markup=reply_markup)
+    screen = main_menu_screen(user.mention_html(), pool_line(), wallet_connected, welcome=True)
+    await renderer.reply(update.message, screen)
 
 # Handle button callbacks
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    
-    logger.info(f"Received callback: {query.data}")
-    
-    if query.data == 'buy_ticket':
-        await buy_ticket(update, context)
-    elif query.data == 'my_tickets':
-        await my_tickets(update, context)
-    elif query.data == 'connect_wallet':
-        await connect_wallet(update, context)
-    elif query.data == 'connect_tonkeeper':
-        await connect_tonkeeper(update, context)
-    elif query.data == 'connect_tonhub':
-        await connect_tonhub(update, context)
-    elif query.data == 'wallet_connected':
-        await wallet_connected(update, context)
-    elif query.data.startswith('confirm_'):
-        ticket_id = query.data.replace('confirm_', '')
-        await confirm_purchase(update, context, ticket_id)
-    elif query.data.startswith('pay_'):
-        ticket_id = query.data.replace('pay_', '')
-        await process_payment(update, context, ticket_id)
-    elif query.data.startswith('check_'):
-        ticket_id = query.data.replace('check_', '')
-        await check_payment_status(update, context, ticket_id)
-    elif query.data == 'back_to_main':
-        await start_callback(update, context)
+    # The query is answered by the router (see answer_middleware)
+    await callback_router.dispatch(update, context)
 
 # Start callback for back button
 async def start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user = query.from_user
     
-    wallet_connected = check_wallet_connection(user.id)
-    
-    if wallet_connected:
-        keyboard = [
-            [InlineKeyboardButton("💰 Buy Ticket", callback_data='buy_ticket')],
-            [InlineKeyboardButton("🎫 My Tickets", callback_data='my_tickets')],
-            [InlineKeyboardButton("🔗 Wallet Settings", callback_data='connect_wallet')]
-        ]
-        wallet_status = "✅ Your wallet is connected!"
-    else:
-        keyboard = [
-            [InlineKeyboardButton("💰 Buy Ticket", callback_data='buy_ticket')],
-            [InlineKeyboardButton("🎫 My Tickets", callback_data='my_tickets')],
-            [InlineKeyboardButton("🔗 Connect Wallet", callback_data='connect_wallet')]
-        ]
-        wallet_status = "🔗 Connect your wallet to purchase tickets easily"
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    welcome_text = f"Hi {user.mention_html()}! Welcome to TON Lottery! 🎰\n\n"
-    welcome_text += wallet_status
+    wallet_connected = await check_wallet_connection(user.id)
     
-    await query.edit_message_text(welcome_text, reply_markup=reply_markup, parse_mode='HTML')
+    await renderer.edit_query(query, main_menu_screen(user.mention_html(), pool_line(), wallet_connected))
 
 # Connect wallet handler
 async def connect_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    
-    keyboard = [
-        [InlineKeyboardButton("📱 Connect Tonkeeper", callback_data='connect_tonkeeper')],
-        [InlineKeyboardButton("📲 Connect Tonhub", callback_data='connect_tonhub')],
-        [InlineKeyboardButton("⬅️ Back", callback_data='back_to_main')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(
-        "🔗 Connect your TON wallet:\n\n"
-        "Select your wallet provider to connect. After connecting your wallet, "
-        "you'll be able to purchase tickets more easily!\n\n"
-        "💡 You can still buy tickets without connecting a wallet by sending TON manually.",
-        reply_markup=reply_markup
-    )
+    await renderer.edit_query(update.callback_query, CONNECT_WALLET)
 
 # Connect to Tonkeeper
 async def connect_tonkeeper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    
-    # Generate a simple connection explanation
-    connection_guide = (
-        "📱 **Connecting Tonkeeper:**\n\n"
-        "1. **Open Tonkeeper** on your phone\n"
-        "2. **Tap the Scan button** in the app\n"
-        "3. **Scan this QR code** (when we implement it)\n"
-        "4. **Confirm the connection** in your wallet\n\n"
-        "🔒 **Your wallet remains secure** - we only request basic access\n\n"
-        "For now, we're simulating the connection process. "
-        "Click 'I'm Connected' below to proceed."
-    )
-    
-    keyboard = [
-        [InlineKeyboardButton("✅ I'm Connected", callback_data='wallet_connected')],
-        [InlineKeyboardButton("⬅️ Back", callback_data='connect_wallet')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(connection_guide, reply_markup=reply_markup, parse_mode='Markdown')
+    await renderer.edit_query(update.callback_query, CONNECT_TONKEEPER)
 
 # Connect to Tonhub
 async def connect_tonhub(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    
-    # Generate a simple connection explanation
-    connection_guide = (
-        "📲 **Connecting Tonhub:**\n\n"
-        "1. **Open Tonhub** on your phone\n"
-        "2. **Go to Settings** → **Connected Apps**\n"
-        "3. **Tap 'Connect New App'**\n"
-        "4. **Scan this QR code** (when we implement it)\n"
-        "5. **Confirm the connection** in your wallet\n\n"
-        "🔒 **Your wallet remains secure** - we only request basic access\n\n"
-        "For now, we're simulating the connection process. "
-        "Click 'I'm Connected' below to proceed."
-    )
-    
-    keyboard = [
-        [InlineKeyboardButton("✅ I'm Connected", callback_data='wallet_connected')],
-        [InlineKeyboardButton("⬅️ Back", callback_data='connect_wallet')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(connection_guide, reply_markup=reply_markup, parse_mode='Markdown')
+    await renderer.edit_query(update.callback_query, CONNECT_TONHUB)
 
 # Handle wallet connected callback
 async def wallet_connected(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -304,290 +225,566 @@ async def wallet_connected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Save wallet connection to database
     try:
-        conn = get_db_connection()
-        if conn is None:
-            await query.edit_message_text("❌ Database error. Please try again.")
-            return
-            
-        cursor = conn.cursor()
-        cursor.execute('''
-        UPDATE users SET wallet_connected = TRUE 
-        WHERE user_id = %s
-        ''', (user.id,))
-        conn.commit()
-        conn.close()
+        await repo.set_wallet_connected(user.id)
+        user_cache.update(user.id, wallet_connected=True)
         
         logger.info(f"User {user.id} wallet connection recorded")
         
+    except DatabaseUnavailable:
+        await renderer.edit_query(query, Screen("❌ Database error. Please try again."))
+        return
     except Exception as e:
         logger.error(f"Error saving wallet connection: {e}")
-        await query.edit_message_text("❌ Error saving connection. Please try again.")
+        user_cache.invalidate(user.id)
+        await renderer.edit_query(query, Screen("❌ Error saving connection. Please try again."))
         return
     
-    keyboard = [
-        [InlineKeyboardButton("💰 Buy Ticket", callback_data='buy_ticket')],
-        [InlineKeyboardButton("🎫 My Tickets", callback_data='my_tickets')],
-        [InlineKeyboardButton("🔗 Wallet Settings", callback_data='connect_wallet')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    success_message = (
-        "✅ **Wallet Connected Successfully!**\n\n"
-        "Your TON wallet is now connected to your account.\n\n"
-        "🎉 **What you can do now:**\n"
-        "• Purchase lottery tickets seamlessly\n"
-        "• View your transaction history\n"
-        "• Participate in weekly draws\n\n"
-        "💰 **Next step:** Buy your first lottery ticket!"
+    await renderer.edit_query(query, WALLET_CONNECTED)
+
+# Most and least picked numbers of the current round, from the snapshot
+async def hot_numbers(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    screen = hot_numbers_screen(
+        round_stats.snapshot, round_stats.pool_ton(),
+        round_stats.ranked_numbers(hot=True), round_stats.ranked_numbers(hot=False)
     )
-    
-    await query.edit_message_text(success_message, reply_markup=reply_markup, parse_mode='Markdown')
+    await renderer.edit_query(update.callback_query, screen)
 
-# Buy ticket flow
-async def buy_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Buy multiple tickets - pick how many
+async def buy_multiple(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await renderer.edit_query(update.callback_query, BUY_MULTIPLE)
+
+# Buy ticket flow (count > 1 creates a batch paid with one memo)
+async def buy_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE, count=1):
     query = update.callback_query
     user = query.from_user
     
-    # Generate ticket numbers
-    numbers, bonus = generate_numbers()
-    ticket_id = generate_ticket_id()
-    
-    # Store in context for confirmation
-    context.user_data['pending_ticket'] = {
-        'numbers': numbers,
-        'bonus': bonus,
-        'ticket_id': ticket_id
+    # Generate ticket numbers; a single ticket's memo is its own ticket ID
+    batch_id = generate_ticket_id()
+    tickets = []
+    for i, (numbers, bonus) in enumerate(generate_numbers(count)):
+        ticket_id = batch_id if count == 1 else f"{batch_id}-{i + 1}"
+        tickets.append({'ticket_id': ticket_id, 'numbers': numbers, 'bonus': bonus})
+    
+    # Keep the selection in context only; rows are written on "Confirm Purchase"
+    context.user_data['pending_batch'] = {
+        'batch_id': batch_id,
+        'tickets': tickets,
+        'confirmed': False
     }
     
-    # Save to database with pending status
-    try:
-        conn = get_db_connection()
-        if conn is None:
-            await query.edit_message_text("❌ Database connection error. Please try again.")
-            return
-            
-        cursor = conn.cursor()
-        cursor.execute('''
-        INSERT INTO tickets (user_id, username, numbers, bonus_number, ticket_id, purchased_at)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        ''', (
-            user.id, 
-            user.username or 'Unknown', 
-            ','.join(map(str, numbers)), 
-            bonus, 
-            ticket_id,
-            datetime.now()
-        ))
-        conn.commit()
-        conn.close()
-        
-        logger.info(f"Ticket {ticket_id} created for user {user.id}")
-        
-    except Exception as e:
-        logger.error(f"Database error in buy_ticket: {e}")
-        await query.edit_message_text("❌ Error creating ticket. Please try again later.")
-        return
-    
-    keyboard = [
-        [InlineKeyboardButton("✅ Confirm Purchase", callback_data=f'confirm_{ticket_id}')],
-        [InlineKeyboardButton("❌ Cancel", callback_data='back_to_main')]
+    await renderer.edit_query(query, ticket_selection_screen(batch_id, tickets))
+
+# Number of tickets a memo pays for, 0 once the batch is gone. Always read
+# from the database: the expiry job deletes unpaid batches without touching
+# user_data, so a confirmed selection there may no longer exist
+async def batch_size(context, user_id, batch_id):
+    count = await repo.batch_size(batch_id, user_id)
+    pending = context.user_data.get('pending_batch')
+    if not count and pending and pending['batch_id'] == batch_id and pending['confirmed']:
+        # Expired: forget the selection so it isn't offered again
+        del context.user_data['pending_batch']
+    return count
+
+# Write a confirmed selection with pending status - one insert for the whole batch
+async def save_batch(user, pending):
+    batch_id = pending['batch_id']
+    purchased_at = datetime.now()
+    draw_round = next_draw_at().date()
+    rows = [
+        (user.id, user.username or 'Unknown', ticket['numbers'], ticket['bonus'],
+         ticket['ticket_id'], batch_id, purchased_at, draw_round)
+        for ticket in pending['tickets']
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    ticket_message = (
-        f"🎫 **Your Lottery Ticket**\n\n"
-        f"🔢 **Numbers:** {', '.join(map(str, numbers))}\n"
-        f"⭐ **Bonus:** {bonus}\n\n"
-        f"📋 **Ticket ID:** {ticket_id}\n"
-        f"💰 **Price:** 1 TON\n\n"
-        f"✅ **Confirm purchase?**"
-    )
+    await repo.insert_tickets(rows)
     
-    await query.edit_message_text(ticket_message, reply_markup=reply_markup, parse_mode='Markdown')
+    pending['confirmed'] = True
+    payment_ingestor.watch(batch_id, len(rows))
+    logger.info(f"Batch {batch_id} ({len(rows)} tickets) created for user {user.id}")
 
 # Confirm purchase
 async def confirm_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE, ticket_id):
     query = update.callback_query
     user = query.from_user
     
-    keyboard = [
-        [InlineKeyboardButton("💳 I've Paid", callback_data=f'pay_{ticket_id}')],
-        [InlineKeyboardButton("🔍 Check Payment", callback_data=f'check_{ticket_id}')],
-        [InlineKeyboardButton("⬅️ Back", callback_data='back_to_main')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    payment_instructions = (
-        f"💳 **Payment Instructions**\n\n"
-        f"Please send exactly **1 TON** to:\n"
-        f"`{TON_WALLET_ADDRESS}`\n\n"
-        f"📋 **Important Details:**\n"
-        f"• Amount: **1 TON** (exactly)\n"
-        f"• Network: **TON Blockchain**\n"
-        f"• Memo: **{ticket_id}** (include this!)\n"
-        f"• User ID: `{user.id}`\n\n"
-        f"⏱️ **After sending**, click 'I've Paid' below.\n"
-        f"🔄 Payment confirmation takes 2-3 minutes."
-    )
+    pending = context.user_data.get('pending_batch')
+    try:
+        if pending and pending['batch_id'] == ticket_id and not pending['confirmed']:
+            # Just written, so the selection is the batch
+            await save_batch(user, pending)
+            count = len(pending['tickets'])
+        else:
+            count = await batch_size(context, user.id, ticket_id)
+    except DatabaseUnavailable:
+        await renderer.edit_query(query, Screen("❌ Database connection error. Please try again."))
+        return
+    except Exception as e:
+        logger.error(f"Database error in confirm_purchase: {e}")
+        await renderer.edit_query(query, Screen("❌ Error creating ticket. Please try again later."))
+        return
     
-    await query.edit_message_text(payment_instructions, parse_mode='Markdown', reply_markup=reply_markup)
+    # Selection from an old keyboard that was never confirmed, or one that expired unpaid
+    if not count:
+        await renderer.edit_query(query, EXPIRED_SELECTION)
+        return
+    
+    await renderer.edit_query(query, payment_instructions_screen(ticket_id, count, user.id, TON_WALLET_ADDRESS))
 
 # Process payment
 async def process_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, ticket_id):
     query = update.callback_query
     user = query.from_user
-    await query.answer()
     
-    # Show waiting message
-    await query.edit_message_text(
-        "🔍 **Checking for payment...**\n\n"
-        "Please wait while we verify your transaction on the blockchain...\n"
-        "This usually takes 2-3 minutes.",
-        parse_mode='Markdown'
-    )
-    
-    # Check if payment was received
-    payment_received = await check_ton_payment(ticket_id, user.id)
+    # Queue the ticket; the verifier reports back when the payment shows up
+    count = await batch_size(context, user.id, ticket_id)
+    if not count:
+        await renderer.edit_query(query, Screen(EXPIRED_SELECTION_MESSAGE))
+        return
+    payment_verifier.submit(ticket_id, user.id, query.message.chat_id, query.message.message_id, count)
     
-    if payment_received:
-        # Update database
-        try:
-            conn = get_db_connection()
-            if conn is None:
-                await query.edit_message_text("❌ Database error. Please contact support.")
-                return
-                
-            cursor = conn.cursor()
-            cursor.execute('''
-            UPDATE tickets SET payment_status = 'paid' 
-            WHERE ticket_id = %s AND user_id = %s
-            ''', (ticket_id, user.id))
-            conn.commit()
-            
-            # Get ticket details
-            cursor.execute('SELECT numbers, bonus_number FROM tickets WHERE ticket_id = %s', (ticket_id,))
-            ticket = cursor.fetchone()
-            conn.close()
-            
-            if ticket:
-                numbers = ticket[0].split(',')
-                bonus = ticket[1]
-                
-                success_message = (
-                    f"✅ **Payment Confirmed!**\n\n"
-                    f"🎫 **Your Lottery Ticket:**\n"
-                    f"Numbers: {', '.join(numbers)}\n"
-                    f"Bonus: {bonus}\n\n"
-                    f"📋 **Ticket ID:** {ticket_id}\n\n"
-                    f"🎉 **Good luck!** The draw will be on Saturday at 20:00 UTC.\n\n"
-                    f"💰 **Prize pool:** 80% of all ticket sales!\n"
-                    f"🏆 **To win:** Match all 6 numbers + bonus"
-                )
-                
-                await query.edit_message_text(success_message, parse_mode='Markdown')
-        except Exception as e:
-            logger.error(f"Database error in process_payment: {e}")
-            await query.edit_message_text("❌ Error updating payment status. Please contact support.")
-    else:
-        keyboard = [
-            [InlineKeyboardButton("🔍 Check Again", callback_data=f'check_{ticket_id}')],
-            [InlineKeyboardButton("💳 Try Payment Again", callback_data=f'pay_{ticket_id}')],
-            [InlineKeyboardButton("⬅️ Back", callback_data='back_to_main')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        error_message = (
-            f"❌ **Payment Not Received Yet**\n\n"
-            f"Please verify:\n"
-            f"1. ✅ Sent exactly **1 TON**\n"
-            f"2. ✅ Used address: `{TON_WALLET_ADDRESS}`\n"
-            f"3. ✅ Included memo: `{ticket_id}`\n"
-            f"4. ⏱️ Wait 2-3 minutes for blockchain confirmation\n\n"
-            f"Click 'Check Again' after waiting."
-        )
-        
-        await query.edit_message_text(error_message, parse_mode='Markdown', reply_markup=reply_markup)
+    # Show waiting message
+    await renderer.edit_query(query, CHECKING_PAYMENT)
 
 # Check payment status
 async def check_payment_status(update: Update, context: ContextTypes.DEFAULT_TYPE, ticket_id):
     query = update.callback_query
     user = query.from_user
-    await query.answer()
     
-    await query.edit_message_text(
-        "🔍 **Checking for payment...**\n\n"
-        "Please wait while we verify your transaction...",
-        parse_mode='Markdown'
-    )
+    count = await batch_size(context, user.id, ticket_id)
+    if not count:
+        await renderer.edit_query(query, Screen(EXPIRED_SELECTION_MESSAGE))
+        return
+    payment_verifier.submit(ticket_id, user.id, query.message.chat_id, query.message.message_id, count)
     
-    payment_received = await check_ton_payment(ticket_id, user.id)
+    await renderer.edit_query(query, CHECKING_PAYMENT_AGAIN)
+
+# Payment found (the ingestor already marked the batch paid) - show it to the user
+async def payment_confirmed(bot, payment):
+    try:
+        rows = await repo.batch_tickets(payment.ticket_id, payment.user_id)
+    except DatabaseUnavailable:
+        await renderer.edit(bot, payment.chat_id, payment.message_id, Screen("❌ Database error. Please contact support."))
+        return
+    except Exception as e:
+        logger.error(f"Database error in payment_confirmed: {e}")
+        await renderer.edit(
+            bot, payment.chat_id, payment.message_id,
+            Screen("❌ Error updating payment status. Please contact support.")
+        )
+        return
     
-    if payment_received:
-        await process_payment(update, context, ticket_id)
+    if rows:
+        tickets = [{'ticket_id': row[0], 'numbers': row[1], 'bonus': row[2]} for row in rows]
+        await renderer.edit(bot, payment.chat_id, payment.message_id, payment_confirmed_screen(payment.ticket_id, tickets))
+
+# Verifier gave up - let the user check again later
+async def payment_not_received(bot, payment):
+    screen = payment_not_received_screen(payment.ticket_id, payment.tickets, TON_WALLET_ADDRESS)
+    await renderer.edit(bot, payment.chat_id, payment.message_id, screen)
+
+# Background verification scheduler (started in post_init)
+payment_verifier = PaymentVerifier(check_ton_payments, payment_confirmed, payment_not_received)
+
+# Rate-limited sender for messages outside a user's own callback (first replica only)
+broadcaster = Broadcaster(repo)
+
+# Queue the weekly result for every ticket holder of a settled round (see settle_round)
+async def announce_draw(draw_at, user_ids, result):
+    messages = draw_messages(draw_at, user_ids, result)
+    return await broadcaster.enqueue(f"draw:{draw_at:%Y-%m-%d}", messages, parse_mode='Markdown')
+
+# The open round's commitment and the previous round's revealed seed, or None
+# while the open round has no commitment yet
+async def draw_commitment(draw_at):
+    draw = await repo.get_draw(draw_at.date())
+    if draw is None:
+        return None
+    previous_round = (draw_at - timedelta(days=7)).date()
+    previous = await repo.get_draw(previous_round)
+    if previous is not None and previous[2] is not None:
+        previous = (previous_round, *previous)
     else:
-        keyboard = [
-            [InlineKeyboardButton("🔍 Check Again", callback_data=f'check_{ticket_id}')],
-            [InlineKeyboardButton("💳 Try Payment Again", callback_data=f'pay_{ticket_id}')],
-            [InlineKeyboardButton("⬅️ Back", callback_data='back_to_main')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            "❌ **Payment Not Confirmed Yet**\n\n"
-            "Please wait a few more minutes for blockchain confirmation.\n"
-            "If you've sent the payment, it should be confirmed soon.",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
+        previous = None
+    return draw_commitment_screen(draw_at, draw[0], previous)
+
+# Reveal a round's seed, score its tickets and queue the results. The round is
+# marked settled only once they are queued; queueing again sends nothing twice
+async def settle_round(draw_round):
+    draw_at = draw_time(draw_round)
+    _seed, numbers, bonus = await reveal_draw(repo, draw_round)
+    _ticket_ids, user_ids, result = await run_draw(repo, draw_at, numbers, bonus)
+    await announce_draw(draw_at, user_ids, result)
+    await repo.mark_draw_settled(draw_round, datetime.now())
+
+# Commit the open round's seed and announce its hash
+async def open_round(draw_at):
+    seed_hash = await commit_draw(repo, draw_at.date())
+    logger.info(f"Draw {draw_at:%Y-%m-%d} committed: seed hash {seed_hash}")
+    if DRAW_ANNOUNCE_CHAT_ID is not None:
+        screen = await draw_commitment(draw_at)
+        await broadcaster.enqueue(
+            f"commit:{draw_at:%Y-%m-%d}", [(DRAW_ANNOUNCE_CHAT_ID, screen.text)], parse_mode=screen.parse_mode
         )
 
-# View user's tickets
-async def my_tickets(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Draw job (first replica only): runs at startup and again at every draw time.
+# It settles each committed round whose draw time has passed, then commits the
+# round now open, so its hash is public before any ticket of it is drawn.
+# Every step is idempotent; a failed run is retried and repeats what is missing.
+async def draw_job(context: ContextTypes.DEFAULT_TYPE):
+    draw_at = next_draw_at()
+    try:
+        for draw_round in await repo.unsettled_draws(draw_at.date()):
+            await settle_round(draw_round)
+        await open_round(draw_at)
+    except Exception as e:
+        logger.error(f"Draw job failed, retrying in {DRAW_RETRY_INTERVAL:.0f}s: {e}")
+        context.job_queue.run_once(draw_job, DRAW_RETRY_INTERVAL, name='draw')
+        return
+    context.job_queue.run_once(draw_job, draw_at, name='draw')
+
+# Round stats job: reload the current round's counters into the snapshot
+async def refresh_round_stats(context: ContextTypes.DEFAULT_TYPE):
+    await round_stats.refresh()
+
+# Ingestion job: settle batches paid on chain even when no verification is due
+async def ingest_payments(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await payment_ingestor.run_once()
+    except Exception as e:
+        logger.error(f"Payment ingestion pass failed: {e}")
+
+# Expiry job: delete unpaid batches older than PENDING_TICKET_TTL in bounded
+# deletes, so no single statement holds locks on a large part of the table.
+# An ingestion pass runs first, so a batch paid on chain but never checked
+# is marked paid (and kept) instead of being deleted with its payment
+async def expire_pending_tickets(context: ContextTypes.DEFAULT_TYPE):
+    cutoff = datetime.now() - timedelta(seconds=PENDING_TICKET_TTL)
+    try:
+        await payment_ingestor.run_once()
+    except Exception as e:
+        logger.error(f"Payment ingestion failed, pending tickets not expired: {e}")
+        return 0
+    
+    batches = tickets = 0
+    try:
+        while True:
+            expired, deleted = await repo.expire_pending(cutoff, PENDING_GC_BATCH)
+            for batch_id in expired:
+                payment_ingestor.unwatch(batch_id)
+            batches += len(expired)
+            tickets += deleted
+            if len(expired) < PENDING_GC_BATCH:
+                break
+            await asyncio.sleep(0)
+    except Exception as e:
+        logger.error(f"Pending ticket expiry failed: {e}")
+    
+    if tickets:
+        EXPIRED_TICKETS.inc(tickets)
+        logger.info(f"Expired {tickets} unpaid tickets in {batches} batches (purchased before {cutoff:%Y-%m-%d %H:%M})")
+    return tickets
+
+# Keyset cursor for ticket pages: "<purchased_at in µs>_<id>", both base 36
+def encode_ticket_cursor(purchased_at, row_id):
+    micros = (purchased_at - EPOCH) // timedelta(microseconds=1)
+    return f"{to_base36(micros)}_{to_base36(row_id)}"
+
+def decode_ticket_cursor(cursor):
+    micros, row_id = cursor.split('_')
+    return EPOCH + timedelta(microseconds=int(micros, 36)), int(row_id, 36)
+
+def to_base36(n):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    encoded = ''
+    while True:
+        n, rest = divmod(n, 36)
+        encoded = digits[rest] + encoded
+        if n == 0:
+            return encoded
+
+# Ticket counts by status, shown above every page
+async def ticket_summary(user_id):
+    return await repo.ticket_summary(user_id)
+
+# One page of tickets around a cursor: 'older' pages go back in time, 'newer' forward
+async def ticket_page(user_id, direction=None, cursor=None):
+    if cursor is None:
+        rows = await repo.ticket_page(user_id, TICKETS_PAGE_SIZE + 1)
+        return rows[:TICKETS_PAGE_SIZE], False, len(rows) > TICKETS_PAGE_SIZE
+
+    position = decode_ticket_cursor(cursor)
+    if direction == 'older':
+        rows = await repo.ticket_page(user_id, TICKETS_PAGE_SIZE + 1, before=position)
+        return rows[:TICKETS_PAGE_SIZE], True, len(rows) > TICKETS_PAGE_SIZE
+
+    rows = await repo.ticket_page(user_id, TICKETS_PAGE_SIZE + 1, after=position)
+    page = list(reversed(rows[:TICKETS_PAGE_SIZE]))
+    return page, len(rows) > TICKETS_PAGE_SIZE, True
+
+# View user's tickets (one page at a time)
+async def my_tickets(update: Update, context: ContextTypes.DEFAULT_TYPE, direction=None, cursor=None):
     query = update.callback_query
     user = query.from_user
-    await query.answer()
+    
+    # Opening the view sends a new message; paging edits it in place
+    if direction is None:
+        send = partial(renderer.reply, query.message)
+    else:
+        send = partial(renderer.edit_query, query)
     
     try:
-        conn = get_db_connection()
-        if conn is None:
-            await query.message.reply_text("❌ Database error. Please try again.")
-            return
-            
-        cursor = conn.cursor()
-        cursor.execute('''
-        SELECT ticket_id, numbers, bonus_number, purchased_at, payment_status 
-        FROM tickets WHERE user_id = %s ORDER BY purchased_at DESC
-        ''', (user.id,))
+        # Counts are taken when the view opens and reused while paging
+        summary = context.user_data.get('ticket_summary')
+        if direction is None or summary is None:
+            summary = await ticket_summary(user.id)
+            context.user_data['ticket_summary'] = summary
         
-        tickets = cursor.fetchall()
-        conn.close()
+        tickets, has_newer, has_older = await ticket_page(user.id, direction, cursor)
         
         if not tickets:
-            await query.message.reply_text("You don't have any tickets yet. Buy your first ticket!")
+            await send(NO_TICKETS)
             return
         
-        message = "🎫 **Your Tickets**\n\n"
-        for ticket in tickets:
-            status = "✅ Paid" if ticket[4] == 'paid' else "⏳ Pending"
-            message += (
-                f"📋 **ID:** {ticket[0]}\n"
-                f"🔢 **Numbers:** {ticket[1]} + {ticket[2]}\n"
-                f"📅 **Purchased:** {ticket[3].strftime('%Y-%m-%d %H:%M')}\n"
-                f"📊 **Status:** {status}\n\n"
-            )
+        newer = older = None
+        if has_newer:
+            first = tickets[0]
+            newer = f'tickets_newer_{encode_ticket_cursor(first[4], first[0])}'
+        if has_older:
+            last = tickets[-1]
+            older = f'tickets_older_{encode_ticket_cursor(last[4], last[0])}'
         
-        keyboard = [[InlineKeyboardButton("⬅️ Back", callback_data='back_to_main')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+        await send(ticket_page_screen(summary, tickets, newer, older))
+    except DatabaseUnavailable:
+        await renderer.reply(query.message, Screen("❌ Database error. Please try again."))
     except Exception as e:
         logger.error(f"Error fetching tickets: {e}")
-        await query.message.reply_text("❌ Error retrieving your tickets. Please try again.")
+        await renderer.reply(query.message, Screen("❌ Error retrieving your tickets. Please try again."))
+
+# Open the connection pool once the event loop is running
+async def post_init(application: Application):
+    try:
+        await repo.open()
+    except Exception as e:
+        logger.error(f"Database connection error: {e}")
+    else:
+        await init_db()
+    await payment_verifier.start(application.bot)
+    if repo.is_open and SHARD_INDEX == 0:
+        await broadcaster.start(application.bot)
+    if repo.is_open:
+        await round_stats.refresh()
+    
+    if application.job_queue is None:
+        logger.warning("Job queue unavailable (install python-telegram-bot[job-queue]); pending tickets won't expire, "
+                       "the prize pool won't update and no draws will run")
+    else:
+        # Every replica keeps its own round snapshot and ingests its own batches
+        application.job_queue.run_repeating(
+            refresh_round_stats, interval=ROUND_STATS_INTERVAL, first=ROUND_STATS_INTERVAL, name='refresh_round_stats'
+        )
+        application.job_queue.run_repeating(
+            ingest_payments, interval=PAYMENT_INGEST_INTERVAL, first=PAYMENT_INGEST_INTERVAL, name='ingest_payments'
+        )
+        # Expiry runs on one replica; deletes are idempotent, so this is only to save work.
+        # So do the draws: the results go out through the first replica's broadcaster
+        if SHARD_INDEX == 0:
+            application.job_queue.run_repeating(
+                expire_pending_tickets, interval=PENDING_GC_INTERVAL, first=60, name='expire_pending_tickets'
+            )
+            application.job_queue.run_once(draw_job, 0, name='draw')
+    
+    REGISTRY.stats('lotto_db', 'Database backend state', repo.stats)
+    REGISTRY.stats('lotto_user_cache', 'User profile cache', user_cache.stats)
+    REGISTRY.stats('lotto_updates', 'Update processor state', application.update_processor.stats)
+    REGISTRY.stats('lotto_payments', 'Payment verifier queue', lambda: {'pending': len(payment_verifier)})
+    REGISTRY.stats('lotto_broadcast', 'Broadcast sender', broadcaster.stats)
+    REGISTRY.stats('lotto_round', 'Current round snapshot', round_stats.stats)
+    REGISTRY.stats('lotto_render', 'Messages sent and edited (skipped = unchanged, no API call)', renderer.stats)
+    if application.persistence is not None:
+        REGISTRY.stats('lotto_persistence', 'Persisted user/chat data', application.persistence.stats)
+    REGISTRY.stats('lotto_admission', 'Admission control for purchases and payment checks', admission.stats)
+    REGISTRY.stats('lotto_callbacks', 'Callbacks without a valid route', lambda: {
+        'invalid': callback_router.invalid, 'unmatched': callback_router.unmatched
+    })
+    await metrics_server.start()
+
+# Stop background work once no more updates are processed
+async def post_stop(application: Application):
+    await metrics_server.stop()
+    await payment_verifier.stop()
+    await broadcaster.stop()
+    await payment_ingestor.source.close()
+
+# Release pooled connections last: application.shutdown() runs before this and
+# writes the final user data through the still open repository
+async def post_shutdown(application: Application):
+    await repo.close()
+    logger.info(f"User cache: {user_cache.stats()}")
+
+# Per-user budgets for purchases and payment checks plus a global ceiling on
+# how many of them run at once (see admission.py)
+admission = AdmissionController({
+    'buy_ticket': (ADMISSION_PURCHASE_RATE, ADMISSION_PURCHASE_BURST),
+    'process_payment': (ADMISSION_PAYMENT_RATE, ADMISSION_PAYMENT_BURST),
+    'check_payment_status': (ADMISSION_PAYMENT_RATE, ADMISSION_PAYMENT_BURST),
+})
+
+# Callback routes (see router.py); admission control runs first so rejected taps
+# are answered with a notice. Purchases also get a short per-user cooldown so
+# a double tap doesn't create two batches
+callback_router = CallbackRouter(middleware=[admission.middleware, answer_middleware, timing_middleware])
+purchase_cooldown = cooldown_middleware(PURCHASE_COOLDOWN)
+
+callback_router.exact('buy_ticket', buy_ticket, middleware=[purchase_cooldown])
+callback_router.exact('buy_multiple', buy_multiple)
+callback_router.prefix('buyn_', buy_ticket, int_param(BATCH_SIZES), middleware=[purchase_cooldown])
+callback_router.exact('my_tickets', my_tickets)
+callback_router.exact('hot_numbers', hot_numbers)
+callback_router.prefix('tickets_', my_tickets, split_param('_', 2, TICKET_CURSOR_RE))
+callback_router.exact('connect_wallet', connect_wallet)
+callback_router.exact('connect_tonkeeper', connect_tonkeeper)
+callback_router.exact('connect_tonhub', connect_tonhub)
+callback_router.exact('wallet_connected', wallet_connected)
+callback_router.prefix('confirm_', confirm_purchase, ticket_id_param)
+callback_router.prefix('pay_', process_payment, ticket_id_param)
+callback_router.prefix('check_', check_payment_status, ticket_id_param)
+callback_router.exact('back_to_main', start_callback)
+
+# Prometheus scrape endpoint (METRICS_PORT, local only by default)
+metrics_server = MetricsServer()
+
+EXPORT_USAGE = (
+    "Usage: /export <round YYYY-MM-DD | from YYYY-MM-DD to YYYY-MM-DD> [csv|jsonl] [paid|pending]\n"
+    "A single date is a draw round; a date range is by purchase date (both days included)."
+)
+
+# Admin export of tickets for reconciliation - streamed to a temporary file and
+# sent as a document. Non-admins get no answer at all.
+@instrumented('export')
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        logger.warning(f"Ignored /export from non-admin user {user.id}")
+        return
+    
+    fmt, status, dates = 'csv', None, []
+    try:
+        for arg in context.args:
+            if arg in EXPORT_FORMATS:
+                fmt = arg
+            elif arg in ('paid', 'pending'):
+                status = arg
+            elif arg not in ('round', 'from', 'to'):
+                dates.append(datetime.strptime(arg, '%Y-%m-%d'))
+        if len(dates) not in (1, 2):
+            raise ValueError("expected one or two dates")
+    except ValueError:
+        await update.message.reply_text(EXPORT_USAGE)
+        return
+    
+    if len(dates) == 1:
+        draw_round, since, until = dates[0].date(), None, None
+        label = f"round-{draw_round}"
+    else:
+        draw_round, since, until = None, min(dates), max(dates) + timedelta(days=1)
+        label = f"{since:%Y-%m-%d}_{max(dates):%Y-%m-%d}"
+    if status:
+        label += f"-{status}"
+    
+    try:
+        with tempfile.TemporaryFile() as file:
+            count = await export_tickets(repo, file, fmt, draw_round, since, until, status)
+            size = file.tell()
+            if size > EXPORT_UPLOAD_LIMIT:
+                await update.message.reply_text(
+                    f"❌ The export has {count:,} tickets ({size / 2 ** 20:.0f} MB), over Telegram's upload limit. "
+                    f"Use the CLI: python export.py --help"
+                )
+                return
+            file.seek(0)
+            await update.message.reply_document(
+                document=file, filename=f"tickets-{label}{WRITERS[fmt].suffix}", caption=f"📤 {count:,} tickets"
+            )
+    except DatabaseUnavailable:
+        await update.message.reply_text("❌ Database connection error. Please try again.")
+    except Exception as e:
+        logger.error(f"Export failed: {e}")
+        await update.message.reply_text("❌ Export failed. Check the logs.")
+
+# Show the open round's seed hash and the last revealed seed
+@instrumented('draw')
+async def draw_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        screen = await draw_commitment(next_draw_at())
+    except DatabaseUnavailable:
+        await update.message.reply_text("❌ Database connection error. Please try again.")
+        return
+    except Exception as e:
+        logger.error(f"Error loading draw commitment: {e}")
+        await update.message.reply_text("❌ Error loading the draw. Please try again.")
+        return
+    
+    if screen is None:
+        await update.message.reply_text("🔐 The next draw isn't committed yet. Please try again in a minute.")
+        return
+    await renderer.reply(update.message, screen)
 
 # Error handler
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(msg="Exception while handling an update:", exc_info=context.error)
 
-# Main function - SIMPLIFIED FOR RAILWAY (ONLY POLLING)
+# Webhook mode - our own HTTP receiver feeds the application's update queue
+async def run_webhook(application: Application):
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+    
+    async def enqueue(update_data):
+        await application.update_queue.put(Update.de_json(update_data, application.bot))
+    
+    server = WebhookServer(
+        enqueue,
+        port=int(os.environ.get('PORT', '8080')),
+        shard_urls=WEBHOOK_SHARDS,
+        shard_index=SHARD_INDEX
+    )
+    await server.start()
+    REGISTRY.stats('lotto_webhook', 'Webhook receiver counters', lambda: {
+        'received': server.received, 'forwarded': server.forwarded, 'rejected': server.rejected
+    })
+    
+    # Only the first replica registers the public URL with Telegram
+    if WEBHOOK_URL and SHARD_INDEX == 0:
+        await application.bot.set_webhook(
+            WEBHOOK_URL.rstrip('/') + server.path,
+            secret_token=server.secret,
+            allowed_updates=Update.ALL_TYPES
+        )
+        logger.info(f"Webhook registered at {WEBHOOK_URL}")
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    await stop_event.wait()
+    
+    # Stop accepting, finish in-flight requests, drain queued updates, then
+    # shut down in run_polling's order (persistence flush before the repo closes)
+    logger.info("Shutting down webhook server...")
+    await server.stop()
+    await application.stop()
+    await post_stop(application)
+    await application.shutdown()
+    await post_shutdown(application)
+
+# Command and callback handlers, shared by main() and the offline benchmarks
+def register_handlers(application: Application):
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("draw", draw_command))
+    application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_error_handler(error_handler)
+
+# Main function
 def main():
     # Get token from environment variable
     token = os.environ.get('TELEGRAM_BOT_TOKEN')
@@ -600,20 +797,36 @@ def main():
         logger.error("Please set your TON_WALLET_ADDRESS in environment variables")
         return
     
-    # Initialize database
-    init_db()
+    # Without a secret anyone who finds the URL could post forged updates
+    if BOT_MODE == 'webhook' and not SECRET_RE.match(WEBHOOK_SECRET):
+        logger.error("Webhook mode needs WEBHOOK_SECRET (1-256 characters: letters, digits, '_' or '-')")
+        return
     
-    # Create Application
-    application = Application.builder().token(token).build()
+    # Create Application (the database pool is opened in post_init).
+    # Updates of different users run concurrently; one user's updates run in order.
+    # Bot API calls go through InstrumentedRequest so their latency is exported.
+    application = (
+        Application.builder()
+        .token(token)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .get_updates_request(InstrumentedRequest())
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .persistence(persistence)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Add handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CallbackQueryHandler(button_handler))
+    register_handlers(application)
     
-    # Error handler
-    application.add_error_handler(error_handler)
+    if BOT_MODE == 'webhook':
+        logger.info("Starting bot with webhook...")
+        asyncio.run(run_webhook(application))
+        return
     
-    # Use polling only (simpler and more reliable)
+    # Polling (simpler, single replica)
     logger.info("Starting bot with polling...")
     application.run_polling()
 
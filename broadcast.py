@@ -0,0 +1,221 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from telegram.error import RetryAfter, Forbidden, BadRequest, TelegramError
+
+from metrics import current_flow
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages/s per bot and 1/s per chat; stay below both
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', '25'))
+BROADCAST_CHAT_RATE = float(os.environ.get('BROADCAST_CHAT_RATE', '1'))
+BROADCAST_BATCH = int(os.environ.get('BROADCAST_BATCH', '50'))
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', '10'))
+BROADCAST_IDLE = float(os.environ.get('BROADCAST_IDLE', '2'))
+BROADCAST_MAX_ATTEMPTS = int(os.environ.get('BROADCAST_MAX_ATTEMPTS', '8'))
+
+
+def _seconds(value):
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+# Classic token bucket: `rate` tokens per second, at most `capacity` saved up
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Take a token if one is available; otherwise return the seconds until one is
+    def reserve(self, now=None):
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def drain(self):
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def idle(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+# Outbox sender.
+# Messages are enqueued into the persistent outbox (one row per campaign and
+# chat, so re-enqueueing a campaign is a no-op) and sent in claimed batches,
+# paced by a global token bucket and one bucket per chat. A 429 pauses all
+# sending for its retry_after and puts the message back; a chat that blocked
+# the bot fails permanently. Rows claimed by a process that died are put back
+# on start, so a broadcast resumes where it stopped (delivery is at least once:
+# up to one batch can be resent after a crash). Run it on one replica only,
+# since the rate limit is per bot.
+class Broadcaster:
+    def __init__(self, repo, rate=BROADCAST_RATE, chat_rate=BROADCAST_CHAT_RATE,
+                 batch_size=BROADCAST_BATCH, concurrency=BROADCAST_CONCURRENCY,
+                 idle_interval=BROADCAST_IDLE, max_attempts=BROADCAST_MAX_ATTEMPTS):
+        self.repo = repo
+        self.chat_rate = chat_rate
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.idle_interval = idle_interval
+        self.max_attempts = max_attempts
+        self.bot = None
+        # A small burst allowance keeps any one-second window under the bot limit
+        self._global = TokenBucket(rate, max(1.0, rate * 0.2))
+        self._chats = {}
+        self._paused_until = 0.0
+        self._task = None
+        self._stopping = False
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.throttled = 0
+        self._busy_time = 0.0
+
+    # Queue one message per chat for a campaign; returns how many were new
+    async def enqueue(self, campaign, messages, parse_mode=None):
+        rows = [(chat_id, text, parse_mode) for chat_id, text in messages]
+        added = await self.repo.enqueue_outbox(campaign, rows, datetime.now())
+        logger.info(f"Broadcast {campaign}: queued {added} of {len(rows)} messages")
+        return added
+
+    async def start(self, bot):
+        self.bot = bot
+        if self._task is not None:
+            return
+        requeued = await self.repo.requeue_outbox()
+        if requeued:
+            logger.info(f"Broadcast: resumed {requeued} messages claimed before a restart")
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Broadcaster started (rate={self._global.rate}/s, per chat={self.chat_rate}/s)")
+
+    # Finish the batch in flight, then stop
+    async def stop(self, timeout=30):
+        if self._task is None:
+            return
+        self._stopping = True
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Broadcaster did not finish its batch in time; it will be resent on restart")
+        self._task = None
+        logger.info(f"Broadcaster stopped: {self.stats()}")
+
+    async def _run(self):
+        # Own task, so this labels only the broadcast's API calls
+        current_flow.set('broadcast')
+        while not self._stopping:
+            try:
+                if not await self.run_once():
+                    await asyncio.sleep(self.idle_interval)
+            except Exception as e:
+                logger.error(f"Broadcast pass failed: {e}")
+                await asyncio.sleep(self.idle_interval)
+
+    # Claim and send one batch; returns the number of messages claimed
+    async def run_once(self):
+        claimed = await self.repo.claim_outbox(self.batch_size, datetime.now())
+        if not claimed:
+            return 0
+
+        started = time.monotonic()
+        sent, retries, failures = [], [], []
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = []
+        for message in claimed:
+            message_id, chat_id = message[0], message[1]
+            wait = self._chat_bucket(chat_id).reserve()
+            if wait:
+                # Too soon for this chat; try again when its bucket refills
+                retries.append((message_id, datetime.now() + timedelta(seconds=wait), None))
+                continue
+            await self._wait_for_slot()
+            await slots.acquire()
+            tasks.append(asyncio.create_task(self._send(message, slots, sent, retries, failures)))
+        if tasks:
+            await asyncio.gather(*tasks)
+
+        await self.repo.complete_outbox(sent, retries, failures, datetime.now())
+        self.sent += len(sent)
+        self.retried += len(retries)
+        self.failed += len(failures)
+        self._busy_time += time.monotonic() - started
+        self._prune_chats()
+        return len(claimed)
+
+    async def _wait_for_slot(self):
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            await self._global.acquire()
+            if self._paused_until <= time.monotonic():
+                return
+
+    async def _send(self, message, slots, sent, retries, failures):
+        message_id, chat_id, text, parse_mode, attempts = message
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+            sent.append(message_id)
+        except RetryAfter as e:
+            retry_after = _seconds(e.retry_after)
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self._global.drain()
+            logger.warning(f"Broadcast throttled by Telegram, pausing {retry_after:.1f}s")
+            retries.append((message_id, datetime.now() + timedelta(seconds=retry_after), 'retry_after'))
+        except (Forbidden, BadRequest) as e:
+            # Blocked the bot, deleted account, chat not found: retrying won't help
+            failures.append((message_id, str(e)[:200]))
+        except TelegramError as e:
+            if attempts >= self.max_attempts:
+                failures.append((message_id, str(e)[:200]))
+            else:
+                delay = min(5 * 2 ** (attempts - 1), 600)
+                retries.append((message_id, datetime.now() + timedelta(seconds=delay), str(e)[:200]))
+        finally:
+            slots.release()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, 1)
+        return bucket
+
+    # Forget chats whose bucket is full again, so the table stays small
+    def _prune_chats(self):
+        if len(self._chats) < 10_000:
+            return
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.idle(now)]:
+            del self._chats[chat_id]
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'throttled': self.throttled,
+            'send_rate': self.sent / self._busy_time if self._busy_time else 0.0,
+            'paused': max(0.0, self._paused_until - time.monotonic()),
+        }
@@ -0,0 +1,73 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '50000'))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '300'))
+
+
+# Bounded LRU cache whose entries also expire after `ttl` seconds.
+# Callers write through on every change they make, so the TTL only bounds how
+# long a change made elsewhere (another replica, a manual SQL fix) can be missed.
+class TTLCache:
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    # Merge fields into a cached dict entry, if there is one
+    def update(self, key, **fields):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                entry[0].update(fields)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,85 @@
+import os
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Updates handled at the same time (across different users)
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', '64'))
+
+# Upper bound on updates waiting in the processor; PTB's own semaphore is set
+# to this so a user's queued taps never occupy worker slots while they wait
+MAX_WAITING_UPDATES = 100_000
+
+
+def update_owner(update):
+    if isinstance(update, Update):
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+    return None
+
+
+# Concurrent update processing with per-user serialization.
+# Different users run in parallel up to `max_concurrent_updates`; updates of
+# the same user wait for each other and run in arrival order (asyncio locks
+# are FIFO), so double taps on pay_/check_ can't race. The per-user lock is
+# taken before a worker slot, so one impatient user can't starve the others.
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates=CONCURRENT_UPDATES):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        self._workers_limit = max_concurrent_updates
+        super().__init__(MAX_WAITING_UPDATES)
+        self._workers = asyncio.Semaphore(max_concurrent_updates)
+        # user id -> [lock, number of updates holding or waiting for it]
+        self._locks = {}
+        self.active = 0
+
+    @property
+    def max_concurrent_updates(self):
+        return self._workers_limit
+
+    async def do_process_update(self, update, coroutine):
+        owner = update_owner(update)
+        if owner is None:
+            async with self._workers:
+                await self._run(coroutine)
+            return
+
+        entry = self._locks.get(owner)
+        if entry is None:
+            entry = self._locks[owner] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._workers:
+                    await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[owner]
+
+    async def _run(self, coroutine):
+        self.active += 1
+        try:
+            await coroutine
+        finally:
+            self.active -= 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        return {
+            'max_concurrent_updates': self._workers_limit,
+            'active': self.active,
+            'users_queued': len(self._locks),
+        }
@@ -0,0 +1,217 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+from metrics import DB_QUERY_LATENCY, DB_WAIT, DB_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Pool sizing - keep DB_POOL_MAX below the Postgres connection limit of the plan
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '10'))
+
+
+class DatabaseUnavailable(Exception):
+    pass
+
+
+# Shared, bounded connection pool with an async API.
+# Blocking psycopg2 calls run in worker threads so the event loop never waits on
+# a connect or a query; the semaphore caps in-flight work at the pool size so
+# getconn() never has to fail with "pool exhausted".
+class Database:
+    def __init__(self, dsn, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._pool = None
+        self._slots = asyncio.Semaphore(maxconn)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._checkout_total = 0.0
+        self._checkout_max = 0.0
+        self._errors = 0
+
+    @property
+    def is_open(self):
+        return self._pool is not None
+
+    # Open the pool (connects minconn sessions up front)
+    async def open(self):
+        if self._pool is not None:
+            return
+        if not self.dsn:
+            raise DatabaseUnavailable("DATABASE_URL not found in environment variables")
+        self._pool = await asyncio.to_thread(
+            ThreadedConnectionPool, self.minconn, self.maxconn, self.dsn
+        )
+        logger.info(f"Database pool opened (min={self.minconn}, max={self.maxconn})")
+
+    # Close every pooled connection
+    async def close(self):
+        if self._pool is None:
+            return
+        pool, self._pool = self._pool, None
+        await asyncio.to_thread(pool.closeall)
+        logger.info(f"Database pool closed: {self.stats()}")
+
+    # Run fn(cursor, *args) on a pooled connection inside one transaction
+    async def run(self, fn, *args):
+        if self._pool is None:
+            raise DatabaseUnavailable("Database pool is not open")
+
+        operation = fn.__name__.strip('_')
+        wait_started = time.monotonic()
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            waited = time.monotonic() - wait_started
+            DB_WAIT.observe(waited)
+            if waited > 1.0:
+                logger.warning(f"Database pool saturated, waited {waited:.2f}s for a connection")
+            return await asyncio.to_thread(self._run_sync, fn, args, waited)
+        except Exception:
+            DB_ERRORS.inc(operation=operation)
+            raise
+        finally:
+            self._slots.release()
+            DB_QUERY_LATENCY.observe(time.monotonic() - wait_started, operation=operation)
+
+    def _run_sync(self, fn, args, waited):
+        checkout_started = time.monotonic()
+        conn = self._pool.getconn()
+        checkout = time.monotonic() - checkout_started
+        self._record_checkout(waited, checkout)
+
+        broken = False
+        try:
+            with conn.cursor() as cursor:
+                result = fn(cursor, *args)
+            conn.commit()
+            return result
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            broken = conn.closed != 0
+            if not broken:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            raise
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._pool.putconn(conn, close=broken)
+
+    def _record_checkout(self, waited, checkout):
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._checkout_total += checkout
+            self._checkout_max = max(self._checkout_max, checkout)
+
+    # Convenience wrappers for single statements
+    async def execute(self, sql, params=None):
+        def _execute(cursor):
+            cursor.execute(sql, params)
+            return cursor.rowcount
+        return await self.run(_execute)
+
+    async def fetchone(self, sql, params=None):
+        def _fetchone(cursor):
+            cursor.execute(sql, params)
+            return cursor.fetchone()
+        return await self.run(_fetchone)
+
+    async def fetchall(self, sql, params=None):
+        def _fetchall(cursor):
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        return await self.run(_fetchall)
+
+    # Stream the rows of one query in chunks of `chunk_size` through a named
+    # (server-side) cursor, so only one chunk is ever held in memory. Runs in a
+    # read-only REPEATABLE READ transaction for a consistent snapshot, and
+    # keeps one pooled connection until the generator is exhausted or closed.
+    async def stream(self, sql, params=None, chunk_size=10_000, name='stream'):
+        if self._pool is None:
+            raise DatabaseUnavailable("Database pool is not open")
+
+        wait_started = time.monotonic()
+        await self._slots.acquire()
+        conn = cursor = None
+        try:
+            waited = time.monotonic() - wait_started
+            DB_WAIT.observe(waited)
+            conn = await asyncio.to_thread(self._pool.getconn)
+            self._record_checkout(waited, 0.0)
+
+            def _open_cursor():
+                with conn.cursor() as setup:
+                    setup.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+                named = conn.cursor(name=f'{name}_{id(conn):x}')
+                named.itersize = chunk_size
+                named.execute(sql, params)
+                return named
+
+            cursor = await asyncio.to_thread(_open_cursor)
+            while True:
+                started = time.monotonic()
+                rows = await asyncio.to_thread(cursor.fetchmany, chunk_size)
+                DB_QUERY_LATENCY.observe(time.monotonic() - started, operation=name)
+                if not rows:
+                    break
+                yield rows
+        except Exception:
+            DB_ERRORS.inc(operation=name)
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            if conn is not None:
+                await asyncio.to_thread(self._release_stream, conn, cursor)
+            self._slots.release()
+
+    def _release_stream(self, conn, cursor):
+        broken = conn.closed != 0
+        if not broken:
+            try:
+                if cursor is not None:
+                    cursor.close()
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        with self._lock:
+            self._in_use -= 1
+        self._pool.putconn(conn, close=broken)
+
+    # Pool size, wait time and checkout latency (seconds)
+    def stats(self):
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                'pool_min': self.minconn,
+                'pool_max': self.maxconn,
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'checkouts': checkouts,
+                'errors': self._errors,
+                'wait_avg': self._wait_total / checkouts if checkouts else 0.0,
+                'wait_max': self._wait_max,
+                'checkout_avg': self._checkout_total / checkouts if checkouts else 0.0,
+                'checkout_max': self._checkout_max,
+            }
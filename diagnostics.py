@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import argparse
+from datetime import date, datetime, timedelta
+
+import psycopg2
+from dotenv import load_dotenv
+
+from migrations import migrate, DRAW_ROUND_SQL
+
+# The bot's hot queries, with sample parameters for the synthetic dataset.
+# Keep these in sync with the handlers; `expect_index` is the index the
+# planner should pick once the table is large.
+CANONICAL_QUERIES = [
+    {
+        'name': 'my_tickets',
+        'sql': '''
+        SELECT id, ticket_id, numbers, bonus_number, purchased_at, payment_status
+        FROM tickets WHERE user_id = %(user_id)s AND (purchased_at, id) < (%(page_at)s, %(page_id)s)
+        ORDER BY purchased_at DESC, id DESC LIMIT 6
+        ''',
+        'expect_index': 'tickets_user_page_idx',
+    },
+    {
+        'name': 'my_tickets_summary',
+        'sql': '''
+        SELECT payment_status, COUNT(*) FROM tickets WHERE user_id = %(user_id)s GROUP BY payment_status
+        ''',
+        'expect_index': 'tickets_user_page_idx',
+    },
+    {
+        'name': 'pending_batches',
+        'sql': "SELECT batch_id, COUNT(*) FROM tickets WHERE payment_status = 'pending' GROUP BY batch_id",
+        'expect_index': 'tickets_pending_idx',
+    },
+    {
+        'name': 'expire_pending',
+        'sql': '''
+        SELECT DISTINCT batch_id FROM tickets
+        WHERE payment_status = 'pending' AND purchased_at < %(cutoff)s
+        LIMIT 500
+        ''',
+        'expect_index': 'tickets_pending_idx',
+    },
+    {
+        'name': 'payment_status',
+        'sql': '''
+        SELECT DISTINCT batch_id FROM tickets
+        WHERE batch_id = ANY(%(ticket_ids)s) AND payment_status = 'paid'
+        ''',
+        'expect_index': 'tickets_batch_idx',
+    },
+    {
+        'name': 'draw_round',
+        'sql': '''
+        SELECT ticket_id, user_id, numbers, bonus_number FROM tickets
+        WHERE payment_status = 'paid' AND draw_round = %(draw_round)s
+        ''',
+        'expect_index': 'tickets_draw_round_idx',
+    },
+    {
+        'name': 'tickets_with_number',
+        'sql': 'SELECT count(*) FROM tickets WHERE numbers @> ARRAY[%(number)s]::SMALLINT[]',
+        'expect_index': 'tickets_numbers_gin',
+    },
+    {
+        'name': 'wallet_lookup',
+        'sql': 'SELECT wallet_connected FROM users WHERE user_id = %(user_id)s',
+        'expect_index': 'users_pkey',
+    },
+]
+
+
+# Fill the scratch schema with `rows` tickets spread over `users` users and ~12 weekly rounds
+def seed(cursor, rows, users):
+    cursor.execute('''
+    INSERT INTO users (user_id, username, wallet_connected)
+    SELECT g, 'user' || g, g %% 3 = 0 FROM generate_series(1, %s) g
+    ''', (users,))
+    cursor.execute(f'''
+    INSERT INTO tickets (user_id, username, numbers, bonus_number, ticket_id, batch_id,
+                         purchased_at, payment_status, draw_round)
+    SELECT s.user_id, 'user' || s.user_id,
+           (SELECT array_agg(n ORDER BY n)::SMALLINT[] FROM (
+               SELECT n FROM generate_series(1, 42) n ORDER BY random() + s.g * 0 LIMIT 6
+           ) picks),
+           1 + (random() * 41)::int,
+           'DIAG_' || s.g,
+           'DIAG_' || s.g,
+           s.purchased_at,
+           CASE WHEN random() < 0.05 THEN 'pending' ELSE 'paid' END,
+           {DRAW_ROUND_SQL.format(ts='s.purchased_at')}
+    FROM (
+        SELECT g, 1 + (random() * (%s - 1))::int AS user_id,
+               now() - random() * INTERVAL '84 days' AS purchased_at
+        FROM generate_series(1, %s) g
+    ) s
+    ''', (users, rows))
+    cursor.execute('ANALYZE')
+
+
+def index_names(plan):
+    names = set()
+    if 'Index Name' in plan:
+        names.add(plan['Index Name'])
+    for child in plan.get('Plans', []):
+        names |= index_names(child)
+    return names
+
+
+def seq_scans(plan):
+    scans = set()
+    if plan.get('Node Type') == 'Seq Scan':
+        scans.add(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        scans |= seq_scans(child)
+    return scans
+
+
+# EXPLAIN ANALYZE every canonical query; returns a list of regressions
+def explain_all(cursor, params, verbose=False):
+    problems = []
+    for query in CANONICAL_QUERIES:
+        cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + query['sql'], params)
+        explained = cursor.fetchone()[0]
+        if isinstance(explained, str):
+            explained = json.loads(explained)
+        plan = explained[0]['Plan']
+        used = index_names(plan)
+        scans = seq_scans(plan)
+
+        ok = query['expect_index'] in used
+        status = 'ok' if ok else 'REGRESSION'
+        print(f"{query['name']:<20} {status:<10} {explained[0]['Execution Time']:>9.2f} ms  "
+              f"indexes={sorted(used) or '-'} seq_scans={sorted(scans) or '-'}")
+        if verbose:
+            print(json.dumps(plan, indent=2))
+        if not ok:
+            problems.append(query['name'])
+    return problems
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="EXPLAIN the bot's canonical queries on synthetic data")
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--verbose', action='store_true', help='print full plans')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch schema')
+    args = parser.parse_args()
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print("DATABASE_URL not found in environment variables", file=sys.stderr)
+        return 2
+
+    schema = f'diag_{os.getpid()}'
+    conn = psycopg2.connect(database_url)
+    cursor = conn.cursor()
+    try:
+        # Build the production schema in a scratch namespace via the real migrations
+        cursor.execute(f'CREATE SCHEMA {schema}')
+        cursor.execute(f'SET search_path TO {schema}')
+        migrate(cursor)
+        seed(cursor, args.rows, args.users)
+        conn.commit()
+
+        cursor.execute("SELECT array_agg(ticket_id) FROM (SELECT ticket_id FROM tickets LIMIT 50) t")
+        ticket_ids = cursor.fetchone()[0]
+        cursor.execute("SELECT max(draw_round) FROM tickets")
+        draw_round = cursor.fetchone()[0] or date.today()
+
+        print(f"Synthetic dataset: {args.rows:,} tickets, {args.users:,} users (schema {schema})")
+        problems = explain_all(cursor, {
+            'user_id': args.users // 2,
+            'page_at': datetime.now() - timedelta(days=7),
+            'page_id': args.rows // 2,
+            'cutoff': datetime.now() - timedelta(hours=1),
+            'ticket_ids': ticket_ids,
+            'draw_round': draw_round,
+            'number': 17,
+        }, verbose=args.verbose)
+        conn.rollback()
+    finally:
+        if not args.keep:
+            conn.rollback()
+            cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+            conn.commit()
+        conn.close()
+
+    if problems:
+        print(f"Query plan regressions: {', '.join(problems)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
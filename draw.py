@@ -0,0 +1,192 @@
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta, timezone
+
+import numpy as np
+
+from rng import MAX_NUMBER, PICK_COUNT, new_seed, commitment, draw_numbers
+from ton_ingest import NANOTON, TICKET_PRICE_NANOTON
+
+logger = logging.getLogger(__name__)
+
+PRIZE_POOL_SHARE = 0.80
+
+# Weekly draws every Saturday at 20:00 UTC
+DRAW_WEEKDAY = 5
+DRAW_HOUR = 20
+
+# Prize tiers, best first: (name, matched numbers, bonus required, share of the pool)
+PRIZE_TIERS = [
+    ('6+bonus', 6, True, 0.40),
+    ('6', 6, False, 0.20),
+    ('5+bonus', 5, True, 0.15),
+    ('5', 5, False, 0.10),
+    ('4', 4, None, 0.10),
+    ('3', 3, None, 0.05),
+]
+NO_PRIZE = len(PRIZE_TIERS)
+
+# Lookup table: tier index for [matched numbers, bonus hit]
+_TIER_TABLE = np.full((PICK_COUNT + 1, 2), NO_PRIZE, dtype=np.int8)
+for _tier, (_name, _matched, _bonus, _share) in reversed(list(enumerate(PRIZE_TIERS))):
+    for _hit in (0, 1):
+        if _bonus is None or _bonus == bool(_hit):
+            _TIER_TABLE[_matched, _hit] = _tier
+
+# Popcount of every byte, for numpy builds without bitwise_count
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+# Pack picked numbers (1..42) into a 42-bit mask, bit n-1 for number n
+def encode_numbers(numbers):
+    mask = 0
+    for n in numbers:
+        mask |= 1 << (int(n) - 1)
+    return mask
+
+
+def decode_numbers(mask):
+    mask = int(mask)
+    return [n for n in range(1, MAX_NUMBER + 1) if mask >> (n - 1) & 1]
+
+
+# Vectorized encode of an (n, 6) array of picks
+def encode_many(picks):
+    picks = np.asarray(picks, dtype=np.uint64)
+    return np.bitwise_or.reduce(np.left_shift(np.uint64(1), picks - np.uint64(1)), axis=1)
+
+
+def popcount(masks):
+    masks = np.ascontiguousarray(masks, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(masks)
+    return _BYTE_POPCOUNT[masks.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+# Draw a purchase at `now` takes part in; tickets.draw_round stores its date
+def next_draw_at(now=None):
+    now = now or datetime.now(timezone.utc)
+    draw_at = now.replace(hour=DRAW_HOUR, minute=0, second=0, microsecond=0)
+    draw_at += timedelta(days=(DRAW_WEEKDAY - now.weekday()) % 7)
+    if draw_at <= now:
+        draw_at += timedelta(days=7)
+    return draw_at
+
+
+# When the round stored under `draw_round` (a date) is drawn
+def draw_time(draw_round):
+    return datetime.combine(draw_round, time(DRAW_HOUR), tzinfo=timezone.utc)
+
+
+@dataclass
+class DrawResult:
+    numbers: list
+    bonus: int
+    tickets: int
+    pool: int
+    winners: dict = field(default_factory=dict)
+    prize_per_ticket: dict = field(default_factory=dict)
+    rollover: int = 0
+    # Per-ticket tier index (NO_PRIZE for losers) and payout in nanoton
+    tiers: np.ndarray = None
+    payouts: np.ndarray = None
+
+
+# Score every ticket against the drawn numbers and split the prize pool.
+# masks/bonuses are parallel arrays (one entry per paid ticket). Each tier's
+# share is split evenly between its winners; unclaimed shares roll over.
+def settle(masks, bonuses, numbers, bonus, price=TICKET_PRICE_NANOTON):
+    masks = np.asarray(masks, dtype=np.uint64)
+    bonuses = np.asarray(bonuses)
+    drawn = np.uint64(encode_numbers(numbers))
+
+    matched = popcount(masks & drawn)
+    bonus_hit = (bonuses == bonus).astype(np.int8)
+    tiers = _TIER_TABLE[matched, bonus_hit]
+
+    counts = np.bincount(tiers, minlength=NO_PRIZE + 1)
+    pool = int(len(masks) * price * PRIZE_POOL_SHARE)
+
+    per_ticket = np.zeros(NO_PRIZE + 1, dtype=np.int64)
+    result = DrawResult(numbers=sorted(numbers), bonus=bonus, tickets=len(masks), pool=pool)
+    for tier, (name, _matched, _bonus, share) in enumerate(PRIZE_TIERS):
+        tier_pool = int(pool * share)
+        count = int(counts[tier])
+        result.winners[name] = count
+        if count:
+            per_ticket[tier] = tier_pool // count
+            result.prize_per_ticket[name] = int(per_ticket[tier])
+        else:
+            result.prize_per_ticket[name] = 0
+            result.rollover += tier_pool
+
+    result.tiers = tiers
+    result.payouts = per_ticket[tiers]
+    return result
+
+
+# Load all paid tickets of a round as (ticket_ids, user_ids, masks, bonuses)
+async def load_round(repo, draw_at):
+    rows = await repo.round_tickets(draw_at.date())
+    if not rows:
+        return [], np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int8)
+
+    ticket_ids = [row[0] for row in rows]
+    user_ids = np.array([row[1] for row in rows], dtype=np.int64)
+    picks = np.array([row[2] for row in rows], dtype=np.uint64)
+    bonuses = np.array([row[3] for row in rows], dtype=np.int8)
+    return ticket_ids, user_ids, encode_many(picks), bonuses
+
+
+# Publish the commitment for a round: sha256 of a fresh secret seed.
+# Returns the existing commitment if the round was already committed.
+async def commit_draw(repo, draw_round):
+    seed = new_seed()
+    return await repo.commit_draw(draw_round, commitment(seed), seed)
+
+
+# Reveal the seed and derive the round's numbers from it (idempotent)
+async def reveal_draw(repo, draw_round):
+    draw = await repo.get_draw(draw_round)
+    if draw is None:
+        raise ValueError(f"Draw {draw_round} has no commitment")
+    _seed_hash, seed, numbers, bonus = draw
+    if numbers is None:
+        numbers, bonus = draw_numbers(seed, draw_round.isoformat())
+        return await repo.reveal_draw(draw_round, numbers, bonus, datetime.now())
+    return seed, list(numbers), bonus
+
+
+# Settle one weekly round
+async def run_draw(repo, draw_at, numbers, bonus):
+    ticket_ids, user_ids, masks, bonuses = await load_round(repo, draw_at)
+    result = settle(masks, bonuses, numbers, bonus)
+    logger.info(
+        f"Draw {draw_at:%Y-%m-%d} settled {result.tickets} tickets: numbers={result.numbers} "
+        f"bonus={bonus} pool={result.pool} winners={result.winners} rollover={result.rollover}"
+    )
+    return ticket_ids, user_ids, result
+
+
+# One result message per ticket holder: [(user_id, text)], for the broadcaster
+def draw_messages(draw_at, user_ids, result):
+    if len(user_ids) == 0:
+        return []
+    users, owner = np.unique(user_ids, return_inverse=True)
+    tickets = np.bincount(owner, minlength=len(users))
+    wins = np.bincount(owner, weights=result.tiers < NO_PRIZE, minlength=len(users)).astype(np.int64)
+    payouts = np.bincount(owner, weights=result.payouts, minlength=len(users))
+
+    header = (
+        f"🎰 **Draw {draw_at:%Y-%m-%d}**\n\n"
+        f"🔢 **Numbers:** {', '.join(map(str, result.numbers))}\n"
+        f"⭐ **Bonus:** {result.bonus}\n\n"
+    )
+    messages = []
+    for user_id, count, won, payout in zip(users.tolist(), tickets.tolist(), wins.tolist(), payouts.tolist()):
+        if won:
+            body = f"🏆 {won} of your {count} tickets won **{payout / NANOTON:.2f} TON**!"
+        else:
+            body = f"No prize for your {count} tickets this week. Good luck next Saturday!"
+        messages.append((user_id, header + body))
+    return messages
@@ -0,0 +1,152 @@
+import os
+import io
+import sys
+import csv
+import gzip
+import json
+import asyncio
+import logging
+import argparse
+from contextlib import aclosing
+from datetime import date, datetime
+
+from dotenv import load_dotenv
+
+from repository import EXPORT_COLUMNS, create_repository
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched (and written) per chunk
+EXPORT_CHUNK = int(os.environ.get('EXPORT_CHUNK', '10000'))
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+def _plain(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+# Ticket rows as CSV, numbers as "1 2 3 4 5 6"
+class CsvWriter:
+    suffix = '.csv'
+
+    def __init__(self, file):
+        self.file = io.TextIOWrapper(file, encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(EXPORT_COLUMNS)
+
+    def write_rows(self, rows):
+        self.writer.writerows(
+            (ticket_id, batch_id, user_id, username, ' '.join(map(str, numbers)), bonus,
+             _plain(purchased_at), _plain(draw_round), status)
+            for ticket_id, batch_id, user_id, username, numbers, bonus, purchased_at, draw_round, status in rows
+        )
+
+    def close(self):
+        self.file.flush()
+        self.file.detach()
+
+
+# Ticket rows as gzipped JSON lines, one object per ticket. One reusable
+# encoder (dates through `default`) and gzip level 6: level 9 costs far more
+# CPU for a file that is barely smaller.
+class JsonlWriter:
+    suffix = '.jsonl.gz'
+
+    def __init__(self, file):
+        self.file = gzip.GzipFile(fileobj=file, mode='wb', compresslevel=6)
+        self.encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_plain).encode
+
+    def write_rows(self, rows):
+        encode = self.encode
+        self.file.write(''.join(encode(dict(zip(EXPORT_COLUMNS, row))) + '\n' for row in rows).encode('utf-8'))
+
+    def close(self):
+        self.file.close()
+
+
+WRITERS = {'csv': CsvWriter, 'jsonl': JsonlWriter}
+
+
+def _write_chunk(writer, rows):
+    writer.write_rows(rows)
+    return len(rows)
+
+
+# Stream matching tickets into a binary file object, one chunk at a time, so
+# memory stays flat however many rows match (at most two chunks are held).
+# Each chunk is encoded and written in a worker thread while the next one is
+# fetched, keeping the event loop free while a large export runs.
+# Returns the number of rows written.
+async def export_tickets(repo, file, fmt='csv', draw_round=None, since=None, until=None, status=None,
+                         chunk_size=EXPORT_CHUNK, progress=None):
+    writer = WRITERS[fmt](file)
+    written = 0
+    writing = None
+    try:
+        async with aclosing(repo.stream_tickets(draw_round, since, until, status, chunk_size)) as chunks:
+            async for rows in chunks:
+                if writing is not None:
+                    written += await writing
+                    if progress is not None:
+                        progress(written)
+                writing = asyncio.ensure_future(asyncio.to_thread(_write_chunk, writer, rows))
+        if writing is not None:
+            written += await writing
+            writing = None
+            if progress is not None:
+                progress(written)
+    finally:
+        if writing is not None:
+            await asyncio.wait([writing])
+        writer.close()
+    logger.info(f"Exported {written} tickets as {fmt} (round={draw_round}, since={since}, until={until}, status={status})")
+    return written
+
+
+def _parse_date(value):
+    return date.fromisoformat(value)
+
+
+def _parse_timestamp(value):
+    return datetime.fromisoformat(value)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Export tickets for reconciliation and audits")
+    parser.add_argument('--round', type=_parse_date, help='draw round (YYYY-MM-DD, the draw date)')
+    parser.add_argument('--since', type=_parse_timestamp, help='purchased at or after (ISO date or timestamp)')
+    parser.add_argument('--until', type=_parse_timestamp, help='purchased before (ISO date or timestamp)')
+    parser.add_argument('--status', choices=('paid', 'pending'))
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--output', help='output file (default: stdout)')
+    parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK)
+    args = parser.parse_args()
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print("DATABASE_URL not found in environment variables", file=sys.stderr)
+        return 2
+
+    async def run():
+        repo = create_repository(database_url)
+        await repo.open()
+        try:
+            if args.output:
+                with open(args.output, 'wb') as file:
+                    return await export_tickets(repo, file, args.format, args.round, args.since, args.until,
+                                                args.status, args.chunk_size)
+            return await export_tickets(repo, sys.stdout.buffer, args.format, args.round, args.since,
+                                        args.until, args.status, args.chunk_size)
+        finally:
+            await repo.close()
+
+    written = asyncio.run(run())
+    print(f"Exported {written:,} tickets", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import os
+import zlib
+import time
+import socket
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Snowflake-style ticket IDs: 41 bits of milliseconds since ID_EPOCH_MS,
+# 10 bits of node id and a 12 bit per-millisecond sequence. IDs are unique
+# across processes as long as every process has its own node id, and they
+# sort by creation time both as integers and as encoded strings.
+ID_EPOCH_MS = 1_704_067_200_000  # 2024-01-01 00:00:00 UTC
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+ID_PREFIX = 'TONLOTO_'
+
+# Crockford base32 keeps the memo short, case-insensitive and free of I/L/O/U
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+ENCODED_LENGTH = 13  # 63 bits -> 13 base32 digits, fixed width so strings sort
+
+
+def encode_id(value):
+    chars = []
+    for _ in range(ENCODED_LENGTH):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def decode_id(encoded):
+    value = 0
+    for char in encoded.upper():
+        value = value * 32 + ALPHABET.index(char)
+    return value
+
+
+# Split an ID back into (timestamp ms, node id, sequence)
+def parse_id(value):
+    if isinstance(value, str):
+        value = decode_id(value[len(ID_PREFIX):] if value.startswith(ID_PREFIX) else value)
+    return (
+        (value >> (NODE_BITS + SEQUENCE_BITS)) + ID_EPOCH_MS,
+        (value >> SEQUENCE_BITS) & MAX_NODE_ID,
+        value & MAX_SEQUENCE,
+    )
+
+
+def check_node_id(node_id):
+    if not 0 <= node_id <= MAX_NODE_ID:
+        raise ValueError(f"node_id must be between 0 and {MAX_NODE_ID}")
+    return node_id
+
+
+# NODE_ID if set. With several webhook replicas (WEBHOOK_SHARDS) the replica's
+# SHARD_INDEX, so every process that writes tickets has its own node id.
+# Otherwise a hash of hostname and pid: containers usually all run the bot as
+# pid 1, but their hostnames differ. Two such processes still share a node id
+# one time in 1024, so anything running more than one writer (say a rolling
+# deploy overlapping old and new replicas) should set NODE_ID.
+def default_node_id():
+    node = os.environ.get('NODE_ID')
+    shards = [url for url in os.environ.get('WEBHOOK_SHARDS', '').split(',') if url.strip()]
+    if node is None and len(shards) > 1:
+        node = os.environ.get('SHARD_INDEX', '0')
+    if node is not None:
+        return check_node_id(int(node))
+    node_id = zlib.crc32(f"{socket.gethostname()}:{os.getpid()}".encode()) & MAX_NODE_ID
+    logger.warning(f"NODE_ID is not set; using node id {node_id} from hostname and pid. "
+                   f"Set NODE_ID if more than one process writes tickets")
+    return node_id
+
+
+class IdGenerator:
+    def __init__(self, node_id=None):
+        if node_id is not None:
+            check_node_id(node_id)
+        self._fixed_node = node_id
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self.node_id = self._fixed_node if self._fixed_node is not None else default_node_id()
+        logger.info(f"Ticket IDs use node id {self.node_id} (pid {self._pid})")
+        self._last_ms = 0
+        self._sequence = 0
+
+    def next_int(self):
+        with self._lock:
+            if os.getpid() != self._pid:
+                # Forked child: restart the sequence and re-derive the node id
+                # (only the hostname and pid fallback differs from the parent's)
+                self._reset()
+
+            now = int(time.time() * 1000) - ID_EPOCH_MS
+            if now > self._last_ms:
+                self._last_ms = now
+                self._sequence = 0
+            else:
+                # Same millisecond, or the clock stepped back: keep counting
+                # on the last timestamp, borrowing the next millisecond when
+                # the sequence runs out, so IDs stay monotonic
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    self._last_ms += 1
+                    self._sequence = 0
+
+            return (self._last_ms << (NODE_BITS + SEQUENCE_BITS)) | (self.node_id << SEQUENCE_BITS) | self._sequence
+
+    def next_id(self):
+        return ID_PREFIX + encode_id(self.next_int())
+
+
+# Created on first use, so the node id is logged once logging is configured
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def next_ticket_id():
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = IdGenerator()
+    return _generator.next_id()
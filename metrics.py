@@ -0,0 +1,277 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from functools import wraps
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Local port for the Prometheus scrape endpoint (0 disables it)
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9100'))
+
+# Latency buckets in seconds, from a cache hit to a slow Telegram call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, '') for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name + '_total', _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # label values -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    # with HISTOGRAM.time(label=...): ...
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(entry)) for key, entry in self._values.items()]
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield self.name + '_bucket', _format_labels(self.labelnames, key, le), cumulative
+            yield self.name + '_sum', _format_labels(self.labelnames, key), entry[-2]
+            yield self.name + '_count', _format_labels(self.labelnames, key), entry[-1]
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+# Gauges read from an existing stats() dict at scrape time, so components keep
+# their own counters and the registry never holds a second copy
+class StatsGauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help, stats_fn):
+        self.name = name
+        self.help = help
+        self.stats_fn = stats_fn
+
+    def samples(self):
+        try:
+            stats = self.stats_fn()
+        except Exception as e:
+            logger.warning(f"Could not collect {self.name}: {e}")
+            return
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield f'{self.name}_{key}', '', value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def stats(self, name, help, stats_fn):
+        return self.register(StatsGauge(name, help, stats_fn))
+
+    # Prometheus text exposition format (version 0.0.4)
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            samples = list(metric.samples())
+            if isinstance(metric, StatsGauge):
+                for name, labels, value in samples:
+                    lines.append(f'# HELP {name} {metric.help}')
+                    lines.append(f'# TYPE {name} gauge')
+                    lines.append(f'{name}{labels} {_format_value(value)}')
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in samples:
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_REQUESTS = REGISTRY.counter('lotto_handler_requests', 'Updates handled, by handler', ['handler'])
+HANDLER_ERRORS = REGISTRY.counter('lotto_handler_errors', 'Handler calls that raised, by handler', ['handler'])
+HANDLER_LATENCY = REGISTRY.histogram('lotto_handler_seconds', 'Handler latency, by handler', ['handler'])
+DB_QUERY_LATENCY = REGISTRY.histogram('lotto_db_query_seconds', 'Database call latency including pool wait, by operation', ['operation'])
+DB_WAIT = REGISTRY.histogram('lotto_db_pool_wait_seconds', 'Time spent waiting for a pooled connection')
+DB_ERRORS = REGISTRY.counter('lotto_db_errors', 'Database calls that raised, by operation', ['operation'])
+PAYMENT_CHECKS = REGISTRY.counter('lotto_payment_checks', 'Payment verification outcomes (paid, retry, unpaid)', ['outcome'])
+PAYMENT_CHECK_LATENCY = REGISTRY.histogram('lotto_payment_check_seconds', 'Duration of one batched payment check')
+TELEGRAM_LATENCY = REGISTRY.histogram('lotto_telegram_api_seconds', 'Telegram Bot API call latency, by method', ['method'])
+EXPIRED_TICKETS = REGISTRY.counter('lotto_expired_tickets', 'Unpaid tickets deleted by the expiry job')
+ADMISSION_THROTTLED = REGISTRY.counter('lotto_admission_throttled', 'Callbacks rejected by admission control, by action and reason (user, global)', ['action', 'reason'])
+TELEGRAM_ERRORS = REGISTRY.counter('lotto_telegram_api_errors', 'Telegram Bot API calls that failed, by method', ['method'])
+TELEGRAM_CALLS = REGISTRY.counter('lotto_telegram_api_calls', 'Telegram Bot API calls, by flow (handler or background task) and method', ['flow', 'method'])
+
+# Flow that outbound Bot API calls are counted against: set by handlers, the
+# callback router and background senders; anything else is 'background'
+current_flow = contextvars.ContextVar('current_flow', default='background')
+
+
+# Wrap a handler coroutine with request/error counters and a latency histogram
+def instrumented(name):
+    def decorate(handler):
+        @wraps(handler)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            HANDLER_REQUESTS.inc(handler=name)
+            flow = current_flow.set(name)
+            try:
+                return await handler(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                raise
+            finally:
+                current_flow.reset(flow)
+                HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+        return wrapper
+    return decorate
+
+
+# HTTPX request that times every Bot API call, labelled by API method, and
+# counts calls per flow (see current_flow)
+class InstrumentedRequest(HTTPXRequest):
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        TELEGRAM_CALLS.inc(flow=current_flow.get(), method=api_method)
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, **kwargs)
+        except Exception:
+            TELEGRAM_ERRORS.inc(method=api_method)
+            raise
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - started, method=api_method)
+        if code >= 400:
+            TELEGRAM_ERRORS.inc(method=api_method)
+        return code, payload
+
+
+# Serves GET /metrics on a local port for the Prometheus scraper
+class MetricsServer:
+    def __init__(self, registry=REGISTRY, host=METRICS_HOST, port=METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        if not self.port:
+            return
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.registry.render().encode()
+            else:
+                status, body = '404 Not Found', b''
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
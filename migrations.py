@@ -0,0 +1,224 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for pg_advisory_xact_lock so concurrent replicas migrate one at a time
+MIGRATION_LOCK_ID = 7_420_001
+
+# Round (draw date) a purchase at `ts` belongs to: the next Saturday 20:00 UTC
+DRAW_ROUND_SQL = "(date_trunc('week', {ts} - INTERVAL '5 days 20 hours') + INTERVAL '12 days 20 hours')::date"
+
+# Versioned schema changes, applied in order exactly once.
+# A run applies every pending migration in one transaction together with
+# their schema_migrations rows, so a failed step leaves nothing half-applied
+# (the whole run is retried on the next start).
+MIGRATIONS = [
+    (1, 'initial schema', [
+        '''
+        CREATE TABLE IF NOT EXISTS tickets (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER,
+            username TEXT,
+            numbers TEXT,
+            bonus_number INTEGER,
+            ticket_id TEXT UNIQUE,
+            purchased_at TIMESTAMP,
+            payment_status TEXT DEFAULT 'pending',
+            wallet_connected BOOLEAN DEFAULT FALSE,
+            wallet_address TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            wallet_connected BOOLEAN DEFAULT FALSE,
+            wallet_address TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS ton_ingest_cursor (
+            address TEXT PRIMARY KEY,
+            last_lt BIGINT NOT NULL,
+            last_hash TEXT NOT NULL
+        )
+        ''',
+    ]),
+    (2, 'compact ticket numbers and draw round', [
+        # "3,7,12,..." TEXT -> SMALLINT[]; GIN lets "tickets containing 17" use an index
+        'ALTER TABLE tickets ADD COLUMN picks SMALLINT[]',
+        "UPDATE tickets SET picks = string_to_array(numbers, ',')::SMALLINT[] WHERE numbers IS NOT NULL",
+        'ALTER TABLE tickets DROP COLUMN numbers',
+        'ALTER TABLE tickets RENAME COLUMN picks TO numbers',
+        'ALTER TABLE tickets ALTER COLUMN bonus_number TYPE SMALLINT',
+        'ALTER TABLE tickets ADD COLUMN draw_round DATE',
+        f"UPDATE tickets SET draw_round = {DRAW_ROUND_SQL.format(ts='purchased_at')} WHERE purchased_at IS NOT NULL",
+        'CREATE INDEX tickets_numbers_gin ON tickets USING GIN (numbers)',
+        'CREATE INDEX tickets_draw_round_idx ON tickets (draw_round)',
+    ]),
+    (3, 'ticket lookup indexes', [
+        # my_tickets: WHERE user_id = ? ORDER BY purchased_at DESC
+        'CREATE INDEX IF NOT EXISTS tickets_user_purchased_idx ON tickets (user_id, purchased_at DESC)',
+        # Ingestor load and pending expiry only ever touch the (small) pending set
+        """
+        CREATE INDEX IF NOT EXISTS tickets_pending_idx ON tickets (purchased_at)
+        INCLUDE (ticket_id) WHERE payment_status = 'pending'
+        """,
+        'ANALYZE tickets',
+    ]),
+    (4, 'keyset pagination index for my_tickets', [
+        # (purchased_at, id) is the page cursor; id breaks ties between equal timestamps
+        'CREATE INDEX IF NOT EXISTS tickets_user_page_idx ON tickets (user_id, purchased_at DESC, id DESC)',
+        'DROP INDEX IF EXISTS tickets_user_purchased_idx',
+    ]),
+    (5, 'ticket batches', [
+        # All tickets bought together share one payment memo; a single ticket is its own batch
+        'ALTER TABLE tickets ADD COLUMN IF NOT EXISTS batch_id TEXT',
+        'UPDATE tickets SET batch_id = ticket_id WHERE batch_id IS NULL',
+        'CREATE INDEX IF NOT EXISTS tickets_batch_idx ON tickets (batch_id)',
+        # The ingestor loads pending memos, so the pending index covers batch_id instead
+        'DROP INDEX IF EXISTS tickets_pending_idx',
+        """
+        CREATE INDEX tickets_pending_idx ON tickets (purchased_at)
+        INCLUDE (batch_id) WHERE payment_status = 'pending'
+        """,
+    ]),
+    (6, 'commit-reveal draws', [
+        # seed_hash is published before the draw; seed is revealed with the numbers
+        '''
+        CREATE TABLE IF NOT EXISTS draws (
+            draw_round DATE PRIMARY KEY,
+            seed_hash TEXT NOT NULL,
+            seed TEXT NOT NULL,
+            numbers SMALLINT[],
+            bonus_number SMALLINT,
+            committed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            revealed_at TIMESTAMP
+        )
+        ''',
+    ]),
+    (7, 'broadcast outbox', [
+        # One row per campaign and chat; status: queued -> sending -> sent | failed
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            campaign TEXT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts SMALLINT NOT NULL DEFAULT 0,
+            not_before TIMESTAMP NOT NULL,
+            sent_at TIMESTAMP,
+            error TEXT,
+            UNIQUE (campaign, chat_id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS outbox_due_idx ON outbox (not_before, id) WHERE status = 'queued'",
+        "CREATE INDEX IF NOT EXISTS outbox_sending_idx ON outbox (id) WHERE status = 'sending'",
+    ]),
+    (8, 'context data', [
+        # context.user_data / context.chat_data, one JSON document per user or chat
+        '''
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id BIGINT PRIMARY KEY,
+            data JSONB NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS chat_data (
+            chat_id BIGINT PRIMARY KEY,
+            data JSONB NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+        ''',
+    ]),
+    (9, 'round statistics', [
+        # Counters kept up to date by mark_paid, so the pool never needs a scan of tickets
+        '''
+        CREATE TABLE IF NOT EXISTS round_stats (
+            draw_round DATE PRIMARY KEY,
+            tickets_paid BIGINT NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS round_number_stats (
+            draw_round DATE NOT NULL,
+            number SMALLINT NOT NULL,
+            picks BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (draw_round, number)
+        )
+        ''',
+        '''
+        INSERT INTO round_stats (draw_round, tickets_paid)
+        SELECT draw_round, COUNT(*) FROM tickets
+        WHERE payment_status = 'paid' AND draw_round IS NOT NULL
+        GROUP BY draw_round
+        ON CONFLICT (draw_round) DO NOTHING
+        ''',
+        '''
+        INSERT INTO round_number_stats (draw_round, number, picks)
+        SELECT draw_round, number, COUNT(*) FROM tickets, unnest(numbers) AS number
+        WHERE payment_status = 'paid' AND draw_round IS NOT NULL
+        GROUP BY draw_round, number
+        ON CONFLICT (draw_round, number) DO NOTHING
+        ''',
+    ]),
+    (10, 'draw settlement', [
+        # Set once a revealed round's results are queued for delivery
+        'ALTER TABLE draws ADD COLUMN IF NOT EXISTS settled_at TIMESTAMP',
+    ]),
+    (11, 'underpaid transfers', [
+        # Transfers with a batch memo but less than its price, kept for manual
+        # reconciliation (refund or top-up); resolved_at is set by hand
+        '''
+        CREATE TABLE IF NOT EXISTS underpaid_transfers (
+            tx_hash TEXT PRIMARY KEY,
+            lt BIGINT NOT NULL,
+            batch_id TEXT NOT NULL,
+            sender TEXT,
+            amount BIGINT NOT NULL,
+            expected BIGINT NOT NULL,
+            seen_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            resolved_at TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS underpaid_transfers_batch_idx ON underpaid_transfers (batch_id)',
+    ]),
+]
+
+
+# Apply every migration newer than the recorded schema version
+# The lock comes first: replicas starting together queue on it, and only the
+# one holding it creates schema_migrations and applies what is missing. The
+# others then see every version applied and commit without changes.
+def migrate(cursor, migrations=MIGRATIONS):
+    cursor.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_ID,))
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute('SELECT version FROM schema_migrations')
+    done = {row[0] for row in cursor.fetchall()}
+
+    applied = []
+    for version, name, statements in migrations:
+        if version in done:
+            continue
+        logger.info(f"Applying migration {version}: {name}")
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s)', (version, name))
+        applied.append(version)
+    cursor.connection.commit()
+    return applied
+
+
+def schema_version(cursor):
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations')
+    return cursor.fetchone()[0]
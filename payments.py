@@ -0,0 +1,141 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+
+from metrics import PAYMENT_CHECKS, PAYMENT_CHECK_LATENCY, current_flow
+
+logger = logging.getLogger(__name__)
+
+# Scheduler tuning (seconds)
+PAYMENT_CHECK_INTERVAL = float(os.environ.get('PAYMENT_CHECK_INTERVAL', '10'))
+PAYMENT_CHECK_BATCH = int(os.environ.get('PAYMENT_CHECK_BATCH', '500'))
+PAYMENT_BACKOFF_BASE = float(os.environ.get('PAYMENT_BACKOFF_BASE', '15'))
+PAYMENT_BACKOFF_MAX = float(os.environ.get('PAYMENT_BACKOFF_MAX', '120'))
+PAYMENT_MAX_ATTEMPTS = int(os.environ.get('PAYMENT_MAX_ATTEMPTS', '8'))
+
+
+# A ticket waiting for its payment to show up on chain.
+# ticket_id is the payment memo: the ticket ID, or the batch ID for a batch.
+@dataclass
+class PendingPayment:
+    ticket_id: str
+    user_id: int
+    chat_id: int
+    message_id: int
+    tickets: int = 1
+    attempts: int = 0
+    next_check_at: float = 0.0
+
+
+# Background payment verification scheduler.
+# Handlers submit tickets and return immediately; one loop checks every due
+# ticket in a single batch per interval, backs off tickets that are not paid
+# yet and pushes the outcome to the user. A ticket is queued at most once, so
+# repeated "I've Paid" / "Check Payment" taps share one verification.
+class PaymentVerifier:
+    def __init__(self, check_batch, on_paid, on_unpaid,
+                 interval=PAYMENT_CHECK_INTERVAL, batch_size=PAYMENT_CHECK_BATCH,
+                 backoff_base=PAYMENT_BACKOFF_BASE, backoff_max=PAYMENT_BACKOFF_MAX,
+                 max_attempts=PAYMENT_MAX_ATTEMPTS):
+        # check_batch(payments) -> set of paid ticket_ids
+        # on_paid(bot, payment) / on_unpaid(bot, payment) deliver the result
+        self.check_batch = check_batch
+        self.on_paid = on_paid
+        self.on_unpaid = on_unpaid
+        self.interval = interval
+        self.batch_size = batch_size
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_attempts = max_attempts
+        self.bot = None
+        self._pending = {}
+        self._task = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def is_pending(self, ticket_id):
+        return ticket_id in self._pending
+
+    # Queue a ticket for verification; returns False if it is already queued
+    def submit(self, ticket_id, user_id, chat_id, message_id, tickets=1):
+        payment = self._pending.get(ticket_id)
+        if payment is not None:
+            # Follow the message the user is looking at now
+            payment.chat_id = chat_id
+            payment.message_id = message_id
+            return False
+
+        self._pending[ticket_id] = PendingPayment(
+            ticket_id=ticket_id,
+            user_id=user_id,
+            chat_id=chat_id,
+            message_id=message_id,
+            tickets=tickets,
+            next_check_at=time.monotonic(),
+        )
+        return True
+
+    async def start(self, bot):
+        self.bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Payment verifier started (interval={self.interval}s, batch={self.batch_size})")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info(f"Payment verifier stopped with {len(self._pending)} tickets pending")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Payment verification pass failed: {e}")
+
+    # Check every due ticket in one batch
+    async def run_once(self):
+        now = time.monotonic()
+        due = [p for p in self._pending.values() if p.next_check_at <= now]
+        if not due:
+            return 0
+        due.sort(key=lambda p: p.next_check_at)
+        due = due[:self.batch_size]
+
+        with PAYMENT_CHECK_LATENCY.time():
+            paid = await self.check_batch(due)
+
+        for payment in due:
+            payment.attempts += 1
+            if payment.ticket_id in paid:
+                del self._pending[payment.ticket_id]
+                PAYMENT_CHECKS.inc(outcome='paid')
+                await self._deliver(self.on_paid, payment)
+            elif payment.attempts >= self.max_attempts:
+                del self._pending[payment.ticket_id]
+                PAYMENT_CHECKS.inc(outcome='unpaid')
+                await self._deliver(self.on_unpaid, payment)
+            else:
+                PAYMENT_CHECKS.inc(outcome='retry')
+                delay = min(self.backoff_base * 2 ** (payment.attempts - 1), self.backoff_max)
+                payment.next_check_at = time.monotonic() + delay
+        return len(due)
+
+    async def _deliver(self, callback, payment):
+        flow = current_flow.set(callback.__name__)
+        try:
+            await callback(self.bot, payment)
+        except Exception as e:
+            logger.error(f"Error delivering payment result for {payment.ticket_id}: {e}")
+        finally:
+            current_flow.reset(flow)
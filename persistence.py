@@ -0,0 +1,208 @@
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime
+from collections import OrderedDict
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# PTB hands over dirty user/chat data every PERSISTENCE_INTERVAL seconds
+PERSISTENCE_INTERVAL = float(os.environ.get('PERSISTENCE_INTERVAL', '10'))
+# Rows per upsert transaction
+PERSISTENCE_BATCH = int(os.environ.get('PERSISTENCE_BATCH', '1000'))
+# Users (and chats) whose last written content hash is kept, least recently
+# used first out; a forgotten one is reloaded on its next update
+PERSISTENCE_CACHE_SIZE = int(os.environ.get('PERSISTENCE_CACHE_SIZE', '100000'))
+
+
+def _encode(data):
+    return json.dumps(data, separators=(',', ':'), sort_keys=True)
+
+
+# context.user_data / context.chat_data stored in the repository.
+# Nothing is loaded at startup: a user's (or chat's) data is read the first time
+# an update of theirs is handled, via refresh_user_data. PTB passes the entries
+# touched since the last pass to update_*_data; those only stage the JSON, and
+# entries whose JSON did not change since it was last written are skipped. The
+# staged entries are written right after the pass, in batched upserts, and again
+# by flush() on shutdown. Values must be JSON-serializable (dict keys become
+# strings). bot_data, callback_data and conversations are not stored.
+# The hashes are an LRU of cache_size entries per kind; an entry that was
+# evicted is just written again (and reloaded on the user's next update).
+class DatabasePersistence(BasePersistence):
+    def __init__(self, repo, update_interval=PERSISTENCE_INTERVAL, batch_size=PERSISTENCE_BATCH,
+                 cache_size=PERSISTENCE_CACHE_SIZE):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.repo = repo
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        # kind -> {key: JSON text, or None to delete}
+        self._staged = {'user': {}, 'chat': {}}
+        # kind -> {key: hash of the JSON last loaded or written}, least recently used first
+        self._stored = {'user': OrderedDict(), 'chat': OrderedDict()}
+        # kind -> keys whose load failed; their data is not written over the stored copy
+        self._unloaded = {'user': set(), 'chat': set()}
+        self._write_task = None
+        self.loaded = 0
+        self.written = 0
+        self.unchanged = 0
+        self.evicted = 0
+        self.errors = 0
+
+    # Loaded lazily per user and chat
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._load('user', user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._load('chat', chat_id, chat_data)
+
+    async def update_user_data(self, user_id, data):
+        self._stage('user', user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._stage('chat', chat_id, data)
+
+    async def drop_user_data(self, user_id):
+        self._stage('user', user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._stage('chat', chat_id, None)
+
+    # Write whatever is still staged (called by PTB on shutdown)
+    async def flush(self):
+        if self._write_task is not None:
+            await self._write_task
+        await self._write()
+
+    async def _load(self, kind, key, data):
+        stored = self._stored[kind]
+        if key in stored:
+            stored.move_to_end(key)
+            return
+        try:
+            saved = await self.repo.load_context_data(kind, key)
+        except Exception as e:
+            # Marked as not loaded, so nothing is written over the stored copy
+            logger.warning(f"Could not load {kind} data for {key}: {e}")
+            self._unloaded[kind].add(key)
+            return
+        if key in stored:
+            return
+        if saved:
+            for name, value in saved.items():
+                data.setdefault(name, value)
+        self._unloaded[kind].discard(key)
+        self._remember(kind, key, hash(_encode(saved or {})))
+        self.loaded += 1
+
+    def _remember(self, kind, key, digest):
+        stored = self._stored[kind]
+        stored[key] = digest
+        stored.move_to_end(key)
+        if len(stored) > self.cache_size:
+            stored.popitem(last=False)
+            self.evicted += 1
+
+    def _stage(self, kind, key, data):
+        stored = self._stored[kind]
+        if data is None:
+            stored.pop(key, None)
+            self._unloaded[kind].discard(key)
+            self._staged[kind][key] = None
+        elif key in self._unloaded[kind]:
+            # The load failed: don't overwrite what is stored
+            return
+        else:
+            try:
+                text = _encode(data)
+            except (TypeError, ValueError) as e:
+                logger.error(f"Not persisting {kind} data for {key}: {e}")
+                self.errors += 1
+                return
+            if stored.get(key) == hash(text):
+                self.unchanged += 1
+                return
+            self._staged[kind][key] = text
+
+        # PTB runs all update_*_data calls of a pass together; start the
+        # write once, after they have all staged their entries
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write_after_pass())
+
+    async def _write_after_pass(self):
+        try:
+            await asyncio.sleep(0)
+            await self._write()
+        finally:
+            self._write_task = None
+
+    async def _write(self):
+        for kind, staged in self._staged.items():
+            if not staged:
+                continue
+            self._staged[kind] = {}
+            entries = list(staged.items())
+            try:
+                dropped = [key for key, text in entries if text is None]
+                if dropped:
+                    await self.repo.drop_context_data(kind, dropped)
+                saved = [(key, text) for key, text in entries if text is not None]
+                now = datetime.now()
+                for i in range(0, len(saved), self.batch_size):
+                    chunk = saved[i:i + self.batch_size]
+                    await self.repo.save_context_data(kind, chunk, now)
+                    for key, text in chunk:
+                        self._remember(kind, key, hash(text))
+                    self.written += len(chunk)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Could not persist {kind} data: {e}")
+                # Keep what failed for the next pass unless newer data was staged since
+                pending = self._staged[kind]
+                for key, text in entries:
+                    if key not in pending and (text is None or self._stored[kind].get(key) != hash(text)):
+                        pending[key] = text
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'written': self.written,
+            'unchanged': self.unchanged,
+            'remembered': sum(len(stored) for stored in self._stored.values()),
+            'evicted': self.evicted,
+            'staged': sum(len(staged) for staged in self._staged.values()),
+            'errors': self.errors,
+        }
@@ -0,0 +1,396 @@
+import os
+import logging
+from collections import OrderedDict, namedtuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+# Messages whose last content is remembered, to skip edits that change nothing
+RENDER_CACHE_SIZE = int(os.environ.get('RENDER_CACHE_SIZE', '100000'))
+
+# Ticket counts offered by "Buy Multiple" (one memo and one transfer per batch)
+BATCH_SIZES = (5, 10, 25, 50)
+
+# What a message shows: text, parse mode and keyboard. Keyboards are
+# InlineKeyboardMarkup, which PTB freezes once built, so the static ones
+# below are built once and shared by every call.
+Screen = namedtuple('Screen', 'text parse_mode reply_markup', defaults=(None, None))
+
+
+# Keyboard from rows of (label, callback_data)
+def keyboard(*rows):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(label, callback_data=data) for label, data in row]
+        for row in rows if row
+    ])
+
+
+BACK = ("⬅️ Back", 'back_to_main')
+
+# Main menu, by whether the user's wallet is connected: (keyboard, status line)
+MAIN_MENU = {
+    True: (keyboard(
+        [("💰 Buy Ticket", 'buy_ticket')],
+        [("🎟️ Buy Multiple", 'buy_multiple')],
+        [("🎫 My Tickets", 'my_tickets')],
+        [("🔥 Hot Numbers", 'hot_numbers')],
+        [("🔗 Wallet Settings", 'connect_wallet')],
+    ), "✅ Your wallet is connected!"),
+    False: (keyboard(
+        [("💰 Buy Ticket", 'buy_ticket')],
+        [("🎟️ Buy Multiple", 'buy_multiple')],
+        [("🎫 My Tickets", 'my_tickets')],
+        [("🔥 Hot Numbers", 'hot_numbers')],
+        [("🔗 Connect Wallet", 'connect_wallet')],
+    ), "🔗 Connect your wallet to purchase tickets easily"),
+}
+
+WELCOME_TEMPLATE = (
+    "Hi {mention}! Welcome to TON Lottery! 🎰\n\n"
+    "🎫 Buy lottery tickets for 1 TON each\n"
+    "💰 80% of all ticket sales go to the prize pool!\n"
+    "🏆 Weekly draws every Saturday at 20:00 UTC\n\n"
+    "{pool}\n"
+    "{status}"
+)
+MENU_TEMPLATE = "Hi {mention}! Welcome to TON Lottery! 🎰\n\n{pool}\n{status}"
+
+CONNECT_WALLET = Screen(
+    "🔗 Connect your TON wallet:\n\n"
+    "Select your wallet provider to connect. After connecting your wallet, "
+    "you'll be able to purchase tickets more easily!\n\n"
+    "💡 You can still buy tickets without connecting a wallet by sending TON manually.",
+    reply_markup=keyboard(
+        [("📱 Connect Tonkeeper", 'connect_tonkeeper')],
+        [("📲 Connect Tonhub", 'connect_tonhub')],
+        [BACK],
+    )
+)
+
+CONNECTED_KEYBOARD = keyboard(
+    [("✅ I'm Connected", 'wallet_connected')],
+    [("⬅️ Back", 'connect_wallet')],
+)
+
+CONNECT_TONKEEPER = Screen(
+    "📱 **Connecting Tonkeeper:**\n\n"
+    "1. **Open Tonkeeper** on your phone\n"
+    "2. **Tap the Scan button** in the app\n"
+    "3. **Scan this QR code** (when we implement it)\n"
+    "4. **Confirm the connection** in your wallet\n\n"
+    "🔒 **Your wallet remains secure** - we only request basic access\n\n"
+    "For now, we're simulating the connection process. "
+    "Click 'I'm Connected' below to proceed.",
+    'Markdown', CONNECTED_KEYBOARD
+)
+
+CONNECT_TONHUB = Screen(
+    "📲 **Connecting Tonhub:**\n\n"
+    "1. **Open Tonhub** on your phone\n"
+    "2. **Go to Settings** → **Connected Apps**\n"
+    "3. **Tap 'Connect New App'**\n"
+    "4. **Scan this QR code** (when we implement it)\n"
+    "5. **Confirm the connection** in your wallet\n\n"
+    "🔒 **Your wallet remains secure** - we only request basic access\n\n"
+    "For now, we're simulating the connection process. "
+    "Click 'I'm Connected' below to proceed.",
+    'Markdown', CONNECTED_KEYBOARD
+)
+
+WALLET_CONNECTED = Screen(
+    "✅ **Wallet Connected Successfully!**\n\n"
+    "Your TON wallet is now connected to your account.\n\n"
+    "🎉 **What you can do now:**\n"
+    "• Purchase lottery tickets seamlessly\n"
+    "• View your transaction history\n"
+    "• Participate in weekly draws\n\n"
+    "💰 **Next step:** Buy your first lottery ticket!",
+    'Markdown', MAIN_MENU[True][0]
+)
+
+BUY_MULTIPLE = Screen(
+    "🎟️ **Buy Multiple Tickets**\n\n"
+    "Each ticket gets its own random numbers. "
+    "You pay for the whole batch with a single transfer.",
+    'Markdown', keyboard(
+        *([(f"🎟️ {count} Tickets ({count} TON)", f'buyn_{count}')] for count in BATCH_SIZES),
+        [BACK],
+    )
+)
+
+EXPIRED_SELECTION_MESSAGE = "⌛ This selection is no longer available. Please buy a new ticket."
+EXPIRED_SELECTION = Screen(EXPIRED_SELECTION_MESSAGE, reply_markup=keyboard([BACK]))
+
+CHECKING_PAYMENT = Screen(
+    "🔍 **Checking for payment...**\n\n"
+    "Please wait while we verify your transaction on the blockchain...\n"
+    "This usually takes 2-3 minutes. We'll update this message once it's confirmed.",
+    'Markdown'
+)
+CHECKING_PAYMENT_AGAIN = Screen(
+    "🔍 **Checking for payment...**\n\n"
+    "Please wait while we verify your transaction...",
+    'Markdown'
+)
+
+HOT_NUMBERS_KEYBOARD = keyboard([("🔙 Back", 'back_to_main')])
+
+NO_TICKETS = Screen("You don't have any tickets yet. Buy your first ticket!")
+
+GOOD_LUCK = (
+    "🎉 **Good luck!** The draw will be on Saturday at 20:00 UTC.\n\n"
+    "💰 **Prize pool:** 80% of all ticket sales!\n"
+    "🏆 **To win:** Match all 6 numbers + bonus\n"
+    "🔐 The draw's seed is fixed in advance - check its hash with /draw"
+)
+
+
+# Main menu: the full welcome for /start, the short one for "Back"
+def main_menu_screen(mention, pool, wallet_connected, welcome=False):
+    reply_markup, status = MAIN_MENU[bool(wallet_connected)]
+    template = WELCOME_TEMPLATE if welcome else MENU_TEMPLATE
+    return Screen(template.format(mention=mention, pool=pool, status=status), 'HTML', reply_markup)
+
+
+# Main menu line with the live pool
+def format_pool_line(pool_ton, tickets):
+    return f"💰 Prize pool this round: {pool_ton:,.1f} TON ({tickets} tickets sold)\n"
+
+
+# Compact "numbers + bonus" lines for a batch, capped to keep messages short
+def format_ticket_lines(tickets, limit=10):
+    lines = [
+        f"🔢 {', '.join(map(str, ticket['numbers']))} + {ticket['bonus']}\n"
+        for ticket in tickets[:limit]
+    ]
+    if len(tickets) > limit:
+        lines.append(f"… and {len(tickets) - limit} more (see My Tickets)\n")
+    return ''.join(lines)
+
+
+def hot_numbers_screen(snapshot, pool_ton, hot, cold):
+    def format_numbers(ranked):
+        return ', '.join(f"{number} ({picks})" for number, picks in ranked)
+
+    text = (
+        f"🔥 **Hot Numbers** - draw of {snapshot.draw_round:%A %d %B}\n\n"
+        f"🎫 **Tickets sold:** {snapshot.tickets}\n"
+        f"💰 **Prize pool:** {pool_ton:,.1f} TON\n\n"
+    )
+    if snapshot.tickets:
+        text += (
+            f"🔥 **Most picked:** {format_numbers(hot)}\n"
+            f"❄️ **Least picked:** {format_numbers(cold)}\n\n"
+            f"Every combination has the same chance - but a rarely picked one shares its prize with fewer winners."
+        )
+    else:
+        text += "No paid tickets in this round yet."
+    return Screen(text, 'Markdown', HOT_NUMBERS_KEYBOARD)
+
+
+# Commit-reveal proof for /draw and the round announcement: the open round's
+# seed hash and, once revealed, the previous round's seed so anyone can
+# recompute its numbers with rng.draw_numbers(seed, round) and check the hash
+def draw_commitment_screen(draw_at, seed_hash, previous=None):
+    text = (
+        f"🔐 **Draw {draw_at:%Y-%m-%d} {draw_at:%H:%M} UTC**\n\n"
+        f"The numbers come from a secret seed fixed now and revealed after the draw.\n"
+        f"**Seed hash (sha256):** `{seed_hash}`\n"
+    )
+    if previous:
+        draw_round, seed_hash, seed, numbers, bonus = previous
+        text += (
+            f"\n🎰 **Draw {draw_round:%Y-%m-%d}:** {', '.join(map(str, numbers))} + {bonus}\n"
+            f"**Seed:** `{seed}`\n"
+            f"**Seed hash:** `{seed_hash}`"
+        )
+    return Screen(text, 'Markdown')
+
+
+# Ticket IDs and memos go in code spans: the "_" in TONLOTO_ would otherwise
+# open an italic entity in legacy Markdown and Telegram rejects the message
+def ticket_selection_screen(batch_id, tickets):
+    if len(tickets) == 1:
+        text = (
+            f"🎫 **Your Lottery Ticket**\n\n"
+            f"🔢 **Numbers:** {', '.join(map(str, tickets[0]['numbers']))}\n"
+            f"⭐ **Bonus:** {tickets[0]['bonus']}\n\n"
+            f"📋 **Ticket ID:** `{batch_id}`\n"
+            f"💰 **Price:** 1 TON\n\n"
+            f"✅ **Confirm purchase?**"
+        )
+    else:
+        text = (
+            f"🎟️ **Your {len(tickets)} Lottery Tickets**\n\n"
+            f"{format_ticket_lines(tickets)}\n"
+            f"📋 **Batch ID:** `{batch_id}`\n"
+            f"💰 **Price:** {len(tickets)} TON\n\n"
+            f"✅ **Confirm purchase?**"
+        )
+    return Screen(text, 'Markdown', keyboard(
+        [("✅ Confirm Purchase", f'confirm_{batch_id}')],
+        [("❌ Cancel", 'back_to_main')],
+    ))
+
+
+def payment_instructions_screen(ticket_id, count, user_id, wallet_address):
+    text = (
+        f"💳 **Payment Instructions**\n\n"
+        f"Please send exactly **{count} TON** to:\n"
+        f"`{wallet_address}`\n\n"
+        f"📋 **Important Details:**\n"
+        f"• Amount: **{count} TON** (exactly)\n"
+        f"• Network: **TON Blockchain**\n"
+        f"• Memo: `{ticket_id}` (include this!)\n"
+        f"• User ID: `{user_id}`\n\n"
+        f"⏱️ **After sending**, click 'I've Paid' below.\n"
+        f"🔄 Payment confirmation takes 2-3 minutes."
+    )
+    return Screen(text, 'Markdown', keyboard(
+        [("💳 I've Paid", f'pay_{ticket_id}')],
+        [("🔍 Check Payment", f'check_{ticket_id}')],
+        [BACK],
+    ))
+
+
+# tickets: [{'ticket_id', 'numbers', 'bonus'}] of one paid memo
+def payment_confirmed_screen(ticket_id, tickets):
+    if len(tickets) == 1:
+        text = (
+            f"✅ **Payment Confirmed!**\n\n"
+            f"🎫 **Your Lottery Ticket:**\n"
+            f"Numbers: {', '.join(map(str, tickets[0]['numbers']))}\n"
+            f"Bonus: {tickets[0]['bonus']}\n\n"
+            f"📋 **Ticket ID:** `{ticket_id}`\n\n"
+        )
+    else:
+        text = (
+            f"✅ **Payment Confirmed!**\n\n"
+            f"🎟️ **Your {len(tickets)} Lottery Tickets:**\n"
+            f"{format_ticket_lines(tickets)}\n"
+            f"📋 **Batch ID:** `{ticket_id}`\n\n"
+        )
+    return Screen(text + GOOD_LUCK, 'Markdown')
+
+
+def payment_not_received_screen(ticket_id, count, wallet_address):
+    text = (
+        f"❌ **Payment Not Received Yet**\n\n"
+        f"Please verify:\n"
+        f"1. ✅ Sent exactly **{count} TON**\n"
+        f"2. ✅ Used address: `{wallet_address}`\n"
+        f"3. ✅ Included memo: `{ticket_id}`\n"
+        f"4. ⏱️ Wait 2-3 minutes for blockchain confirmation\n\n"
+        f"Click 'Check Again' after waiting."
+    )
+    return Screen(text, 'Markdown', keyboard(
+        [("🔍 Check Again", f'check_{ticket_id}')],
+        [("💳 Try Payment Again", f'pay_{ticket_id}')],
+        [BACK],
+    ))
+
+
+# One "My Tickets" page; rows are (id, ticket_id, numbers, bonus, purchased_at,
+# status), newer/older are the paging callbacks (None hides the button)
+def ticket_page_screen(summary, tickets, newer=None, older=None):
+    paid = summary.get('paid', 0)
+    pending = summary.get('pending', 0)
+    text = (
+        f"🎫 **Your Tickets** ({sum(summary.values())} total)\n"
+        f"✅ Paid: {paid} | ⏳ Pending: {pending}\n\n"
+    )
+    for ticket in tickets:
+        status = "✅ Paid" if ticket[5] == 'paid' else "⏳ Pending"
+        text += (
+            f"📋 **ID:** `{ticket[1]}`\n"
+            f"🔢 **Numbers:** {', '.join(map(str, ticket[2]))} + {ticket[3]}\n"
+            f"📅 **Purchased:** {ticket[4].strftime('%Y-%m-%d %H:%M')}\n"
+            f"📊 **Status:** {status}\n\n"
+        )
+    paging = []
+    if newer:
+        paging.append(("⬅️ Newer", newer))
+    if older:
+        paging.append(("Older ➡️", older))
+    return Screen(text, 'Markdown', keyboard(paging, [BACK]))
+
+
+# Content hash of a screen: what Telegram compares to decide "message is not modified"
+def screen_digest(screen):
+    markup = screen.reply_markup
+    buttons = () if markup is None else tuple(
+        tuple((button.text, button.callback_data, button.url) for button in row)
+        for row in markup.inline_keyboard
+    )
+    return hash((screen.text, screen.parse_mode, buttons))
+
+
+# Sends and edits bot messages, remembering a content hash per message (LRU,
+# RENDER_CACHE_SIZE entries). An edit to the content a message already shows
+# is skipped without an API call - Telegram would only reject it with "message
+# is not modified". All edits of bot messages go through here, so the hash
+# stays in step with what the chat shows; a message that isn't cached (after a
+# restart or eviction) is simply edited, and "not modified" is then ignored.
+class MessageRenderer:
+    def __init__(self, max_size=RENDER_CACHE_SIZE):
+        self.max_size = max_size
+        self._digests = OrderedDict()
+        self.sent = 0
+        self.edited = 0
+        self.skipped = 0
+        self.not_modified = 0
+
+    async def reply(self, message, screen):
+        sent = await message.reply_text(screen.text, parse_mode=screen.parse_mode, reply_markup=screen.reply_markup)
+        self.sent += 1
+        self._remember((sent.chat_id, sent.message_id), screen_digest(screen))
+        return sent
+
+    # Edit unless the message already shows `screen`; returns whether it changed
+    async def edit(self, bot, chat_id, message_id, screen):
+        key = (chat_id, message_id)
+        digest = screen_digest(screen)
+        if self._digests.get(key) == digest:
+            self.skipped += 1
+            self._digests.move_to_end(key)
+            return False
+        try:
+            await bot.edit_message_text(
+                screen.text, chat_id=chat_id, message_id=message_id,
+                parse_mode=screen.parse_mode, reply_markup=screen.reply_markup
+            )
+        except BadRequest as e:
+            if 'not modified' not in e.message:
+                self._digests.pop(key, None)
+                raise
+            self.not_modified += 1
+            self._remember(key, digest)
+            return False
+        except Exception:
+            self._digests.pop(key, None)
+            raise
+        self.edited += 1
+        self._remember(key, digest)
+        return True
+
+    # Edit the message the callback query's button belongs to
+    async def edit_query(self, query, screen):
+        message = query.message
+        return await self.edit(query.get_bot(), message.chat_id, message.message_id, screen)
+
+    def _remember(self, key, digest):
+        self._digests[key] = digest
+        self._digests.move_to_end(key)
+        if len(self._digests) > self.max_size:
+            self._digests.popitem(last=False)
+
+    def stats(self):
+        return {
+            'cached': len(self._digests),
+            'sent': self.sent,
+            'edited': self.edited,
+            'skipped': self.skipped,
+            'not_modified': self.not_modified,
+        }
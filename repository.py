@@ -0,0 +1,1086 @@
+import json
+import time
+import logging
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from collections import Counter
+
+from psycopg2.extras import execute_values
+
+from db import Database, DatabaseUnavailable
+from metrics import DB_QUERY_LATENCY, DB_ERRORS
+from migrations import migrate
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# Ticket columns in exports, in order
+EXPORT_COLUMNS = (
+    'ticket_id', 'batch_id', 'user_id', 'username', 'numbers', 'bonus_number',
+    'purchased_at', 'draw_round', 'payment_status',
+)
+
+# Persisted context.user_data / context.chat_data: kind -> (table, key column)
+CONTEXT_TABLES = {'user': ('user_data', 'user_id'), 'chat': ('chat_data', 'chat_id')}
+
+
+# Storage used by the handlers, the payment verifier and the ingestor.
+# Ticket rows passed to insert_tickets are
+#   (user_id, username, numbers, bonus, ticket_id, batch_id, purchased_at, draw_round)
+# and ticket pages come back as
+#   (id, ticket_id, numbers, bonus_number, purchased_at, payment_status)
+# Backends raise DatabaseUnavailable while they are not open.
+class Repository:
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @property
+    def is_open(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+    # Apply pending schema migrations; returns the versions applied
+    async def migrate(self):
+        raise NotImplementedError
+
+    # Users
+
+    # Create or rename the user; returns their wallet_connected flag
+    async def upsert_user(self, user_id, username):
+        raise NotImplementedError
+
+    # (username, wallet_connected) or None
+    async def get_user(self, user_id):
+        raise NotImplementedError
+
+    async def set_wallet_connected(self, user_id):
+        raise NotImplementedError
+
+    # Tickets
+
+    async def insert_tickets(self, rows):
+        raise NotImplementedError
+
+    async def batch_size(self, batch_id, user_id):
+        raise NotImplementedError
+
+    # [(ticket_id, numbers, bonus_number)] of a batch in purchase order
+    async def batch_tickets(self, batch_id, user_id):
+        raise NotImplementedError
+
+    # {payment_status: count}
+    async def ticket_summary(self, user_id):
+        raise NotImplementedError
+
+    # Up to `limit` tickets, newest first; with `before`/`after` = (purchased_at, id)
+    # only tickets older/newer than that position (`after` pages come back oldest first)
+    async def ticket_page(self, user_id, limit, before=None, after=None):
+        raise NotImplementedError
+
+    # Payments
+
+    # The subset of batch_ids whose tickets are paid
+    async def paid_batches(self, batch_ids):
+        raise NotImplementedError
+
+    # Saved ingestion cursor (lt, hash) or None, and [(batch_id, tickets)] still pending
+    async def load_ingest_state(self, cursor_key):
+        raise NotImplementedError
+
+    # Mark batches paid, add them to the round statistics, record underpaid
+    # transfers [(tx_hash, lt, batch_id, sender, amount, expected)] and save
+    # the ingestion cursor in one transaction; returns the batch_ids that
+    # were still pending
+    async def mark_paid(self, batch_ids, cursor_key, lt, tx_hash, underpaid=()):
+        raise NotImplementedError
+
+    # Paid tickets of a round and {number: times picked}
+    async def round_stats(self, draw_round):
+        raise NotImplementedError
+
+    # Delete up to `limit` whole batches still pending since before `cutoff`;
+    # returns (deleted batch_ids, deleted ticket rows)
+    async def expire_pending(self, cutoff, limit):
+        raise NotImplementedError
+
+    # Draws (commit-reveal, see draw.py)
+
+    # Store a round's commitment unless it already has one; returns the
+    # round's seed_hash
+    async def commit_draw(self, draw_round, seed_hash, seed):
+        raise NotImplementedError
+
+    # (seed_hash, seed, numbers, bonus_number) or None; numbers is None until revealed
+    async def get_draw(self, draw_round):
+        raise NotImplementedError
+
+    # Record the drawn numbers unless the round was already revealed;
+    # returns the stored (seed, numbers, bonus_number)
+    async def reveal_draw(self, draw_round, numbers, bonus, now):
+        raise NotImplementedError
+
+    # Committed rounds before `draw_round` that are not settled yet, oldest first
+    async def unsettled_draws(self, draw_round):
+        raise NotImplementedError
+
+    async def mark_draw_settled(self, draw_round, now):
+        raise NotImplementedError
+
+    # Paid tickets of a round: [(ticket_id, user_id, numbers, bonus_number)]
+    async def round_tickets(self, draw_round):
+        raise NotImplementedError
+
+    # Broadcast outbox
+
+    # Add [(chat_id, text, parse_mode)] to a campaign, skipping chats already
+    # in it; returns the number of rows added
+    async def enqueue_outbox(self, campaign, rows, now):
+        raise NotImplementedError
+
+    # Claim up to `limit` due messages: [(id, chat_id, text, parse_mode, attempts)]
+    async def claim_outbox(self, limit, now):
+        raise NotImplementedError
+
+    # Put messages claimed by a previous run back in the queue
+    async def requeue_outbox(self):
+        raise NotImplementedError
+
+    # Record a sent batch: sent ids, retries [(id, not_before, error)], failures [(id, error)]
+    async def complete_outbox(self, sent, retries, failures, now):
+        raise NotImplementedError
+
+    # {status: count}, for one campaign or all of them
+    async def outbox_counts(self, campaign=None):
+        raise NotImplementedError
+
+    # Exports
+
+    # Async generator of ticket chunks (rows in EXPORT_COLUMNS order) for one
+    # round and/or a purchase time range [since, until) and/or a status
+    def stream_tickets(self, draw_round=None, since=None, until=None, status=None, chunk_size=10_000):
+        raise NotImplementedError
+
+    # Context data (kind is 'user' or 'chat')
+
+    # The stored dict for one user or chat, or None
+    async def load_context_data(self, kind, key):
+        raise NotImplementedError
+
+    # Upsert [(key, json_text)] in one transaction
+    async def save_context_data(self, kind, rows, now):
+        raise NotImplementedError
+
+    async def drop_context_data(self, kind, keys):
+        raise NotImplementedError
+
+
+class PostgresRepository(Repository):
+    def __init__(self, db):
+        self.db = db
+
+    async def open(self):
+        await self.db.open()
+
+    async def close(self):
+        await self.db.close()
+
+    @property
+    def is_open(self):
+        return self.db.is_open
+
+    def stats(self):
+        return self.db.stats()
+
+    async def migrate(self):
+        return await self.db.run(migrate)
+
+    async def upsert_user(self, user_id, username):
+        row = await self.db.fetchone('''
+        INSERT INTO users (user_id, username)
+        VALUES (%s, %s)
+        ON CONFLICT (user_id) DO UPDATE SET username = EXCLUDED.username
+        RETURNING wallet_connected
+        ''', (user_id, username))
+        return bool(row[0])
+
+    async def get_user(self, user_id):
+        row = await self.db.fetchone('SELECT username, wallet_connected FROM users WHERE user_id = %s', (user_id,))
+        return (row[0], bool(row[1])) if row else None
+
+    async def set_wallet_connected(self, user_id):
+        await self.db.execute('''
+        UPDATE users SET wallet_connected = TRUE
+        WHERE user_id = %s
+        ''', (user_id,))
+
+    async def insert_tickets(self, rows):
+        # One multi-row insert for the whole batch
+        def _insert_batch(cursor):
+            execute_values(cursor, '''
+            INSERT INTO tickets (user_id, username, numbers, bonus_number, ticket_id, batch_id, purchased_at, draw_round)
+            VALUES %s
+            ''', rows, template='(%s, %s, %s::SMALLINT[], %s, %s, %s, %s, %s)')
+        await self.db.run(_insert_batch)
+
+    async def batch_size(self, batch_id, user_id):
+        row = await self.db.fetchone(
+            'SELECT COUNT(*) FROM tickets WHERE batch_id = %s AND user_id = %s', (batch_id, user_id)
+        )
+        return row[0] if row else 0
+
+    async def batch_tickets(self, batch_id, user_id):
+        return await self.db.fetchall('''
+        SELECT ticket_id, numbers, bonus_number FROM tickets
+        WHERE batch_id = %s AND user_id = %s ORDER BY id
+        ''', (batch_id, user_id))
+
+    async def ticket_summary(self, user_id):
+        rows = await self.db.fetchall('''
+        SELECT payment_status, COUNT(*) FROM tickets WHERE user_id = %s GROUP BY payment_status
+        ''', (user_id,))
+        return dict(rows)
+
+    async def ticket_page(self, user_id, limit, before=None, after=None):
+        columns = 'id, ticket_id, numbers, bonus_number, purchased_at, payment_status'
+        if after is not None:
+            return await self.db.fetchall(f'''
+            SELECT {columns} FROM tickets
+            WHERE user_id = %s AND (purchased_at, id) > (%s, %s)
+            ORDER BY purchased_at ASC, id ASC LIMIT %s
+            ''', (user_id, after[0], after[1], limit))
+        if before is not None:
+            return await self.db.fetchall(f'''
+            SELECT {columns} FROM tickets
+            WHERE user_id = %s AND (purchased_at, id) < (%s, %s)
+            ORDER BY purchased_at DESC, id DESC LIMIT %s
+            ''', (user_id, before[0], before[1], limit))
+        return await self.db.fetchall(f'''
+        SELECT {columns} FROM tickets WHERE user_id = %s
+        ORDER BY purchased_at DESC, id DESC LIMIT %s
+        ''', (user_id, limit))
+
+    async def paid_batches(self, batch_ids):
+        rows = await self.db.fetchall('''
+        SELECT DISTINCT batch_id FROM tickets
+        WHERE batch_id = ANY(%s) AND payment_status = 'paid'
+        ''', (list(batch_ids),))
+        return {row[0] for row in rows}
+
+    async def load_ingest_state(self, cursor_key):
+        def _load(cursor):
+            cursor.execute('SELECT last_lt, last_hash FROM ton_ingest_cursor WHERE address = %s', (cursor_key,))
+            saved = cursor.fetchone()
+            cursor.execute('''
+            SELECT batch_id, COUNT(*) FROM tickets
+            WHERE payment_status = 'pending' GROUP BY batch_id
+            ''')
+            return saved, cursor.fetchall()
+        return await self.db.run(_load)
+
+    async def mark_paid(self, batch_ids, cursor_key, lt, tx_hash, underpaid=()):
+        def _mark_paid(cursor):
+            paid = set()
+            if batch_ids:
+                # Every ticket of a batch flips in this one statement
+                cursor.execute('''
+                UPDATE tickets SET payment_status = 'paid'
+                WHERE batch_id = ANY(%s) AND payment_status = 'pending'
+                RETURNING batch_id, draw_round, numbers
+                ''', (list(batch_ids),))
+                rows = cursor.fetchall()
+                paid = {row[0] for row in rows}
+                rounds, picks = _round_deltas(rows)
+                if rounds:
+                    execute_values(cursor, '''
+                    INSERT INTO round_stats (draw_round, tickets_paid) VALUES %s
+                    ON CONFLICT (draw_round) DO UPDATE
+                    SET tickets_paid = round_stats.tickets_paid + EXCLUDED.tickets_paid
+                    ''', rounds)
+                    execute_values(cursor, '''
+                    INSERT INTO round_number_stats (draw_round, number, picks) VALUES %s
+                    ON CONFLICT (draw_round, number) DO UPDATE
+                    SET picks = round_number_stats.picks + EXCLUDED.picks
+                    ''', picks, page_size=1000)
+            if underpaid:
+                execute_values(cursor, '''
+                INSERT INTO underpaid_transfers (tx_hash, lt, batch_id, sender, amount, expected) VALUES %s
+                ON CONFLICT (tx_hash) DO NOTHING
+                ''', list(underpaid))
+            cursor.execute('''
+            INSERT INTO ton_ingest_cursor (address, last_lt, last_hash)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (address) DO UPDATE
+            SET last_lt = EXCLUDED.last_lt, last_hash = EXCLUDED.last_hash
+            ''', (cursor_key, lt, tx_hash))
+            return paid
+        return await self.db.run(_mark_paid)
+
+    async def round_stats(self, draw_round):
+        def _round_stats(cursor):
+            cursor.execute('SELECT tickets_paid FROM round_stats WHERE draw_round = %s', (draw_round,))
+            row = cursor.fetchone()
+            cursor.execute('SELECT number, picks FROM round_number_stats WHERE draw_round = %s', (draw_round,))
+            return (row[0] if row else 0), dict(cursor.fetchall())
+        return await self.db.run(_round_stats)
+
+    async def expire_pending(self, cutoff, limit):
+        # Whole batches only, so a late payment never finds half a batch
+        rows = await self.db.fetchall('''
+        DELETE FROM tickets
+        WHERE payment_status = 'pending' AND batch_id IN (
+            SELECT DISTINCT batch_id FROM tickets
+            WHERE payment_status = 'pending' AND purchased_at < %s
+            LIMIT %s
+        )
+        RETURNING batch_id
+        ''', (cutoff, limit))
+        return {row[0] for row in rows}, len(rows)
+
+    async def commit_draw(self, draw_round, seed_hash, seed):
+        def _commit_draw(cursor):
+            cursor.execute('''
+            INSERT INTO draws (draw_round, seed_hash, seed) VALUES (%s, %s, %s)
+            ON CONFLICT (draw_round) DO NOTHING
+            ''', (draw_round, seed_hash, seed))
+            cursor.execute('SELECT seed_hash FROM draws WHERE draw_round = %s', (draw_round,))
+            return cursor.fetchone()[0]
+        return await self.db.run(_commit_draw)
+
+    async def get_draw(self, draw_round):
+        row = await self.db.fetchone(
+            'SELECT seed_hash, seed, numbers, bonus_number FROM draws WHERE draw_round = %s', (draw_round,)
+        )
+        return tuple(row) if row else None
+
+    async def reveal_draw(self, draw_round, numbers, bonus, now):
+        def _reveal_draw(cursor):
+            cursor.execute('''
+            UPDATE draws SET numbers = %s::SMALLINT[], bonus_number = %s, revealed_at = %s
+            WHERE draw_round = %s AND numbers IS NULL
+            ''', (numbers, bonus, now, draw_round))
+            cursor.execute('SELECT seed, numbers, bonus_number FROM draws WHERE draw_round = %s', (draw_round,))
+            seed, numbers, bonus = cursor.fetchone()
+            return seed, list(numbers), bonus
+        return await self.db.run(_reveal_draw)
+
+    async def unsettled_draws(self, draw_round):
+        rows = await self.db.fetchall('''
+        SELECT draw_round FROM draws WHERE settled_at IS NULL AND draw_round < %s ORDER BY draw_round
+        ''', (draw_round,))
+        return [row[0] for row in rows]
+
+    async def mark_draw_settled(self, draw_round, now):
+        await self.db.execute('UPDATE draws SET settled_at = %s WHERE draw_round = %s', (now, draw_round))
+
+    async def round_tickets(self, draw_round):
+        return await self.db.fetchall('''
+        SELECT ticket_id, user_id, numbers, bonus_number FROM tickets
+        WHERE payment_status = 'paid' AND draw_round = %s
+        ''', (draw_round,))
+
+    async def enqueue_outbox(self, campaign, rows, now):
+        def _enqueue_outbox(cursor):
+            added = execute_values(cursor, '''
+            INSERT INTO outbox (campaign, chat_id, text, parse_mode, not_before)
+            VALUES %s
+            ON CONFLICT (campaign, chat_id) DO NOTHING
+            RETURNING id
+            ''', [(campaign, chat_id, text, parse_mode, now) for chat_id, text, parse_mode in rows],
+                page_size=1000, fetch=True)
+            return len(added)
+        return await self.db.run(_enqueue_outbox)
+
+    async def claim_outbox(self, limit, now):
+        # SKIP LOCKED lets a second sender (or a stuck one) never block this one
+        rows = await self.db.fetchall('''
+        UPDATE outbox SET status = 'sending', attempts = attempts + 1
+        WHERE id IN (
+            SELECT id FROM outbox
+            WHERE status = 'queued' AND not_before <= %s
+            ORDER BY not_before, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, chat_id, text, parse_mode, attempts
+        ''', (now, limit))
+        return sorted(rows)
+
+    async def requeue_outbox(self):
+        return await self.db.execute("UPDATE outbox SET status = 'queued' WHERE status = 'sending'")
+
+    async def complete_outbox(self, sent, retries, failures, now):
+        def _complete_outbox(cursor):
+            if sent:
+                cursor.execute('''
+                UPDATE outbox SET status = 'sent', sent_at = %s, error = NULL WHERE id = ANY(%s)
+                ''', (now, sent))
+            if retries:
+                execute_values(cursor, '''
+                UPDATE outbox SET status = 'queued', not_before = v.not_before, error = v.error
+                FROM (VALUES %s) AS v (id, not_before, error)
+                WHERE outbox.id = v.id
+                ''', retries, template='(%s, %s::TIMESTAMP, %s)')
+            if failures:
+                execute_values(cursor, '''
+                UPDATE outbox SET status = 'failed', error = v.error
+                FROM (VALUES %s) AS v (id, error)
+                WHERE outbox.id = v.id
+                ''', failures)
+        await self.db.run(_complete_outbox)
+
+    async def outbox_counts(self, campaign=None):
+        if campaign is None:
+            rows = await self.db.fetchall('SELECT status, COUNT(*) FROM outbox GROUP BY status')
+        else:
+            rows = await self.db.fetchall(
+                'SELECT status, COUNT(*) FROM outbox WHERE campaign = %s GROUP BY status', (campaign,)
+            )
+        return dict(rows)
+
+    async def stream_tickets(self, draw_round=None, since=None, until=None, status=None, chunk_size=10_000):
+        where, params = _export_filters(draw_round, since, until, status, '%s')
+        # Named cursor: Postgres keeps the result, we fetch it a chunk at a time
+        async for rows in self.db.stream(
+            f"SELECT {', '.join(EXPORT_COLUMNS)} FROM tickets WHERE {where}", params,
+            chunk_size=chunk_size, name='export_tickets'
+        ):
+            yield rows
+
+    async def load_context_data(self, kind, key):
+        table, column = CONTEXT_TABLES[kind]
+        # psycopg2 decodes JSONB into a dict
+        row = await self.db.fetchone(f'SELECT data FROM {table} WHERE {column} = %s', (key,))
+        return row[0] if row else None
+
+    async def save_context_data(self, kind, rows, now):
+        table, column = CONTEXT_TABLES[kind]
+
+        def _save_context_data(cursor):
+            execute_values(cursor, f'''
+            INSERT INTO {table} ({column}, data, updated_at)
+            VALUES %s
+            ON CONFLICT ({column}) DO UPDATE
+            SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+            ''', [(key, data, now) for key, data in rows], template='(%s, %s::JSONB, %s)', page_size=1000)
+        await self.db.run(_save_context_data)
+
+    async def drop_context_data(self, kind, keys):
+        table, column = CONTEXT_TABLES[kind]
+        await self.db.execute(f'DELETE FROM {table} WHERE {column} = ANY(%s)', (list(keys),))
+
+
+# SQLite schema, versioned with PRAGMA user_version. Numbers are stored as
+# "1,2,3,4,5,6" text and timestamps as fixed-width text so they sort correctly.
+SQLITE_MIGRATIONS = [
+    (1, 'initial', [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            wallet_connected INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            numbers TEXT NOT NULL,
+            bonus_number INTEGER,
+            ticket_id TEXT UNIQUE,
+            batch_id TEXT NOT NULL,
+            purchased_at TEXT NOT NULL,
+            draw_round TEXT,
+            payment_status TEXT NOT NULL DEFAULT 'pending'
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS tickets_user_page_idx ON tickets (user_id, purchased_at DESC, id DESC)',
+        'CREATE INDEX IF NOT EXISTS tickets_batch_idx ON tickets (batch_id)',
+        "CREATE INDEX IF NOT EXISTS tickets_pending_idx ON tickets (batch_id) WHERE payment_status = 'pending'",
+        'CREATE INDEX IF NOT EXISTS tickets_draw_round_idx ON tickets (draw_round)',
+        '''
+        CREATE TABLE IF NOT EXISTS ton_ingest_cursor (
+            address TEXT PRIMARY KEY,
+            last_lt INTEGER NOT NULL,
+            last_hash TEXT NOT NULL
+        )
+        ''',
+    ]),
+    (2, 'pending_expiry_index', [
+        # Pending expiry scans by purchase time; the ingestor still reads batch_id
+        'DROP INDEX IF EXISTS tickets_pending_idx',
+        "CREATE INDEX tickets_pending_idx ON tickets (purchased_at, batch_id) WHERE payment_status = 'pending'",
+    ]),
+    (3, 'broadcast_outbox', [
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            campaign TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            not_before TEXT NOT NULL,
+            sent_at TEXT,
+            error TEXT,
+            UNIQUE (campaign, chat_id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS outbox_due_idx ON outbox (not_before, id) WHERE status = 'queued'",
+        "CREATE INDEX IF NOT EXISTS outbox_sending_idx ON outbox (id) WHERE status = 'sending'",
+    ]),
+    (4, 'context_data', [
+        '''
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS chat_data (
+            chat_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        ''',
+    ]),
+    (5, 'round_stats', [
+        '''
+        CREATE TABLE IF NOT EXISTS round_stats (
+            draw_round TEXT PRIMARY KEY,
+            tickets_paid INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS round_number_stats (
+            draw_round TEXT NOT NULL,
+            number INTEGER NOT NULL,
+            picks INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (draw_round, number)
+        )
+        ''',
+        '''
+        INSERT INTO round_stats (draw_round, tickets_paid)
+        SELECT draw_round, COUNT(*) FROM tickets
+        WHERE payment_status = 'paid' AND draw_round IS NOT NULL
+        GROUP BY draw_round
+        ''',
+        '''
+        INSERT INTO round_number_stats (draw_round, number, picks)
+        SELECT draw_round, picked.value, COUNT(*) FROM tickets, json_each('[' || numbers || ']') AS picked
+        WHERE payment_status = 'paid' AND draw_round IS NOT NULL
+        GROUP BY draw_round, picked.value
+        ''',
+    ]),
+    (6, 'draws', [
+        '''
+        CREATE TABLE IF NOT EXISTS draws (
+            draw_round TEXT PRIMARY KEY,
+            seed_hash TEXT NOT NULL,
+            seed TEXT NOT NULL,
+            numbers TEXT,
+            bonus_number INTEGER,
+            committed_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+            revealed_at TEXT,
+            settled_at TEXT
+        )
+        ''',
+    ]),
+    (7, 'underpaid_transfers', [
+        '''
+        CREATE TABLE IF NOT EXISTS underpaid_transfers (
+            tx_hash TEXT PRIMARY KEY,
+            lt INTEGER NOT NULL,
+            batch_id TEXT NOT NULL,
+            sender TEXT,
+            amount INTEGER NOT NULL,
+            expected INTEGER NOT NULL,
+            seen_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+            resolved_at TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS underpaid_transfers_batch_idx ON underpaid_transfers (batch_id)',
+    ]),
+]
+
+
+# WHERE clause and parameters for the export filters (values already encoded)
+def _export_filters(draw_round, since, until, status, placeholder):
+    clauses, params = [], []
+    for clause, value in (
+        ('draw_round = {}', draw_round),
+        ('purchased_at >= {}', since),
+        ('purchased_at < {}', until),
+        ('payment_status = {}', status),
+    ):
+        if value is not None:
+            clauses.append(clause.format(placeholder))
+            params.append(value)
+    return ' AND '.join(clauses) or 'TRUE', params
+
+
+# Per-round deltas from newly paid (batch_id, draw_round, numbers) rows:
+# [(draw_round, tickets)] and [(draw_round, number, picks)], sorted so that
+# concurrent writers lock the counter rows in the same order
+def _round_deltas(rows):
+    tickets = Counter()
+    picks = Counter()
+    for _batch_id, draw_round, numbers in rows:
+        if draw_round is None:
+            continue
+        tickets[draw_round] += 1
+        for number in numbers:
+            picks[draw_round, int(number)] += 1
+    return sorted(tickets.items()), sorted((draw_round, number, count) for (draw_round, number), count in picks.items())
+
+
+def _encode_numbers(numbers):
+    return ','.join(map(str, numbers))
+
+
+def _decode_numbers(text):
+    return [int(n) for n in text.split(',')]
+
+
+def _encode_timestamp(value):
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+# Single-file (or in-memory) backend for tests, benchmarks and small deployments.
+# One connection in WAL mode with synchronous=NORMAL, used from one dedicated
+# worker thread: transactions run one at a time, in call order, and a bulk
+# statement (a round's tickets, an expiry batch, an export chunk) blocks only
+# other database calls, never the event loop.
+class SQLiteRepository(Repository):
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._conn = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._queries = 0
+        self._errors = 0
+
+    async def open(self):
+        if self._conn is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self._conn = await self._in_worker(self._connect)
+        logger.info(f"SQLite database opened at {self.path}")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    # Closes after every transaction already queued on the worker
+    async def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        await self._in_worker(conn.close)
+        self._executor.shutdown()
+        self._executor = None
+        logger.info(f"SQLite database closed: {self.stats()}")
+
+    async def _in_worker(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    @property
+    def is_open(self):
+        return self._conn is not None
+
+    def stats(self):
+        return {'queries': self._queries, 'errors': self._errors}
+
+    # Run fn(conn) inside one transaction on the database thread
+    async def _run(self, fn, *args):
+        if self._conn is None:
+            raise DatabaseUnavailable("Database is not open")
+        return await self._in_worker(self._transaction, fn, *args)
+
+    def _transaction(self, fn, *args):
+        operation = fn.__name__.strip('_')
+        started = time.monotonic()
+        with self._lock:
+            if self._conn is None:
+                raise DatabaseUnavailable("Database is not open")
+            self._queries += 1
+            try:
+                self._conn.execute('BEGIN IMMEDIATE')
+                result = fn(self._conn, *args)
+                self._conn.execute('COMMIT')
+                return result
+            except Exception:
+                self._errors += 1
+                DB_ERRORS.inc(operation=operation)
+                if self._conn.in_transaction:
+                    self._conn.execute('ROLLBACK')
+                raise
+            finally:
+                DB_QUERY_LATENCY.observe(time.monotonic() - started, operation=operation)
+
+    async def migrate(self):
+        def _migrate(conn):
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            applied = []
+            for number, name, statements in SQLITE_MIGRATIONS:
+                if number <= version:
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {number}')
+                applied.append(number)
+            return applied
+        return await self._run(_migrate)
+
+    async def upsert_user(self, user_id, username):
+        def _upsert_user(conn):
+            return conn.execute('''
+            INSERT INTO users (user_id, username) VALUES (?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET username = excluded.username
+            RETURNING wallet_connected
+            ''', (user_id, username)).fetchone()
+        return bool((await self._run(_upsert_user))[0])
+
+    async def get_user(self, user_id):
+        def _get_user(conn):
+            return conn.execute('SELECT username, wallet_connected FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        row = await self._run(_get_user)
+        return (row[0], bool(row[1])) if row else None
+
+    async def set_wallet_connected(self, user_id):
+        def _set_wallet_connected(conn):
+            conn.execute('UPDATE users SET wallet_connected = 1 WHERE user_id = ?', (user_id,))
+        await self._run(_set_wallet_connected)
+
+    async def insert_tickets(self, rows):
+        encoded = [
+            (user_id, username, _encode_numbers(numbers), bonus, ticket_id, batch_id,
+             _encode_timestamp(purchased_at), draw_round.isoformat())
+            for user_id, username, numbers, bonus, ticket_id, batch_id, purchased_at, draw_round in rows
+        ]
+
+        def _insert_batch(conn):
+            conn.executemany('''
+            INSERT INTO tickets (user_id, username, numbers, bonus_number, ticket_id, batch_id, purchased_at, draw_round)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', encoded)
+        await self._run(_insert_batch)
+
+    async def batch_size(self, batch_id, user_id):
+        def _batch_size(conn):
+            return conn.execute(
+                'SELECT COUNT(*) FROM tickets WHERE batch_id = ? AND user_id = ?', (batch_id, user_id)
+            ).fetchone()[0]
+        return await self._run(_batch_size)
+
+    async def batch_tickets(self, batch_id, user_id):
+        def _batch_tickets(conn):
+            return conn.execute('''
+            SELECT ticket_id, numbers, bonus_number FROM tickets
+            WHERE batch_id = ? AND user_id = ? ORDER BY id
+            ''', (batch_id, user_id)).fetchall()
+        return [(ticket_id, _decode_numbers(numbers), bonus) for ticket_id, numbers, bonus in await self._run(_batch_tickets)]
+
+    async def ticket_summary(self, user_id):
+        def _ticket_summary(conn):
+            return conn.execute('''
+            SELECT payment_status, COUNT(*) FROM tickets WHERE user_id = ? GROUP BY payment_status
+            ''', (user_id,)).fetchall()
+        return dict(await self._run(_ticket_summary))
+
+    async def ticket_page(self, user_id, limit, before=None, after=None):
+        columns = 'id, ticket_id, numbers, bonus_number, purchased_at, payment_status'
+        if after is not None:
+            sql = f'''
+            SELECT {columns} FROM tickets
+            WHERE user_id = ? AND (purchased_at, id) > (?, ?)
+            ORDER BY purchased_at ASC, id ASC LIMIT ?
+            '''
+            params = (user_id, _encode_timestamp(after[0]), after[1], limit)
+        elif before is not None:
+            sql = f'''
+            SELECT {columns} FROM tickets
+            WHERE user_id = ? AND (purchased_at, id) < (?, ?)
+            ORDER BY purchased_at DESC, id DESC LIMIT ?
+            '''
+            params = (user_id, _encode_timestamp(before[0]), before[1], limit)
+        else:
+            sql = f'''
+            SELECT {columns} FROM tickets WHERE user_id = ?
+            ORDER BY purchased_at DESC, id DESC LIMIT ?
+            '''
+            params = (user_id, limit)
+
+        def _ticket_page(conn):
+            return conn.execute(sql, params).fetchall()
+        return [
+            (row_id, ticket_id, _decode_numbers(numbers), bonus, datetime.strptime(purchased_at, TIMESTAMP_FORMAT), status)
+            for row_id, ticket_id, numbers, bonus, purchased_at, status in await self._run(_ticket_page)
+        ]
+
+    async def paid_batches(self, batch_ids):
+        def _paid_batches(conn):
+            return conn.execute('''
+            SELECT DISTINCT batch_id FROM tickets
+            WHERE batch_id IN (SELECT value FROM json_each(?)) AND payment_status = 'paid'
+            ''', (json.dumps(list(batch_ids)),)).fetchall()
+        return {row[0] for row in await self._run(_paid_batches)}
+
+    async def load_ingest_state(self, cursor_key):
+        def _load(conn):
+            saved = conn.execute(
+                'SELECT last_lt, last_hash FROM ton_ingest_cursor WHERE address = ?', (cursor_key,)
+            ).fetchone()
+            pending = conn.execute('''
+            SELECT batch_id, COUNT(*) FROM tickets
+            WHERE payment_status = 'pending' GROUP BY batch_id
+            ''').fetchall()
+            return saved, pending
+        return await self._run(_load)
+
+    async def mark_paid(self, batch_ids, cursor_key, lt, tx_hash, underpaid=()):
+        def _mark_paid(conn):
+            paid = set()
+            if batch_ids:
+                rows = conn.execute('''
+                UPDATE tickets SET payment_status = 'paid'
+                WHERE batch_id IN (SELECT value FROM json_each(?)) AND payment_status = 'pending'
+                RETURNING batch_id, draw_round, numbers
+                ''', (json.dumps(list(batch_ids)),)).fetchall()
+                paid = {row[0] for row in rows}
+                rounds, picks = _round_deltas(
+                    [(batch_id, draw_round, _decode_numbers(numbers)) for batch_id, draw_round, numbers in rows]
+                )
+                conn.executemany('''
+                INSERT INTO round_stats (draw_round, tickets_paid) VALUES (?, ?)
+                ON CONFLICT (draw_round) DO UPDATE SET tickets_paid = tickets_paid + excluded.tickets_paid
+                ''', rounds)
+                conn.executemany('''
+                INSERT INTO round_number_stats (draw_round, number, picks) VALUES (?, ?, ?)
+                ON CONFLICT (draw_round, number) DO UPDATE SET picks = picks + excluded.picks
+                ''', picks)
+            conn.executemany('''
+            INSERT INTO underpaid_transfers (tx_hash, lt, batch_id, sender, amount, expected) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (tx_hash) DO NOTHING
+            ''', underpaid)
+            conn.execute('''
+            INSERT INTO ton_ingest_cursor (address, last_lt, last_hash) VALUES (?, ?, ?)
+            ON CONFLICT (address) DO UPDATE SET last_lt = excluded.last_lt, last_hash = excluded.last_hash
+            ''', (cursor_key, lt, tx_hash))
+            return paid
+        return await self._run(_mark_paid)
+
+    async def round_stats(self, draw_round):
+        def _round_stats(conn):
+            key = draw_round.isoformat()
+            row = conn.execute('SELECT tickets_paid FROM round_stats WHERE draw_round = ?', (key,)).fetchone()
+            picks = conn.execute('SELECT number, picks FROM round_number_stats WHERE draw_round = ?', (key,)).fetchall()
+            return (row[0] if row else 0), dict(picks)
+        return await self._run(_round_stats)
+
+    async def expire_pending(self, cutoff, limit):
+        def _expire_pending(conn):
+            return conn.execute('''
+            DELETE FROM tickets
+            WHERE payment_status = 'pending' AND batch_id IN (
+                SELECT DISTINCT batch_id FROM tickets
+                WHERE payment_status = 'pending' AND purchased_at < ?
+                LIMIT ?
+            )
+            RETURNING batch_id
+            ''', (_encode_timestamp(cutoff), limit)).fetchall()
+        rows = await self._run(_expire_pending)
+        return {row[0] for row in rows}, len(rows)
+
+    async def commit_draw(self, draw_round, seed_hash, seed):
+        def _commit_draw(conn):
+            conn.execute('''
+            INSERT INTO draws (draw_round, seed_hash, seed) VALUES (?, ?, ?)
+            ON CONFLICT (draw_round) DO NOTHING
+            ''', (draw_round.isoformat(), seed_hash, seed))
+            return conn.execute('SELECT seed_hash FROM draws WHERE draw_round = ?', (draw_round.isoformat(),)).fetchone()[0]
+        return await self._run(_commit_draw)
+
+    async def get_draw(self, draw_round):
+        def _get_draw(conn):
+            return conn.execute(
+                'SELECT seed_hash, seed, numbers, bonus_number FROM draws WHERE draw_round = ?', (draw_round.isoformat(),)
+            ).fetchone()
+        row = await self._run(_get_draw)
+        if row is None:
+            return None
+        seed_hash, seed, numbers, bonus = row
+        return seed_hash, seed, _decode_numbers(numbers) if numbers else None, bonus
+
+    async def reveal_draw(self, draw_round, numbers, bonus, now):
+        def _reveal_draw(conn):
+            key = draw_round.isoformat()
+            conn.execute('''
+            UPDATE draws SET numbers = ?, bonus_number = ?, revealed_at = ?
+            WHERE draw_round = ? AND numbers IS NULL
+            ''', (_encode_numbers(numbers), bonus, _encode_timestamp(now), key))
+            return conn.execute('SELECT seed, numbers, bonus_number FROM draws WHERE draw_round = ?', (key,)).fetchone()
+        seed, numbers, bonus = await self._run(_reveal_draw)
+        return seed, _decode_numbers(numbers), bonus
+
+    async def unsettled_draws(self, draw_round):
+        def _unsettled_draws(conn):
+            return conn.execute('''
+            SELECT draw_round FROM draws WHERE settled_at IS NULL AND draw_round < ? ORDER BY draw_round
+            ''', (draw_round.isoformat(),)).fetchall()
+        return [date.fromisoformat(row[0]) for row in await self._run(_unsettled_draws)]
+
+    async def mark_draw_settled(self, draw_round, now):
+        def _mark_draw_settled(conn):
+            conn.execute(
+                'UPDATE draws SET settled_at = ? WHERE draw_round = ?', (_encode_timestamp(now), draw_round.isoformat())
+            )
+        await self._run(_mark_draw_settled)
+
+    async def round_tickets(self, draw_round):
+        def _round_tickets(conn):
+            return conn.execute('''
+            SELECT ticket_id, user_id, numbers, bonus_number FROM tickets
+            WHERE payment_status = 'paid' AND draw_round = ?
+            ''', (draw_round.isoformat(),)).fetchall()
+        return [(ticket_id, user_id, _decode_numbers(numbers), bonus)
+                for ticket_id, user_id, numbers, bonus in await self._run(_round_tickets)]
+
+    async def enqueue_outbox(self, campaign, rows, now):
+        encoded = [(campaign, chat_id, text, parse_mode, _encode_timestamp(now)) for chat_id, text, parse_mode in rows]
+
+        def _enqueue_outbox(conn):
+            before = conn.total_changes
+            conn.executemany('''
+            INSERT INTO outbox (campaign, chat_id, text, parse_mode, not_before) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (campaign, chat_id) DO NOTHING
+            ''', encoded)
+            return conn.total_changes - before
+        return await self._run(_enqueue_outbox)
+
+    async def claim_outbox(self, limit, now):
+        def _claim_outbox(conn):
+            return conn.execute('''
+            UPDATE outbox SET status = 'sending', attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM outbox
+                WHERE status = 'queued' AND not_before <= ?
+                ORDER BY not_before, id
+                LIMIT ?
+            )
+            RETURNING id, chat_id, text, parse_mode, attempts
+            ''', (_encode_timestamp(now), limit)).fetchall()
+        return sorted(await self._run(_claim_outbox))
+
+    async def requeue_outbox(self):
+        def _requeue_outbox(conn):
+            return conn.execute("UPDATE outbox SET status = 'queued' WHERE status = 'sending'").rowcount
+        return await self._run(_requeue_outbox)
+
+    async def complete_outbox(self, sent, retries, failures, now):
+        def _complete_outbox(conn):
+            conn.executemany(
+                "UPDATE outbox SET status = 'sent', sent_at = ?, error = NULL WHERE id = ?",
+                [(_encode_timestamp(now), message_id) for message_id in sent]
+            )
+            conn.executemany(
+                "UPDATE outbox SET status = 'queued', not_before = ?, error = ? WHERE id = ?",
+                [(_encode_timestamp(not_before), error, message_id) for message_id, not_before, error in retries]
+            )
+            conn.executemany(
+                "UPDATE outbox SET status = 'failed', error = ? WHERE id = ?",
+                [(error, message_id) for message_id, error in failures]
+            )
+        await self._run(_complete_outbox)
+
+    async def outbox_counts(self, campaign=None):
+        def _outbox_counts(conn):
+            if campaign is None:
+                return conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall()
+            return conn.execute(
+                'SELECT status, COUNT(*) FROM outbox WHERE campaign = ? GROUP BY status', (campaign,)
+            ).fetchall()
+        return dict(await self._run(_outbox_counts))
+
+    # Keyset pages on id: every chunk is its own short transaction, so the
+    # connection is never held between chunks (no snapshot across the export)
+    async def stream_tickets(self, draw_round=None, since=None, until=None, status=None, chunk_size=10_000):
+        where, params = _export_filters(
+            draw_round.isoformat() if draw_round is not None else None,
+            _encode_timestamp(since) if since is not None else None,
+            _encode_timestamp(until) if until is not None else None,
+            status, '?'
+        )
+        sql = f"SELECT id, {', '.join(EXPORT_COLUMNS)} FROM tickets WHERE id > ? AND {where} ORDER BY id LIMIT ?"
+        last_id = 0
+
+        def _export_tickets(conn):
+            return conn.execute(sql, [last_id, *params, chunk_size]).fetchall()
+
+        while True:
+            rows = await self._run(_export_tickets)
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [
+                (ticket_id, batch_id, user_id, username, _decode_numbers(numbers), bonus,
+                 datetime.fromisoformat(purchased_at), draw_round, payment_status)
+                for _id, ticket_id, batch_id, user_id, username, numbers, bonus, purchased_at, draw_round, payment_status
+                in rows
+            ]
+
+    async def load_context_data(self, kind, key):
+        table, column = CONTEXT_TABLES[kind]
+
+        def _load_context_data(conn):
+            return conn.execute(f'SELECT data FROM {table} WHERE {column} = ?', (key,)).fetchone()
+        row = await self._run(_load_context_data)
+        return json.loads(row[0]) if row else None
+
+    async def save_context_data(self, kind, rows, now):
+        table, column = CONTEXT_TABLES[kind]
+        updated_at = _encode_timestamp(now)
+
+        def _save_context_data(conn):
+            conn.executemany(f'''
+            INSERT INTO {table} ({column}, data, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT ({column}) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            ''', [(key, data, updated_at) for key, data in rows])
+        await self._run(_save_context_data)
+
+    async def drop_context_data(self, kind, keys):
+        table, column = CONTEXT_TABLES[kind]
+
+        def _drop_context_data(conn):
+            conn.execute(
+                f'DELETE FROM {table} WHERE {column} IN (SELECT value FROM json_each(?))', (json.dumps(list(keys)),)
+            )
+        await self._run(_drop_context_data)
+
+
+# Backend from DATABASE_URL: sqlite:///relative.db, sqlite:////absolute.db or
+# sqlite:// (in memory) for SQLite, anything else is a Postgres DSN
+def create_repository(database_url):
+    if database_url and database_url.startswith('sqlite:'):
+        path = database_url[len('sqlite:'):]
+        if path.startswith('///'):
+            path = path[3:]
+        elif path.startswith('//'):
+            path = path[2:]
+        return SQLiteRepository(path or ':memory:')
+    return PostgresRepository(Database(database_url))
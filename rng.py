@@ -0,0 +1,85 @@
+import os
+import hmac
+import hashlib
+import secrets
+
+import numpy as np
+
+MAX_NUMBER = 42
+PICK_COUNT = 6
+
+
+# Commit-reveal draw randomness.
+# Before the draw we publish sha256(seed); at draw time we reveal the seed and
+# anyone can recompute the numbers with draw_numbers(seed, draw_round).
+def new_seed():
+    return secrets.token_hex(32)
+
+
+def commitment(seed):
+    return hashlib.sha256(bytes.fromhex(seed)).hexdigest()
+
+
+def verify_commitment(seed, published):
+    return hmac.compare_digest(commitment(seed), published)
+
+
+# Deterministic byte stream: HMAC-SHA256(seed, "<round>:<counter>") blocks
+class _SeedStream:
+    def __init__(self, seed, draw_round):
+        self._key = bytes.fromhex(seed)
+        self._label = str(draw_round).encode()
+        self._counter = 0
+        self._buffer = b''
+
+    def read(self, n):
+        while len(self._buffer) < n:
+            block = hmac.new(self._key, self._label + b':' + str(self._counter).encode(), hashlib.sha256)
+            self._buffer += block.digest()
+            self._counter += 1
+        out, self._buffer = self._buffer[:n], self._buffer[n:]
+        return out
+
+    # Uniform integer in [0, bound) by rejection sampling 32-bit words
+    def below(self, bound):
+        limit = (1 << 32) - (1 << 32) % bound
+        while True:
+            value = int.from_bytes(self.read(4), 'big')
+            if value < limit:
+                return value % bound
+
+
+# The six numbers and bonus for a revealed seed (partial Fisher-Yates shuffle)
+def draw_numbers(seed, draw_round):
+    stream = _SeedStream(seed, draw_round)
+    pool = list(range(1, MAX_NUMBER + 1))
+    for i in range(PICK_COUNT):
+        j = i + stream.below(MAX_NUMBER - i)
+        pool[i], pool[j] = pool[j], pool[i]
+    bonus = 1 + stream.below(MAX_NUMBER)
+    return sorted(pool[:PICK_COUNT]), bonus
+
+
+# Player picks from the OS CSPRNG, many tickets per call.
+# Each row gets 42 random 64-bit keys; the positions of the six smallest keys
+# are a uniform 6-of-42 combination. Bonus numbers come from rejection-sampled
+# bytes so every value in 1..42 is equally likely.
+def sample_tickets(count):
+    keys = np.frombuffer(os.urandom(count * MAX_NUMBER * 8), dtype=np.uint64).reshape(count, MAX_NUMBER)
+    picks = np.argpartition(keys, PICK_COUNT, axis=1)[:, :PICK_COUNT]
+    picks.sort(axis=1)
+    return (picks + 1).astype(np.int16), sample_bonuses(count)
+
+
+def sample_bonuses(count):
+    limit = 256 - 256 % MAX_NUMBER
+    bonuses = np.empty(0, dtype=np.uint8)
+    while len(bonuses) < count:
+        raw = np.frombuffer(os.urandom(2 * (count - len(bonuses)) + 16), dtype=np.uint8)
+        bonuses = np.concatenate([bonuses, raw[raw < limit]])
+    return (bonuses[:count] % MAX_NUMBER + 1).astype(np.int16)
+
+
+def sample_ticket():
+    picks, bonuses = sample_tickets(1)
+    return picks[0].tolist(), int(bonuses[0])
@@ -0,0 +1,64 @@
+import os
+import time
+import logging
+from collections import namedtuple
+
+from draw import PRIZE_POOL_SHARE, next_draw_at
+from ton_ingest import NANOTON, TICKET_PRICE_NANOTON
+from rng import MAX_NUMBER
+
+logger = logging.getLogger(__name__)
+
+ROUND_STATS_INTERVAL = float(os.environ.get('ROUND_STATS_INTERVAL', '15'))
+
+# Immutable view of one round, replaced as a whole on every refresh
+RoundSnapshot = namedtuple('RoundSnapshot', 'draw_round tickets picks refreshed_at')
+
+
+# Live totals of the current round, read from the round_stats counters that
+# mark_paid maintains. Handlers only read the snapshot (no database access);
+# a job refreshes it every ROUND_STATS_INTERVAL seconds, so figures can lag
+# a payment by that much.
+class RoundStats:
+    def __init__(self, repo, price=TICKET_PRICE_NANOTON, share=PRIZE_POOL_SHARE):
+        self.repo = repo
+        self.price = price
+        self.share = share
+        self.snapshot = RoundSnapshot(next_draw_at().date(), 0, {}, 0.0)
+        self.refreshes = 0
+        self.errors = 0
+
+    async def refresh(self, now=None):
+        draw_round = next_draw_at(now).date()
+        try:
+            tickets, picks = await self.repo.round_stats(draw_round)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Could not refresh round stats: {e}")
+            return self.snapshot
+        self.snapshot = RoundSnapshot(draw_round, tickets, picks, time.monotonic())
+        self.refreshes += 1
+        return self.snapshot
+
+    # Prize pool of the current round, in TON
+    def pool_ton(self):
+        return self.snapshot.tickets * self.price * self.share / NANOTON
+
+    # [(number, times picked)], most picked first (least picked with hot=False)
+    def ranked_numbers(self, count=6, hot=True):
+        picks = self.snapshot.picks
+        ranked = sorted(
+            range(1, MAX_NUMBER + 1),
+            key=lambda number: (-picks.get(number, 0) if hot else picks.get(number, 0), number)
+        )
+        return [(number, picks.get(number, 0)) for number in ranked[:count]]
+
+    def stats(self):
+        snapshot = self.snapshot
+        return {
+            'tickets': snapshot.tickets,
+            'pool_ton': self.pool_ton(),
+            'age': time.monotonic() - snapshot.refreshed_at if snapshot.refreshed_at else 0.0,
+            'refreshes': self.refreshes,
+            'errors': self.errors,
+        }
@@ -0,0 +1,194 @@
+import re
+import time
+import logging
+
+from metrics import HANDLER_REQUESTS, HANDLER_ERRORS, HANDLER_LATENCY, current_flow
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidPayload(ValueError):
+    pass
+
+
+# Parameter parsers: turn the text after a prefix into handler arguments.
+# Each returns a tuple of positional arguments or raises InvalidPayload.
+
+# New snowflake IDs (TONLOTO_ + 13 base32 chars) and the older random_timestamp
+# form, optionally with a -N batch suffix
+TICKET_ID_RE = re.compile(r'^TONLOTO_(?:[0-9A-HJKMNP-TV-Z]{13}|\d{6}_\d{10})(?:-\d{1,3})?$')
+
+
+def ticket_id_param(payload):
+    if not TICKET_ID_RE.match(payload):
+        raise InvalidPayload(f"bad ticket id {payload!r}")
+    return (payload,)
+
+
+def int_param(choices=None):
+    def parse(payload):
+        if not payload.isdigit():
+            raise InvalidPayload(f"bad integer {payload!r}")
+        value = int(payload)
+        if choices is not None and value not in choices:
+            raise InvalidPayload(f"unexpected value {value}")
+        return (value,)
+    return parse
+
+
+def split_param(sep, count, pattern=None):
+    def parse(payload):
+        parts = payload.split(sep, count - 1)
+        if len(parts) != count or (pattern is not None and not pattern.match(payload)):
+            raise InvalidPayload(f"bad payload {payload!r}")
+        return tuple(parts)
+    return parse
+
+
+class Route:
+    def __init__(self, name, handler, parse=None, middleware=()):
+        self.name = name
+        self.handler = handler
+        self.parse = parse
+        self.middleware = list(middleware)
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    async def __call__(self, update, context, args):
+        async def call_handler():
+            return await self.handler(update, context, *args)
+
+        # Wrap the handler in this route's middleware, first one outermost
+        call = call_handler
+        for middleware in reversed(self.middleware):
+            call = _bind(middleware, self, update, context, call)
+        return await call()
+
+
+def _bind(middleware, route, update, context, call_next):
+    async def call():
+        return await middleware(route, update, context, call_next)
+    return call
+
+
+# Callback router: exact callback_data matches are one dict lookup; prefixed
+# payloads ("pay_<ticket_id>") are matched by walking a character trie, so
+# dispatch cost doesn't grow with the number of routes. Middleware runs as
+# middleware(route, update, context, call_next).
+class CallbackRouter:
+    def __init__(self, middleware=()):
+        self._exact = {}
+        self._trie = {}
+        self.middleware = list(middleware)
+        self.invalid = 0
+        self.unmatched = 0
+
+    def exact(self, data, handler, middleware=()):
+        self._exact[data] = Route(data, handler, middleware=self.middleware + list(middleware))
+
+    def prefix(self, prefix, handler, parse, middleware=()):
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = Route(prefix + '*', handler, parse, self.middleware + list(middleware))
+
+    def routes(self):
+        found = list(self._exact.values())
+        stack = [self._trie]
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if key is None:
+                    found.append(child)
+                else:
+                    stack.append(child)
+        return found
+
+    # Find the route for callback_data; returns (route, args) or (None, None)
+    def match(self, data):
+        route = self._exact.get(data)
+        if route is not None:
+            return route, ()
+
+        node, best, best_end = self._trie, None, 0
+        for i, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                best, best_end = node[None], i + 1
+        if best is None:
+            return None, None
+        return best, best.parse(data[best_end:])
+
+    # Bot API calls made while a route runs (middleware included) are counted
+    # against its handler's name, as in the handler metrics
+    async def dispatch(self, update, context):
+        data = update.callback_query.data or ''
+        try:
+            route, args = self.match(data)
+        except InvalidPayload as e:
+            self.invalid += 1
+            logger.warning(f"Rejected callback from user {update.callback_query.from_user.id}: {e}")
+            await update.callback_query.answer()
+            return None
+        if route is None:
+            self.unmatched += 1
+            logger.debug(f"No route for callback {data!r}")
+            await update.callback_query.answer()
+            return None
+        logger.debug(f"Callback {data!r} -> {route.name}")
+        flow = current_flow.set(route.handler.__name__)
+        try:
+            return await route(update, context, args)
+        finally:
+            current_flow.reset(flow)
+
+
+# Answer the query (stops the button's loading spinner) before the handler runs.
+# Middleware ahead of this one can still answer with a notice of its own.
+async def answer_middleware(route, update, context, call_next):
+    await update.callback_query.answer()
+    return await call_next()
+
+
+# Per-route call count, error count and latency; also exported per handler
+# function to /metrics (buy_ticket and buyn_* both count as buy_ticket)
+async def timing_middleware(route, update, context, call_next):
+    handler = route.handler.__name__
+    started = time.perf_counter()
+    HANDLER_REQUESTS.inc(handler=handler)
+    try:
+        return await call_next()
+    except Exception:
+        route.errors += 1
+        HANDLER_ERRORS.inc(handler=handler)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        route.calls += 1
+        route.total_time += elapsed
+        route.max_time = max(route.max_time, elapsed)
+        HANDLER_LATENCY.observe(elapsed, handler=handler)
+
+
+# Ignore repeats of the same route by the same user within `interval` seconds
+def cooldown_middleware(interval):
+    last_call = {}
+
+    async def cooldown(route, update, context, call_next):
+        key = (route.name, update.callback_query.from_user.id)
+        now = time.monotonic()
+        if now - last_call.get(key, -interval) < interval:
+            logger.debug(f"Cooldown: dropped {route.name} for user {key[1]}")
+            return None
+        last_call[key] = now
+        if len(last_call) > 100_000:
+            # Drop expired entries so the table stays bounded
+            for stale in [k for k, t in last_call.items() if now - t >= interval]:
+                del last_call[stale]
+        return await call_next()
+
+    return cooldown
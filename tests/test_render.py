@@ -0,0 +1,115 @@
+from datetime import date, datetime
+
+import numpy as np
+
+import render
+from draw import settle, encode_many, draw_messages
+from ids import IdGenerator
+from round_stats import RoundSnapshot
+
+
+# First problem Telegram's legacy Markdown parser would report, or None.
+# Entities can't nest: inside *bold* or _italic_ the other marker is literal,
+# and nothing is parsed inside `code` or ```pre```.
+def legacy_markdown_error(text):
+    entity = None
+    i = 0
+    while i < len(text):
+        if entity is None and text.startswith('```', i):
+            end = text.find('```', i + 3)
+            if end < 0:
+                return f"unclosed ``` at {i}"
+            i = end + 3
+            continue
+        char = text[i]
+        if entity is None and char == '`':
+            end = text.find('`', i + 1)
+            if end < 0:
+                return f"unclosed ` at {i}"
+            i = end + 1
+            continue
+        if char in '*_':
+            if entity is None:
+                entity = (char, i)
+            elif entity[0] == char:
+                entity = None
+        i += 1
+    if entity is not None:
+        return f"unclosed {entity[0]} at {entity[1]}"
+    return None
+
+
+def assert_markdown(screen):
+    assert screen.parse_mode == 'Markdown'
+    error = legacy_markdown_error(screen.text)
+    assert error is None, f"{error}: {screen.text!r}"
+
+
+def ticket_ids(count):
+    generator = IdGenerator(1)
+    batch_id = generator.next_id()
+    if count == 1:
+        return batch_id, [batch_id]
+    return batch_id, [f"{batch_id}-{i + 1}" for i in range(count)]
+
+
+def tickets(count):
+    batch_id, ids = ticket_ids(count)
+    return batch_id, [{'ticket_id': ticket_id, 'numbers': [3, 7, 12, 19, 33, 41], 'bonus': 5} for ticket_id in ids]
+
+
+def test_checker_rejects_a_bare_ticket_id():
+    assert legacy_markdown_error("📋 **Ticket ID:** TONLOTO_0ABCDEFGHJKMN") is not None
+    assert legacy_markdown_error("📋 **Ticket ID:** `TONLOTO_0ABCDEFGHJKMN`") is None
+
+
+def test_static_screens():
+    for screen in (render.CONNECT_TONKEEPER, render.CONNECT_TONHUB, render.WALLET_CONNECTED,
+                   render.BUY_MULTIPLE, render.CHECKING_PAYMENT, render.CHECKING_PAYMENT_AGAIN):
+        assert_markdown(screen)
+
+
+def test_purchase_screens():
+    for count in (1, 5, 25):
+        batch_id, batch = tickets(count)
+        assert_markdown(render.ticket_selection_screen(batch_id, batch))
+        assert_markdown(render.payment_instructions_screen(
+            batch_id, count, 123456789, 'UQDn-7fmd-goYxycJZuKBBkaBM2Hd8XJEVOqQyE_22892mXs'
+        ))
+        assert_markdown(render.payment_confirmed_screen(batch_id, batch))
+        assert_markdown(render.payment_not_received_screen(
+            batch_id, count, 'UQDn-7fmd-goYxycJZuKBBkaBM2Hd8XJEVOqQyE_22892mXs'
+        ))
+
+
+def test_ticket_page():
+    _, ids = ticket_ids(5)
+    rows = [
+        (i, ticket_id, [3, 7, 12, 19, 33, 41], 5, datetime(2026, 1, 3, 12, i), 'paid' if i % 2 else 'pending')
+        for i, ticket_id in enumerate(ids)
+    ]
+    screen = render.ticket_page_screen({'paid': 2, 'pending': 3}, rows, 'tickets_newer_a_b', 'tickets_older_c_d')
+    assert_markdown(screen)
+
+
+def test_hot_numbers():
+    empty = RoundSnapshot(date(2026, 1, 10), 0, {}, 0.0)
+    assert_markdown(render.hot_numbers_screen(empty, 0.0, [], []))
+    snapshot = RoundSnapshot(date(2026, 1, 10), 12, {7: 5, 12: 3}, 0.0)
+    assert_markdown(render.hot_numbers_screen(snapshot, 9.6, [(7, 5), (12, 3)], [(1, 0), (2, 0)]))
+
+
+def test_draw_messages():
+    picks = np.array([[1, 2, 3, 4, 5, 6], [1, 2, 3, 10, 11, 12], [20, 21, 22, 23, 24, 25]])
+    result = settle(encode_many(picks), np.array([7, 8, 9]), [1, 2, 3, 4, 5, 6], 7)
+    for _, text in draw_messages(datetime(2026, 1, 10, 20), np.array([11, 12, 12]), result):
+        error = legacy_markdown_error(text)
+        assert error is None, f"{error}: {text!r}"
+
+
+def test_draw_commitment():
+    seed_hash = 'ab' * 32
+    draw_at = datetime(2026, 1, 10, 20)
+    assert_markdown(render.draw_commitment_screen(draw_at, seed_hash))
+    previous = (date(2026, 1, 3), seed_hash, 'cd' * 32, [3, 7, 12, 19, 33, 41], 5)
+    assert_markdown(render.draw_commitment_screen(draw_at, seed_hash, previous))
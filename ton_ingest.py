@@ -0,0 +1,230 @@
+import os
+import asyncio
+import logging
+from dataclasses import dataclass
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+NANOTON = 1_000_000_000
+TICKET_PRICE_NANOTON = 1 * NANOTON
+
+TONCENTER_API_URL = os.environ.get('TONCENTER_API_URL', 'https://toncenter.com/api/v2')
+TONCENTER_API_KEY = os.environ.get('TONCENTER_API_KEY')
+TON_PAGE_SIZE = int(os.environ.get('TON_PAGE_SIZE', '100'))
+
+
+# An incoming transfer to the lottery wallet
+@dataclass(frozen=True)
+class Transaction:
+    lt: int
+    hash: str
+    memo: str
+    amount: int
+    sender: str = ''
+
+
+# Position in the wallet history: the last (lt, hash) that was processed
+@dataclass(frozen=True)
+class Cursor:
+    lt: int = 0
+    hash: str = ''
+
+
+# Transaction sources return incoming transfers newer than the cursor,
+# oldest first, at most `limit` per call
+class TransactionSource:
+    async def fetch(self, cursor, limit):
+        raise NotImplementedError
+
+    # Where a wallet without a saved cursor starts: Cursor() replays the
+    # whole history, which only sources with a short one should do
+    async def head(self):
+        return Cursor()
+
+    async def close(self):
+        pass
+
+
+# In-memory source for tests and local runs
+class FakeTransactionSource(TransactionSource):
+    def __init__(self):
+        self.transactions = []
+        self._lt = 0
+
+    # Simulate a transfer landing in the wallet
+    def pay(self, memo, amount=TICKET_PRICE_NANOTON, sender=''):
+        self._lt += 1
+        tx = Transaction(lt=self._lt, hash=f"fake{self._lt:016x}", memo=memo, amount=amount, sender=sender)
+        self.transactions.append(tx)
+        return tx
+
+    async def fetch(self, cursor, limit):
+        newer = [tx for tx in self.transactions if tx.lt > cursor.lt]
+        return newer[:limit]
+
+
+# toncenter v2 getTransactions. The API pages backwards from the newest
+# transaction, so walk back until we reach the cursor and return everything
+# newer than it in chronological order (`limit` is ignored here). A new
+# wallet cursor starts at the head (see head()), so the walk only covers
+# transfers since the previous pass, never the wallet's whole history.
+class TonCenterTransactionSource(TransactionSource):
+    def __init__(self, address, api_url=TONCENTER_API_URL, api_key=TONCENTER_API_KEY,
+                 page_size=TON_PAGE_SIZE):
+        self.address = address
+        self.page_size = page_size
+        headers = {'X-API-Key': api_key} if api_key else {}
+        self._client = httpx.AsyncClient(base_url=api_url, headers=headers, timeout=15)
+
+    async def head(self):
+        response = await self._client.get('/getTransactions', params={'address': self.address, 'limit': 1})
+        response.raise_for_status()
+        page = response.json().get('result', [])
+        if not page:
+            return Cursor()
+        tx_id = page[0]['transaction_id']
+        return Cursor(int(tx_id['lt']), tx_id['hash'])
+
+    async def fetch(self, cursor, limit):
+        collected = {}
+        params = {'address': self.address, 'limit': self.page_size, 'archival': 'true'}
+        if cursor.lt:
+            params['to_lt'] = cursor.lt
+
+        while True:
+            response = await self._client.get('/getTransactions', params=params)
+            response.raise_for_status()
+            page = response.json().get('result', [])
+
+            reached_cursor = False
+            for raw in page:
+                tx_id = raw['transaction_id']
+                lt = int(tx_id['lt'])
+                if lt <= cursor.lt:
+                    reached_cursor = True
+                    break
+                in_msg = raw.get('in_msg') or {}
+                # Only incoming transfers carry a ticket memo
+                if not in_msg.get('source'):
+                    continue
+                collected[lt] = Transaction(
+                    lt=lt,
+                    hash=tx_id['hash'],
+                    memo=(in_msg.get('message') or '').strip(),
+                    amount=int(in_msg.get('value') or 0),
+                    sender=in_msg['source'],
+                )
+
+            if reached_cursor or len(page) < self.page_size:
+                break
+            # Continue from the oldest transaction of this page
+            last = page[-1]['transaction_id']
+            params['lt'] = last['lt']
+            params['hash'] = last['hash']
+
+        return [collected[lt] for lt in sorted(collected)]
+
+    async def close(self):
+        await self._client.aclose()
+
+
+# Pick the transaction source from TON_SOURCE ('toncenter' or 'fake')
+def create_transaction_source(address):
+    kind = os.environ.get('TON_SOURCE', 'toncenter').lower()
+    if kind == 'fake':
+        logger.warning("Using the fake TON transaction source - payments must be simulated")
+        return FakeTransactionSource()
+    return TonCenterTransactionSource(address)
+
+
+# Batched payment ingestion.
+# Keeps an in-memory index memo -> ticket count of every pending batch (a
+# single ticket is a batch of one whose memo is its ticket ID), pages through
+# new wallet transactions from the stored cursor and settles all matched
+# batches with one bulk UPDATE per pass (cursor saved in the same
+# transaction), instead of one wallet lookup per ticket. Transfers that
+# match a batch but pay less than its price are stored in underpaid_transfers
+# (in that transaction too) for manual reconciliation; the batch stays pending.
+class PaymentIngestor:
+    def __init__(self, repo, source, address, price=TICKET_PRICE_NANOTON, page_limit=1000, cursor_key=None):
+        self.repo = repo
+        self.source = source
+        self.address = address
+        # Replicas each keep their own cursor so none skips past another's tickets
+        self.cursor_key = cursor_key or address
+        self.price = price
+        self.page_limit = page_limit
+        self.cursor = None
+        self._index = {}
+        self._lock = asyncio.Lock()
+
+    def watch(self, memo, tickets=1):
+        self._index[memo] = tickets
+
+    def unwatch(self, memo):
+        self._index.pop(memo, None)
+
+    def __len__(self):
+        return len(self._index)
+
+    # Load the saved cursor and every pending batch into the index. Without a
+    # saved cursor ingestion starts at the wallet's current head, saved right
+    # away; transfers before it are never scanned
+    async def load(self):
+        saved, pending = await self.repo.load_ingest_state(self.cursor_key)
+        if saved:
+            self.cursor = Cursor(*saved)
+        else:
+            self.cursor = await self.source.head()
+            if self.cursor.lt:
+                await self.repo.mark_paid([], self.cursor_key, self.cursor.lt, self.cursor.hash)
+                logger.info(f"No ingestion cursor for {self.cursor_key}: starting at the wallet head lt={self.cursor.lt}")
+        for memo, tickets in pending:
+            self.watch(memo, tickets)
+        logger.info(f"Payment ingestor loaded {len(pending)} pending batches from lt={self.cursor.lt}")
+
+    # One ingestion pass; returns the memos (batch IDs) that were marked paid
+    async def run_once(self):
+        async with self._lock:
+            if self.cursor is None:
+                await self.load()
+
+            settled = set()
+            while True:
+                fetched = await self.source.fetch(self.cursor, self.page_limit)
+                if not fetched:
+                    break
+                transactions = fetched[:self.page_limit]
+
+                matched, underpaid = [], []
+                for tx in transactions:
+                    tickets = self._index.get(tx.memo)
+                    if tickets is None:
+                        continue
+                    expected = self.price * tickets
+                    if tx.amount < expected:
+                        logger.warning(f"Underpaid transfer {tx.hash} for {tx.memo}: {tx.amount} of {expected} "
+                                       f"nanoton from {tx.sender or 'unknown'}, recorded for reconciliation")
+                        underpaid.append((tx.hash, tx.lt, tx.memo, tx.sender, tx.amount, expected))
+                        continue
+                    matched.append(tx.memo)
+
+                last = transactions[-1]
+                new_cursor = Cursor(last.lt, last.hash)
+                paid = await self.repo.mark_paid(
+                    matched, self.cursor_key, new_cursor.lt, new_cursor.hash, underpaid=underpaid
+                )
+                self.cursor = new_cursor
+
+                for memo in matched:
+                    self.unwatch(memo)
+                settled.update(paid)
+
+                if len(fetched) < self.page_limit:
+                    break
+
+            if settled:
+                logger.info(f"Payment ingestion settled {len(settled)} batches (cursor lt={self.cursor.lt})")
+            return settled
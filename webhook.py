@@ -0,0 +1,204 @@
+import os
+import re
+import json
+import hmac
+import zlib
+import asyncio
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+# Required: Telegram sends it with every update and replicas with every
+# forwarded one; 1-256 characters, letters, digits, '_' and '-' (Bot API rule)
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+SECRET_RE = re.compile(r'^[A-Za-z0-9_-]{1,256}$')
+MAX_BODY = 1 << 20
+
+
+# Replica that owns a user's updates, so one user is always served by one
+# process (where updates are handled in order) whichever replica received it
+def shard_for(update_data, shards):
+    user_id = update_user_id(update_data)
+    if user_id is None:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % shards
+
+
+def update_user_id(update_data):
+    for key in ('message', 'edited_message', 'callback_query', 'inline_query',
+                'chosen_inline_result', 'pre_checkout_query', 'shipping_query', 'my_chat_member'):
+        payload = update_data.get(key)
+        if payload and 'from' in payload:
+            return payload['from'].get('id')
+    return None
+
+
+# Minimal HTTP/1.1 webhook receiver.
+# Verifies the secret token header on every post (from Telegram or a peer
+# replica; there is no unauthenticated mode), answers 200 as soon as the update
+# is queued and, with several replicas, forwards updates it doesn't own to the
+# owning replica over one ordered stream per peer. stop() stops accepting
+# connections and lets in-flight requests finish.
+class WebhookServer:
+    def __init__(self, on_update, host='0.0.0.0', port=8080, path=WEBHOOK_PATH,
+                 secret=WEBHOOK_SECRET, shard_urls=None, shard_index=0):
+        if not SECRET_RE.match(secret or ''):
+            raise ValueError("WEBHOOK_SECRET must be 1-256 characters: letters, digits, '_' or '-'")
+        self.on_update = on_update
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.shard_urls = shard_urls or []
+        self.shard_index = shard_index
+        self.received = 0
+        self.forwarded = 0
+        self.rejected = 0
+        self._server = None
+        self._connections = set()
+        self._idle = set()
+        self._forward_queues = {}
+        self._forward_tasks = []
+        self._client = None
+
+    async def start(self):
+        if len(self.shard_urls) > 1:
+            self._client = httpx.AsyncClient(timeout=10)
+            for index, url in enumerate(self.shard_urls):
+                if index == self.shard_index:
+                    continue
+                queue = asyncio.Queue()
+                self._forward_queues[index] = queue
+                self._forward_tasks.append(asyncio.create_task(self._forward_worker(url, queue)))
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"Webhook server listening on {self.host}:{self.port}{self.path} "
+                    f"(shard {self.shard_index + 1}/{max(1, len(self.shard_urls))})")
+
+    async def stop(self, timeout=10):
+        if self._server is None:
+            return
+        self._server.close()
+        # Idle keep-alive connections can go now; busy ones finish their request
+        for writer in list(self._idle):
+            writer.close()
+        if self._connections:
+            _, unfinished = await asyncio.wait(list(self._connections), timeout=timeout)
+            for task in unfinished:
+                task.cancel()
+        await self._server.wait_closed()
+        for queue in self._forward_queues.values():
+            await queue.join()
+        for task in self._forward_tasks:
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+        self._server = None
+        logger.info(f"Webhook server stopped: received={self.received} "
+                    f"forwarded={self.forwarded} rejected={self.rejected}")
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                self._idle.add(writer)
+                request_line = await reader.readline()
+                self._idle.discard(writer)
+                if not request_line:
+                    break
+                keep_alive = await self._handle_request(request_line, reader, writer)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(task)
+            self._idle.discard(writer)
+            writer.close()
+
+    async def _handle_request(self, request_line, reader, writer):
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            await self._respond(writer, 400, keep_alive=False)
+            return False
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY:
+            await self._respond(writer, 413, keep_alive=False)
+            return False
+        body = await reader.readexactly(length) if length else b''
+        keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+        if target == '/healthz' and method == 'GET':
+            await self._respond(writer, 200, b'ok', keep_alive)
+            return keep_alive
+        if target != self.path:
+            await self._respond(writer, 404, keep_alive=keep_alive)
+            return keep_alive
+        if method != 'POST':
+            await self._respond(writer, 405, keep_alive=keep_alive)
+            return keep_alive
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, '').encode('latin-1'), self.secret.encode()):
+            self.rejected += 1
+            await self._respond(writer, 403, keep_alive=keep_alive)
+            return keep_alive
+
+        try:
+            update_data = json.loads(body)
+        except ValueError:
+            await self._respond(writer, 400, keep_alive=keep_alive)
+            return keep_alive
+
+        self.received += 1
+        owner = shard_for(update_data, len(self.shard_urls)) if len(self.shard_urls) > 1 else self.shard_index
+        if owner == self.shard_index:
+            await self.on_update(update_data)
+        else:
+            self.forwarded += 1
+            self._forward_queues[owner].put_nowait(body)
+
+        await self._respond(writer, 200, keep_alive=keep_alive)
+        return keep_alive
+
+    async def _respond(self, writer, status, body=b'', keep_alive=True):
+        reasons = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+                   405: 'Method Not Allowed', 413: 'Payload Too Large'}
+        writer.write(
+            f"HTTP/1.1 {status} {reasons.get(status, '')}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+
+    # One sequential stream per peer keeps each user's updates in order
+    async def _forward_worker(self, base_url, queue):
+        headers = {'Content-Type': 'application/json', SECRET_HEADER: self.secret}
+        url = base_url.rstrip('/') + self.path
+        while True:
+            body = await queue.get()
+            try:
+                for attempt in range(5):
+                    try:
+                        response = await self._client.post(url, content=body, headers=headers)
+                        if response.status_code < 500:
+                            break
+                    except httpx.HTTPError as e:
+                        logger.warning(f"Forwarding update to {base_url} failed: {e}")
+                    await asyncio.sleep(0.2 * 2 ** attempt)
+                else:
+                    logger.error(f"Dropping update after 5 attempts to forward it to {base_url}")
+            finally:
+                queue.task_done()